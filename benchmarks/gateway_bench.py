@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from proto import smart_city_pb2
+from devices.simulador import Simulator
+from web_client.backend.gateway_client import GatewayConnection, GatewayError
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GATEWAY_HOST = '127.0.0.1'
+GATEWAY_TCP_PORT = 10000
+GATEWAY_UDP_PORT = 10001
+
+STARTUP_TIMEOUT = 15.0 #segundos esperando o Gateway aceitar conexões
+REGISTRATION_TIMEOUT = 120.0
+INGEST_SETTLE_TIME = 1.0 #segundos para o Gateway esvaziar o buffer UDP depois da rajada
+DEFAULT_TOLERANCE = 0.2 #piora relativa aceita na comparação com um relatório anterior
+
+#métricas comparadas com o relatório de referência: caminho no relatório -> True se maior é melhor
+COMPARED_METRICS = {
+    ('registration', 'per_second'): True,
+    ('list_devices', 'p50_ms'): False,
+    ('list_devices', 'p99_ms'): False,
+    ('commands', 'p50_ms'): False,
+    ('commands', 'p99_ms'): False,
+    ('udp_ingest', 'readings_per_second'): True,
+    ('rss_kb', 'after_ingest'): False,
+}
+
+def percentiles(samples):
+    '''p50/p90/p99/máximo (em ms) de uma lista de durações em segundos, por posto mais próximo.'''
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    rank = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {
+        'p50_ms': round(rank(0.50) * 1000, 3),
+        'p90_ms': round(rank(0.90) * 1000, 3),
+        'p99_ms': round(rank(0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+def read_rss_kb(pid):
+    '''
+    Memória residente do processo e dos seus filhos (workers do Gateway) em kB
+    (Linux, /proc); None em outros sistemas.'''
+    total = None
+    try:
+        with open(f"/proc/{pid}/status", encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total = int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children", encoding='ascii') as f:
+            children = f.read().split()
+    except OSError:
+        return total
+    for child in children:
+        child_rss = read_rss_kb(child)
+        if child_rss is not None:
+            total += child_rss
+    return total
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex((GATEWAY_HOST, port)) == 0
+
+class GatewayProcess:
+    '''
+    Gateway executado num subprocesso (python -m gateway.gateway) com um diretório de
+    trabalho temporário, para que o histórico dos sensores de uma rodada não afete a outra.
+    A saída do Gateway vai para gateway.log nesse diretório.'''
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.workdir = tempfile.TemporaryDirectory(prefix='gateway_bench_')
+        self.process = None
+        self._log = None
+
+    def start(self):
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONUNBUFFERED='1')
+        self._log = open(os.path.join(self.workdir.name, 'gateway.log'), 'wb')
+        #sem limite de admissão: o registro mede a capacidade do Gateway, não a taxa configurada
+        command = [sys.executable, '-m', 'gateway.gateway', '--workers', str(self.workers),
+                   '--admission-rate', '0']
+        self.process = subprocess.Popen(command, cwd=self.workdir.name,
+                                        env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log is not None:
+            self._log.close()
+        self.workdir.cleanup()
+
+async def connect_client(gateway):
+    '''Conexão de cliente web com o Gateway recém-iniciado, tentando até ele aceitar.'''
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        if gateway.process.poll() is not None:
+            raise RuntimeError("O Gateway encerrou durante a inicialização.")
+        client = GatewayConnection(GATEWAY_HOST, GATEWAY_TCP_PORT)
+        try:
+            await client.connect()
+            request_proto = smart_city_pb2.ClientGatewayRequest()
+            request_proto.ping = "PING"
+            await client.request(request_proto)
+            return client
+        except (OSError, asyncio.TimeoutError, GatewayError):
+            await client.close()
+            if time.monotonic() > deadline:
+                raise RuntimeError("O Gateway não aceitou conexões a tempo.")
+            await asyncio.sleep(0.1)
+
+async def count_devices(client):
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.list_devices = "LIST"
+    response_proto = await client.request(request_proto)
+    return len(response_proto.devices)
+
+async def bench_registration(client, simulator):
+    '''Tempo desde a primeira conexão até o Gateway listar todos os dispositivos simulados.'''
+    total = len(simulator.devices)
+    started = time.perf_counter()
+    await simulator.start()
+    deadline = time.monotonic() + REGISTRATION_TIMEOUT
+    registered = await count_devices(client)
+    while registered < total and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        registered = await count_devices(client)
+    elapsed = time.perf_counter() - started
+    return {
+        'devices': total,
+        'registered': registered,
+        'failed_connections': simulator.stats.failed,
+        'seconds': round(elapsed, 3),
+        'per_second': round(registered / elapsed, 1),
+    }
+
+async def bench_list_devices(client, requests):
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.list_devices = "LIST"
+    samples = []
+    devices = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        response_proto = await client.request(request_proto)
+        samples.append(time.perf_counter() - started)
+        devices = len(response_proto.devices)
+    result = {'requests': requests, 'devices': devices, 'response_bytes': response_proto.ByteSize()}
+    result.update(percentiles(samples))
+    return result
+
+async def bench_commands(client, simulator, commands, rng):
+    '''Round-trip de command_device (envio, confirmação do poste e resposta ao cliente), um por vez.'''
+    if not simulator.lamps:
+        return {'commands': 0}
+    samples = []
+    outcomes = {}
+    for _ in range(commands):
+        lamp = rng.choice(simulator.lamps)
+        request_proto = smart_city_pb2.ClientGatewayRequest()
+        request_proto.command_device.device_id = lamp.id
+        request_proto.command_device.action = rng.choice(("TURN_ON", "TURN_OFF"))
+        started = time.perf_counter()
+        response_proto = await client.request(request_proto)
+        samples.append(time.perf_counter() - started)
+        for result in response_proto.command_results:
+            name = smart_city_pb2.CommandResult.Outcome.Name(result.outcome)
+            outcomes[name] = outcomes.get(name, 0) + 1
+    result = {'commands': commands, 'outcomes': outcomes}
+    result.update(percentiles(samples))
+    return result
+
+async def readings_stored(client, simulator, since_ms):
+    '''Leituras que o Gateway gravou no histórico desde since_ms, somando os agregados por minuto.'''
+    total = 0
+    for sensor in simulator.sensors:
+        request_proto = smart_city_pb2.ClientGatewayRequest()
+        request_proto.history.device_id = sensor.id
+        request_proto.history.from_ms = since_ms
+        request_proto.history.resolution = 'minute'
+        response_proto = await client.request(request_proto)
+        total += sum(response_proto.history.count)
+    return total
+
+async def bench_udp_ingest(client, simulator, duration, readings_per_batch):
+    '''
+    Envia lotes dos sensores o mais rápido possível por duration segundos e compara o
+    que foi enviado com o que chegou ao histórico do Gateway. Datagramas descartados
+    pelo kernel (buffer cheio) aparecem como perda.'''
+    if not simulator.sensors:
+        return {'datagrams_sent': 0}
+    #os agregados por minuto são filtrados pelo início do bucket
+    since_ms = int(time.time() * 1000) // 60000 * 60000
+    readings_before = simulator.stats.readings
+    started = time.perf_counter()
+    datagrams = await simulator.blast(duration, readings_per_batch)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(INGEST_SETTLE_TIME)
+
+    sent = simulator.stats.readings - readings_before
+    stored = await readings_stored(client, simulator, since_ms)
+    return {
+        'seconds': round(elapsed, 3),
+        'readings_per_batch': readings_per_batch,
+        'datagrams_sent': datagrams,
+        'readings_sent': sent,
+        'readings_stored': stored,
+        'loss': round(1 - stored / sent, 4) if sent else 0.0,
+        'readings_per_second': round(stored / elapsed, 1),
+    }
+
+async def run(args):
+    random.seed(args.seed) #leituras simuladas de sensor_temperatura usam o random global
+    rng = random.Random(args.seed)
+    gateway = GatewayProcess(args.workers)
+    gateway.start()
+    simulator = Simulator(args.lamps, args.sensors, GATEWAY_HOST, GATEWAY_TCP_PORT,
+                          GATEWAY_UDP_PORT, seed=args.seed, prefix="bench")
+    client = None
+    results = {}
+    try:
+        client = await connect_client(gateway)
+        rss = {'idle': read_rss_kb(gateway.pid)}
+
+        print(f"Benchmark: registrando {args.lamps} postes e {args.sensors} sensores...")
+        results['registration'] = await bench_registration(client, simulator)
+        rss['registered'] = read_rss_kb(gateway.pid)
+
+        print("Benchmark: medindo list_devices...")
+        results['list_devices'] = await bench_list_devices(client, args.list_requests)
+
+        print("Benchmark: medindo comandos...")
+        results['commands'] = await bench_commands(client, simulator, args.commands, rng)
+
+        print(f"Benchmark: rajada UDP por {args.ingest_seconds}s...")
+        results['udp_ingest'] = await bench_udp_ingest(
+            client, simulator, args.ingest_seconds, args.readings_per_batch)
+        rss['after_ingest'] = read_rss_kb(gateway.pid)
+        results['rss_kb'] = rss
+    finally:
+        if client is not None:
+            await client.close()
+        await simulator.close()
+        gateway.stop()
+    return results
+
+def compare(report, baseline, tolerance):
+    '''
+    Compara as métricas de COMPARED_METRICS com um relatório anterior e devolve as que
+    pioraram mais que tolerance (fração relativa), como linhas de texto.'''
+    regressions = []
+    for (section, metric), higher_is_better in COMPARED_METRICS.items():
+        current = report['results'].get(section, {}).get(metric)
+        previous = baseline['results'].get(section, {}).get(metric)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if higher_is_better else change
+        line = f"{section}.{metric}: {previous} -> {current} ({change:+.1%})"
+        print(f"Benchmark: {line}")
+        if worse > tolerance:
+            regressions.append(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta do Gateway com dispositivos simulados.")
+    parser.add_argument('--lamps', type=int, default=1000)
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--list-requests', type=int, default=200)
+    parser.add_argument('--commands', type=int, default=500)
+    parser.add_argument('--ingest-seconds', type=float, default=5.0)
+    parser.add_argument('--readings-per-batch', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1, help="processos do Gateway (--workers do gateway)")
+    parser.add_argument('--output', help="arquivo JSON do relatório (padrão: imprime na saída)")
+    parser.add_argument('--baseline', help="relatório anterior para comparação; sai com código 1 se houver regressão")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    if port_in_use(GATEWAY_TCP_PORT):
+        sys.exit(f"Benchmark: a porta {GATEWAY_TCP_PORT} já está em uso; encerre o Gateway antes de medir.")
+
+    params = {name: value for name, value in vars(args).items() if name not in ('output', 'baseline', 'tolerance')}
+    report = {
+        'benchmark': 'gateway',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'params': params,
+        'results': asyncio.run(run(args)),
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Benchmark: relatório gravado em {args.output}")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            sys.exit("Benchmark: regressões acima da tolerância:\n  " + "\n  ".join(regressions))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import socket
+import time
+from google.protobuf.message import DecodeError
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, encode_message
+from devices import atuador_poste, sensor_temperatura
+from gateway.ingest import MAX_DATAGRAM_SIZE, UDP_RCVBUF, SensorDecoder
+
+CHUNK = 1000 #datagramas enviados ao socket antes de cada rodada de leitura medida
+
+def legacy_decode(data, received_ms):
+    '''Decodificação anterior: duas mensagens protobuf novas por datagrama, lidas de bytes.'''
+    batch = smart_city_pb2.SensorBatch()
+    batch.ParseFromString(data)
+    if batch.values:
+        if len(batch.timestamp_deltas_ms) != len(batch.values):
+            raise DecodeError("SensorBatch com deltas e valores de tamanhos diferentes")
+        readings = []
+        timestamp = batch.base_timestamp_ms
+        for delta, value in zip(batch.timestamp_deltas_ms, batch.values):
+            timestamp += delta
+            readings.append((timestamp, value))
+        return batch.device_id, readings
+    sensor_data = smart_city_pb2.SensorData()
+    sensor_data.ParseFromString(data)
+    return sensor_data.device_id, [(received_ms, sensor_data.value)]
+
+def build_datagrams(count, batch_fraction, rng):
+    '''Datagramas de 1000 sensores: SensorData com uma leitura ou, na fração batch_fraction, SensorBatch de 10.'''
+    datagrams = []
+    now_ms = int(time.time() * 1000)
+    for i in range(count):
+        device_id = f"sensor_{i % 1000:05d}"
+        if rng.random() < batch_fraction:
+            samples = [(now_ms + k * 100, rng.uniform(20, 35)) for k in range(10)]
+            datagrams.append(sensor_temperatura.build_batch(samples, device_id=device_id).SerializeToString())
+        else:
+            datagrams.append(smart_city_pb2.SensorData(device_id=device_id, value=rng.uniform(20, 35)).SerializeToString())
+    return datagrams
+
+def bench_decode(datagrams):
+    received_ms = int(time.time() * 1000)
+    started = time.perf_counter()
+    for data in datagrams:
+        legacy_decode(data, received_ms)
+    legacy = time.perf_counter() - started
+
+    decode = SensorDecoder().decode
+    started = time.perf_counter()
+    for data in datagrams:
+        decode(data, received_ms)
+    current = time.perf_counter() - started
+    return legacy, current
+
+def bench_receive(datagrams):
+    '''Recebe e decodifica os datagramas por um socket UDP local, medindo só a leitura.'''
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    view = memoryview(bytearray(MAX_DATAGRAM_SIZE))
+    decode = SensorDecoder().decode
+
+    def legacy_round(count, received_ms):
+        for _ in range(count):
+            data, _ = receiver.recvfrom(MAX_DATAGRAM_SIZE)
+            legacy_decode(data, received_ms)
+
+    def current_round(count, received_ms):
+        for _ in range(count):
+            size = receiver.recv_into(view)
+            decode(view[:size], received_ms)
+
+    elapsed = {}
+    try:
+        for name, receive in (('legacy', legacy_round), ('current', current_round)):
+            total = 0.0
+            for start in range(0, len(datagrams), CHUNK):
+                chunk = datagrams[start:start + CHUNK]
+                for data in chunk:
+                    sender.sendto(data, address)
+                started = time.perf_counter()
+                receive(len(chunk), int(time.time() * 1000))
+                total += time.perf_counter() - started
+            elapsed[name] = total
+    finally:
+        sender.close()
+        receiver.close()
+    return elapsed['legacy'], elapsed['current']
+
+def bench_frames(count):
+    '''Frames TCP de heartbeats e estados de postes: cópia + mensagem nova por frame contra parse no buffer.'''
+    messages = [atuador_poste.build_heartbeat(f"lamp_{i:05d}") if i % 4 else
+                smart_city_pb2.DeviceMessage(discovery=atuador_poste.build_packet("ON", i, device_id=f"lamp_{i:05d}"))
+                for i in range(count)]
+    stream = b''.join(encode_message(message) for message in messages)
+
+    decoder = FrameDecoder()
+    decoder.feed(stream)
+    started = time.perf_counter()
+    for frame in decoder.frames():
+        smart_city_pb2.DeviceMessage().ParseFromString(frame)
+    legacy = time.perf_counter() - started
+
+    decoder = FrameDecoder()
+    decoder.feed(stream)
+    message = smart_city_pb2.DeviceMessage()
+    started = time.perf_counter()
+    while decoder.parse_next(message):
+        pass
+    current = time.perf_counter() - started
+    return legacy, current
+
+def rates(count, legacy, current):
+    return {
+        'legacy_per_second': round(count / legacy, 1),
+        'current_per_second': round(count / current, 1),
+        'speedup': round(legacy / current, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão de sensores: código anterior contra o atual, em pacotes por segundo.")
+    parser.add_argument('--datagrams', type=int, default=200000)
+    parser.add_argument('--batch-fraction', type=float, default=0.0,
+                        help="fração de datagramas SensorBatch (o resto é SensorData)")
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    datagrams = build_datagrams(args.datagrams, args.batch_fraction, random.Random(args.seed))
+    results = {
+        'udp_decode': rates(len(datagrams), *bench_decode(datagrams)),
+        'udp_receive': rates(len(datagrams), *bench_receive(datagrams)),
+        'tcp_frames': rates(args.frames, *bench_frames(args.frames)),
+    }
+    print(json.dumps({'benchmark': 'ingest', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from proto import smart_city_pb2
+from devices.simulador import ZONES
+from gateway.commands import CommandDispatcher
+from gateway.registry import DeviceRegistry
+from gateway.rules import RulesEngine, parse_rules
+
+def build_rules(device_rules, sensors):
+    '''Uma regra por zona (sensores da zona acima de 32°C acendem os postes da zona) e device_rules regras por id.'''
+    specs = [{
+        'name': f"calor_{zone}",
+        'when': {'type': 'TEMP_SENSOR', 'zone': zone, 'above': 32},
+        'then': {'action': 'TURN_ON', 'type': 'LAMP', 'zone': zone},
+        'otherwise': {'action': 'TURN_OFF', 'type': 'LAMP', 'zone': zone},
+    } for zone in ZONES]
+    specs += [{
+        'name': f"sensor_{i}",
+        'when': {'device_id': sensors[i], 'below': 21},
+        'then': {'action': 'TURN_ON', 'device_ids': [f"lamp_{i:05d}"]},
+    } for i in range(min(device_rules, len(sensors)))]
+    return parse_rules(specs)
+
+def populate(registry, sensors, lamps):
+    for i in range(lamps):
+        registry.register(f"lamp_{i:05d}", smart_city_pb2.DeviceType.LAMP, "OFF", ZONES[i % len(ZONES)],
+                          "10.0.0.1", 0, None)
+    ids = []
+    for i in range(sensors):
+        device_id = f"sensor_{i:05d}"
+        registry.register(device_id, smart_city_pb2.DeviceType.TEMP_SENSOR, "25°C", ZONES[i % len(ZONES)],
+                          "10.0.0.2", 0, None)
+        ids.append(device_id)
+    return ids
+
+def apply_updates(registry, updates):
+    started = time.perf_counter()
+    for device_id, value in updates:
+        registry.set_reading(device_id, value)
+    return time.perf_counter() - started
+
+async def run(args):
+    rng = random.Random(args.seed)
+    #mesmo registro e mesmas leituras com e sem o motor de regras, para isolar o custo dele
+    registry = DeviceRegistry()
+    sensors = populate(registry, args.sensors, args.lamps)
+    updates = [(rng.choice(sensors), round(rng.uniform(20, 35), 1)) for _ in range(args.updates)]
+    baseline = apply_updates(registry, updates)
+
+    engine = RulesEngine(registry, CommandDispatcher(registry), build_rules(args.device_rules, sensors))
+    with_rules = apply_updates(registry, updates)
+    evaluations = engine.evaluations
+    engine.close()
+    return {
+        'rules': len(engine.rules),
+        'updates': args.updates,
+        'evaluations': evaluations,
+        'evaluations_per_second': round(evaluations / with_rules, 1),
+        'updates_per_second': round(args.updates / with_rules, 1),
+        'overhead_us_per_update': round((with_rules - baseline) / args.updates * 1e6, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do motor de regras do Gateway (avaliações por segundo).")
+    parser.add_argument('--sensors', type=int, default=10000)
+    parser.add_argument('--lamps', type=int, default=10000)
+    parser.add_argument('--device-rules', type=int, default=1000, help="regras sobre um sensor específico")
+    parser.add_argument('--updates', type=int, default=500000, help="leituras aplicadas ao registro")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print(json.dumps({'benchmark': 'rules', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from google.protobuf.internal import api_implementation
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, encode_message, recv_frame
+from benchmarks.gateway_bench import GATEWAY_HOST, GATEWAY_TCP_PORT, REPO_ROOT, STARTUP_TIMEOUT, port_in_use
+from gateway.journal import RegistryJournal
+from gateway.registry import DeviceRegistry
+
+#módulos de entrada de cada processo do projeto
+ENTRY_POINTS = ('gateway.gateway', 'web_client.backend.main', 'devices.atuador_poste',
+                'devices.sensor_temperatura', 'devices.simulador')
+BACKEND_PORT = 8765
+POLL_INTERVAL = 0.002 #segundos entre tentativas de conexão
+
+def environment():
+    return dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE='1')
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 1)
+
+def bench_import(module, runs):
+    '''Tempo de um interpretador novo até terminar de importar o módulo (inclui o próprio Python).'''
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f"import {module}"], env=environment(), check=True)
+        samples.append(time.perf_counter() - started)
+    return median_ms(samples)
+
+def write_journal(directory, devices):
+    '''Journal com devices dispositivos, como o de um Gateway encerrado com eles conectados.'''
+    registry = DeviceRegistry()
+    for i in range(devices):
+        device_type = smart_city_pb2.DeviceType.LAMP if i % 2 else smart_city_pb2.DeviceType.TEMP_SENSOR
+        registry.register(f"device_{i:06d}", device_type, "OFF" if i % 2 else "25°C", "centro",
+                          "10.0.0.1", 0, None)
+    journal = RegistryJournal(registry, os.path.join(directory, 'data', 'registry'))
+    journal.load()
+    journal.close()
+
+def wait_connect(port, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"O processo na porta {port} encerrou durante a inicialização.")
+        try:
+            return socket.create_connection((GATEWAY_HOST, port), 1)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Nada aceitou conexões na porta {port} a tempo.")
+            time.sleep(POLL_INTERVAL)
+
+def ping(sock):
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.ping = "PING"
+    sock.sendall(encode_message(request_proto))
+    return recv_frame(sock, FrameDecoder()) is not None
+
+def bench_gateway(devices, runs):
+    '''
+    Do início do processo até o Gateway aceitar uma conexão e até responder um ping, com
+    o registro restaurado de um journal de devices dispositivos.'''
+    accept, answer = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix='startup_bench_') as workdir:
+            if devices:
+                write_journal(workdir, devices)
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, '-m', 'gateway.gateway', '--admission-rate', '0'],
+                                       cwd=workdir, env=environment(),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                with wait_connect(GATEWAY_TCP_PORT, process) as sock:
+                    accept.append(time.perf_counter() - started)
+                    ping(sock)
+                    answer.append(time.perf_counter() - started)
+            finally:
+                process.terminate()
+                process.wait()
+    return {'accept_ms': median_ms(accept), 'ping_ms': median_ms(answer)}
+
+def bench_backend(runs):
+    '''Do início do uvicorn até o backend responder uma requisição HTTP (sem Gateway no ar).'''
+    samples = []
+    request = f"GET /api/aggregates HTTP/1.1\r\nHost: {GATEWAY_HOST}\r\nConnection: close\r\n\r\n".encode()
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'web_client.backend.main:app',
+                                    '--port', str(BACKEND_PORT), '--log-level', 'warning'],
+                                   cwd=REPO_ROOT, env=environment(),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            with wait_connect(BACKEND_PORT, process) as sock:
+                sock.sendall(request)
+                sock.recv(64)
+                samples.append(time.perf_counter() - started)
+        finally:
+            process.terminate()
+            process.wait()
+    return {'http_ms': median_ms(samples)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de inicialização de cada processo do projeto.")
+    parser.add_argument('--runs', type=int, default=5, help="execuções de cada medida (vale a mediana)")
+    parser.add_argument('--devices', type=int, default=20000,
+                        help="dispositivos no journal restaurado pelo Gateway")
+    args = parser.parse_args()
+    if port_in_use(GATEWAY_TCP_PORT) or port_in_use(BACKEND_PORT):
+        sys.exit(f"Benchmark: as portas {GATEWAY_TCP_PORT} e {BACKEND_PORT} precisam estar livres.")
+
+    results = {
+        'protobuf_backend': api_implementation.Type(),
+        'python_ms': bench_import('sys', args.runs),
+        'import_ms': {module: bench_import(module, args.runs) for module in ENTRY_POINTS},
+        'gateway_empty': bench_gateway(0, args.runs),
+        'gateway_restored': bench_gateway(args.devices, args.runs),
+        'backend': bench_backend(args.runs),
+    }
+    print(json.dumps({'benchmark': 'startup', 'params': vars(args), 'results': results}, indent=2))
+
+if __name__ == "__main__":
+    main()
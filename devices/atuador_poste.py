@@ -2,43 +2,76 @@ import socket
 import struct
 import time 
 from proto import smart_city_pb2
+from proto.cluster import owner_address
+from proto.discovery import STABLE_CONNECTION, backoff_delay, connect_delay, should_answer
+from proto.framing import FrameDecoder, encode_message, recv_frame
 
 MCAST_GRP = '224.1.1.1'
 MCAST_PORT = 5007
-GATEWAY_TCP_PORT = 10000
 
 DEVICE_ID = "lamp_01"
 DEVICE_IP = "192.168.0.102"
 DEVICE_PORT = 20002
+DEVICE_ZONE = "centro"
+HEARTBEAT_INTERVAL = 5 #segundos entre heartbeats enviados ao Gateway
 
 status = "OFF"
 
+def build_packet(status, correlation_id=0, device_id=DEVICE_ID, zone=DEVICE_ZONE, ip=DEVICE_IP, port=DEVICE_PORT):
+    '''DiscoveryPacket do atuador: usado no registro e, com correlation_id, como confirmação de comando.'''
+    packet = smart_city_pb2.DiscoveryPacket()
+    packet.info.id = device_id
+    packet.info.type = smart_city_pb2.DeviceType.LAMP
+    packet.info.status = status
+    packet.info.zone = zone
+    packet.ip_address = ip
+    packet.port = port
+    packet.correlation_id = correlation_id
+    return packet
+
+def build_heartbeat(device_id=DEVICE_ID):
+    message = smart_city_pb2.DeviceMessage()
+    message.heartbeat.device_id = device_id
+    message.heartbeat.interval_ms = int(HEARTBEAT_INTERVAL * 1000)
+    return message
+
+def apply_command(status, command):
+    '''Novo status do poste depois de um Command; ações desconhecidas mantêm o status.'''
+    if command.action in ["TURN_ON", "TURN_OFF"]:
+        return command.action.replace("TURN_", "")
+    return status
+
 def handle_commands(conn):
     global status
+    decoder = FrameDecoder()
+    next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
     try:
         while True:
-            data = conn.recv(1024)
-            if not data:
+            #espera comandos até a hora do próximo heartbeat
+            conn.settimeout(max(0.01, next_heartbeat - time.monotonic()))
+            try:
+                data = recv_frame(conn, decoder)
+            except socket.timeout:
+                conn.sendall(encode_message(build_heartbeat()))
+                next_heartbeat += HEARTBEAT_INTERVAL
+                continue
+            if data is None:
                 print(f"{DEVICE_ID}: Gateway fechou a conexão.")
                 break
             
             command = smart_city_pb2.Command()
             command.ParseFromString(data)
             
-            if command.action in ["TURN_ON", "TURN_OFF"]:
-                status = command.action.replace("TURN_", "")
+            new_status = apply_command(status, command)
+            if new_status != status:
+                status = new_status
                 print(f"{DEVICE_ID}: Status alterado para {status}")
+            
+            #responde todo comando com o estado atual, ecoando o correlation_id como confirmação
+            conn.sendall(encode_message(smart_city_pb2.DeviceMessage(
+                discovery=build_packet(status, command.correlation_id))))
                 
-                response_packet = smart_city_pb2.DiscoveryPacket()
-                response_packet.info.id = DEVICE_ID
-                response_packet.info.type = smart_city_pb2.DeviceType.LAMP
-                response_packet.info.status = status
-                response_packet.ip_address = DEVICE_IP
-                response_packet.port = DEVICE_PORT
-                
-                conn.send(response_packet.SerializeToString())
-                
-    except ConnectionResetError:
+    except ConnectionError:
         print(f"{DEVICE_ID}: Conexão com Gateway perdida.")
     finally:
         conn.close()
@@ -52,34 +85,40 @@ def listen_for_discovery():
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
     print(f"{DEVICE_ID}: Aguardando descoberta...")
-    data, addr = sock.recvfrom(1024)
-    gateway_ip = addr[0]
-    
     request = smart_city_pb2.GatewayRequest()
-    request.ParseFromString(data)
+    #anúncios de outros nós do cluster, ou de um Gateway que já tem este poste, são ignorados
+    while True:
+        data, addr = sock.recvfrom(65535)
+        request.ParseFromString(data)
+        if request.action == "DISCOVER" and should_answer(request, DEVICE_ID):
+            break
+    sock.close()
+    gateway_ip = addr[0]
 
-    if request.action == "DISCOVER":
-        print(f"{DEVICE_ID}: Gateway em {gateway_ip}. Conectando via TCP...")
-        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            tcp_sock.connect((gateway_ip, GATEWAY_TCP_PORT))
-            
-            packet = smart_city_pb2.DiscoveryPacket()
-            packet.info.id = DEVICE_ID
-            packet.info.type = smart_city_pb2.DeviceType.LAMP
-            packet.info.status = status
-            packet.ip_address = DEVICE_IP
-            packet.port = DEVICE_PORT
-            
-            tcp_sock.send(packet.SerializeToString())
-            handle_commands(tcp_sock)
-        except Exception as e:
-            print(f"Falha ao conectar com o Gateway: {e}")
-        finally:
-            tcp_sock.close()
+    #espera um tempo sorteado na janela anunciada, para não chegar junto com os outros dispositivos
+    time.sleep(connect_delay(request))
+
+    #em cluster, conecta direto ao nó dono deste poste no anel de hash
+    host, tcp_port, _ = owner_address(request, gateway_ip, DEVICE_ID)
+    print(f"{DEVICE_ID}: Gateway em {host}:{tcp_port}. Conectando via TCP...")
+    tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    connected_at = time.monotonic()
+    try:
+        tcp_sock.connect((host, tcp_port))
+        
+        tcp_sock.sendall(encode_message(smart_city_pb2.DeviceMessage(discovery=build_packet(status))))
+        handle_commands(tcp_sock)
+    except Exception as e:
+        print(f"Falha ao conectar com o Gateway: {e}")
+    finally:
+        tcp_sock.close()
+    return time.monotonic() - connected_at >= STABLE_CONNECTION
 
 if __name__ == "__main__":
+    attempt = 0
     while True:
-        listen_for_discovery()
-        print(f"{DEVICE_ID}: Desconectado. Tentando se reconectar em 10 segundos...")
-        time.sleep(10)
\ No newline at end of file
+        #conexão recusada ou que caiu logo: a espera dobra a cada vez (com jitter) até BACKOFF_CAP
+        attempt = 0 if listen_for_discovery() else attempt + 1
+        delay = backoff_delay(attempt)
+        print(f"{DEVICE_ID}: Desconectado. Tentando se reconectar em {delay:.1f} segundos...")
+        time.sleep(delay)
\ No newline at end of file
@@ -3,39 +3,84 @@ import struct
 import time
 import random
 from proto import smart_city_pb2
+from proto.cluster import owner_address
+from proto.discovery import STABLE_CONNECTION, backoff_delay, connect_delay, should_answer
+from proto.framing import encode_message
 
 MCAST_GRP = '224.1.1.1'
 MCAST_PORT = 5007
-GATEWAY_IP = '127.0.0.1'
-GATEWAY_UDP_port = 10001
-GATEWAY_TCP_PORT = 10000
 
 DEVICE_ID = "temp_sensor_01"
 DEVICE_IP = "192.168.0.101"
 DEVICE_PORT = 20001
+DEVICE_ZONE = "centro"
 
-def send_data_periodically(tcp_conn):
+SAMPLE_RATE_HZ = 10 #leituras por segundo
+BATCH_INTERVAL = 1.0 #segundos entre envios; cada envio leva todas as leituras do intervalo
+HEARTBEAT_INTERVAL = 5 #segundos entre heartbeats enviados ao Gateway pela conexão TCP
+
+def read_temperature(last):
+    '''Simula o sensor: pequena variação em torno da leitura anterior, entre 20 e 35°C.'''
+    return min(35.0, max(20.0, last + random.uniform(-0.2, 0.2)))
+
+def build_packet(temp, device_id=DEVICE_ID, zone=DEVICE_ZONE, ip=DEVICE_IP, port=DEVICE_PORT):
+    '''DiscoveryPacket com que o sensor se registra no Gateway.'''
+    packet = smart_city_pb2.DiscoveryPacket()
+    packet.info.id = device_id
+    packet.info.type = smart_city_pb2.DeviceType.TEMP_SENSOR
+    packet.info.status = f"{int(temp)}°C"
+    packet.info.zone = zone
+    packet.ip_address = ip
+    packet.port = port
+    return packet
+
+def build_heartbeat(device_id=DEVICE_ID):
+    message = smart_city_pb2.DeviceMessage()
+    message.heartbeat.device_id = device_id
+    message.heartbeat.interval_ms = int(HEARTBEAT_INTERVAL * 1000)
+    return message
+
+def build_batch(samples, device_id=DEVICE_ID):
+    '''Monta um SensorBatch com os instantes codificados como deltas em milissegundos.'''
+    batch = smart_city_pb2.SensorBatch()
+    batch.device_id = device_id
+    batch.base_timestamp_ms = samples[0][0]
+    previous = samples[0][0]
+    for timestamp, value in samples:
+        batch.timestamp_deltas_ms.append(timestamp - previous)
+        batch.values.append(value)
+        previous = timestamp
+    return batch
+
+def send_data_periodically(tcp_conn, udp_address):
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    temp = random.uniform(20, 35)
+    samples = []
+    next_send = time.monotonic() + BATCH_INTERVAL
+    next_heartbeat = time.monotonic()
     while True:
-        try:          
-            tcp_conn.send(b'')
-        except Exception as e:
-            print(f"{DEVICE_ID}: Conexão com Gateway perdida. {e}")
-            return 
+        temp = read_temperature(temp)
+        samples.append((int(time.time() * 1000), temp))
 
-        temp = random.randint(20, 35)
-        
-        data = smart_city_pb2.SensorData()
-        data.device_id = DEVICE_ID
-        data.value = temp
-        
-        try:
-            udp_sock.sendto(data.SerializeToString(), (GATEWAY_IP, GATEWAY_UDP_port))
-            print(f"{DEVICE_ID}: Enviado {temp}°C para o Gateway.")
-        except Exception as e:
-            print(f"{DEVICE_ID}: Falha ao enviar dados UDP. {e}")
-            break
-        time.sleep(15)
+        #o heartbeat mantém o registro no Gateway; se a conexão caiu, o envio falha
+        if time.monotonic() >= next_heartbeat:
+            try:
+                tcp_conn.sendall(encode_message(build_heartbeat()))
+            except OSError as e:
+                print(f"{DEVICE_ID}: Conexão com Gateway perdida. {e}")
+                return
+            next_heartbeat += HEARTBEAT_INTERVAL
+
+        if time.monotonic() >= next_send:
+            try:
+                udp_sock.sendto(build_batch(samples).SerializeToString(), udp_address)
+                print(f"{DEVICE_ID}: Enviadas {len(samples)} leituras, última {temp:.1f}°C.")
+            except Exception as e:
+                print(f"{DEVICE_ID}: Falha ao enviar dados UDP. {e}")
+                break
+            samples = []
+            next_send += BATCH_INTERVAL
+        time.sleep(1 / SAMPLE_RATE_HZ)
 
 def listen_for_discovery():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -46,35 +91,41 @@ def listen_for_discovery():
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
 
     print(f"{DEVICE_ID}: Aguardando descoberta...")
-    data, addr = sock.recvfrom(1024)
+    request = smart_city_pb2.GatewayRequest()
+    #anúncios de outros nós do cluster, ou de um Gateway que já tem este sensor, são ignorados
+    while True:
+        data, addr = sock.recvfrom(65535)
+        request.ParseFromString(data)
+        if request.action == "DISCOVER" and should_answer(request, DEVICE_ID):
+            break
+    sock.close()
     
     gateway_ip = addr[0]
-    
-    request = smart_city_pb2.GatewayRequest()
-    request.ParseFromString(data)
 
-    if request.action == "DISCOVER":
-        print(f"{DEVICE_ID}: Gateway em {gateway_ip}. Conectando via TCP...")
-        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            tcp_sock.connect((gateway_ip, GATEWAY_TCP_PORT))
-            
-            packet = smart_city_pb2.DiscoveryPacket()
-            packet.info.id = DEVICE_ID
-            packet.info.type = smart_city_pb2.DeviceType.TEMP_SENSOR
-            packet.info.status = f"{random.randint(20, 35)}°C"
-            packet.ip_address = DEVICE_IP
-            packet.port = DEVICE_PORT
-            
-            tcp_sock.send(packet.SerializeToString())
-            send_data_periodically(tcp_sock)
-        except Exception as e:
-            print(f"Falha ao conectar com o Gateway: {e}")
-        finally:
-            tcp_sock.close()
+    #espera um tempo sorteado na janela anunciada, para não chegar junto com os outros dispositivos
+    time.sleep(connect_delay(request))
+
+    #em cluster, o dono deste sensor no anel de hash recebe tanto a conexão quanto os dados
+    host, tcp_port, udp_port = owner_address(request, gateway_ip, DEVICE_ID)
+    print(f"{DEVICE_ID}: Gateway em {host}:{tcp_port}. Conectando via TCP...")
+    tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    connected_at = time.monotonic()
+    try:
+        tcp_sock.connect((host, tcp_port))
+        
+        tcp_sock.sendall(encode_message(smart_city_pb2.DeviceMessage(discovery=build_packet(random.uniform(20, 35)))))
+        send_data_periodically(tcp_sock, (host, udp_port))
+    except Exception as e:
+        print(f"Falha ao conectar com o Gateway: {e}")
+    finally:
+        tcp_sock.close()
+    return time.monotonic() - connected_at >= STABLE_CONNECTION
 
 if __name__ == "__main__":
+    attempt = 0
     while True:
-        listen_for_discovery()
-        print(f"{DEVICE_ID}: Desconectado. Tentando se reconectar em 10 segundos...")
-        time.sleep(10)
\ No newline at end of file
+        #conexão recusada ou que caiu logo: a espera dobra a cada vez (com jitter) até BACKOFF_CAP
+        attempt = 0 if listen_for_discovery() else attempt + 1
+        delay = backoff_delay(attempt)
+        print(f"{DEVICE_ID}: Desconectado. Tentando se reconectar em {delay:.1f} segundos...")
+        time.sleep(delay)
\ No newline at end of file
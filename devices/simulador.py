@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import random
+import socket
+import time
+from proto import smart_city_pb2
+from proto.cluster import HashRing, parse_nodes
+from proto.discovery import STABLE_CONNECTION, backoff_delay
+from proto.framing import FrameDecoder, encode_message, read_frame
+from proto.limits import raise_fd_limit
+from devices import atuador_poste, sensor_temperatura
+
+GATEWAY_HOST = '127.0.0.1'
+GATEWAY_TCP_PORT = 10000
+GATEWAY_UDP_PORT = 10001
+
+#o Gateway trata conexões vindas de 127.0.0.1 como clientes web, então na mesma
+#máquina os dispositivos simulados se conectam a partir de outro endereço de loopback
+LOCAL_SOURCE_IP = '127.0.0.2'
+
+CONNECT_CONCURRENCY = 256 #conexões abertas em paralelo durante o registro
+ZONES = ("centro", "norte", "sul", "leste", "oeste")
+STATS_INTERVAL = 10 #segundos entre relatórios no modo interativo
+HEARTBEAT_INTERVAL = sensor_temperatura.HEARTBEAT_INTERVAL
+
+class SimulatorStats:
+    '''Contadores do simulador.'''
+
+    __slots__ = ('connected', 'failed', 'disconnected', 'reconnects', 'commands', 'datagrams', 'readings')
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0 #conexões recusadas ou registros que não chegaram a ser enviados
+        self.disconnected = 0 #conexões encerradas pelo Gateway (inclusive pelo limite de admissão)
+        self.reconnects = 0 #registros refeitos depois de uma queda ou falha
+        self.commands = 0 #comandos recebidos pelos postes
+        self.datagrams = 0
+        self.readings = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class SimulatedLamp:
+    '''Um poste virtual: mesmo registro e mesmo tratamento de comandos de atuador_poste.'''
+
+    def __init__(self, device_id, zone):
+        self.id = device_id
+        self.zone = zone
+        self.status = "OFF"
+        self.writer = None
+
+    async def register(self, simulator):
+        reader, writer = await simulator.open_connection(self.id)
+        self.writer = writer
+        ip, port = writer.get_extra_info('sockname')[:2]
+        writer.write(encode_message(smart_city_pb2.DeviceMessage(discovery=atuador_poste.build_packet(
+            self.status, device_id=self.id, zone=self.zone, ip=ip, port=port))))
+        await writer.drain()
+        return reader
+
+    def heartbeat(self):
+        return atuador_poste.build_heartbeat(self.id)
+
+    async def serve(self, simulator, reader):
+        '''Responde aos comandos até o Gateway fechar a conexão.'''
+        decoder = FrameDecoder()
+        ip, port = self.writer.get_extra_info('sockname')[:2]
+        command = smart_city_pb2.Command()
+        while True:
+            data = await read_frame(reader, decoder)
+            if data is None:
+                break
+            command.ParseFromString(data)
+            simulator.stats.commands += 1
+            self.status = atuador_poste.apply_command(self.status, command)
+            self.writer.write(encode_message(smart_city_pb2.DeviceMessage(discovery=atuador_poste.build_packet(
+                self.status, command.correlation_id, device_id=self.id, zone=self.zone, ip=ip, port=port))))
+
+class SimulatedSensor:
+    '''Um sensor virtual: registra-se por TCP como sensor_temperatura e envia lotes de leituras por UDP.'''
+
+    def __init__(self, device_id, zone, temp):
+        self.id = device_id
+        self.zone = zone
+        self.temp = temp
+        self.writer = None
+
+    async def register(self, simulator):
+        reader, writer = await simulator.open_connection(self.id)
+        self.writer = writer
+        ip, port = writer.get_extra_info('sockname')[:2]
+        writer.write(encode_message(smart_city_pb2.DeviceMessage(discovery=sensor_temperatura.build_packet(
+            self.temp, device_id=self.id, zone=self.zone, ip=ip, port=port))))
+        await writer.drain()
+        return reader
+
+    def heartbeat(self):
+        return sensor_temperatura.build_heartbeat(self.id)
+
+    async def serve(self, simulator, reader):
+        #o Gateway não envia nada aos sensores; a leitura só detecta o fechamento da conexão
+        while await reader.read(4096):
+            pass
+
+    def batch(self, count, interval_ms, now_ms):
+        '''SensorBatch com count leituras espaçadas de interval_ms, terminando em now_ms.'''
+        samples = []
+        start = now_ms - (count - 1) * interval_ms
+        for i in range(count):
+            self.temp = sensor_temperatura.read_temperature(self.temp)
+            samples.append((start + i * interval_ms, self.temp))
+        return sensor_temperatura.build_batch(samples, device_id=self.id)
+
+class Simulator:
+    '''
+    Milhares de postes e sensores virtuais num único processo, sobre asyncio:
+        - cada dispositivo tem sua própria conexão TCP com o Gateway e se registra com o
+         mesmo DiscoveryPacket dos scripts de dispositivo (a descoberta por multicast é
+         dispensada: o endereço do Gateway é informado diretamente);
+        - os postes respondem aos comandos com apply_command/build_packet de atuador_poste;
+        - os sensores compartilham um socket UDP e enviam SensorBatch como sensor_temperatura;
+        - uma única tarefa envia os heartbeats de todos os dispositivos, a cada
+         HEARTBEAT_INTERVAL; sem ela (heartbeats=False) o Gateway expira os dispositivos;
+        - com nodes (lista de nós de um cluster), cada dispositivo se conecta e envia
+         leituras ao nó dono do seu id no anel de hash, como fazem os scripts ao receber
+         o DISCOVER com a lista de nós;
+        - com reconnect, um dispositivo cuja conexão falhou ou caiu (Gateway reiniciado,
+         conexão recusada pelo limite de admissão) tenta de novo com o mesmo backoff
+         exponencial com jitter dos scripts.
+
+    A geração de leituras tem dois modos: run_sensors() imita o ritmo dos sensores reais
+    (sample_rate_hz leituras por segundo, enviadas a cada batch_interval) e blast() envia
+    lotes o mais rápido possível, para medir a vazão da ingestão.'''
+
+    def __init__(self, lamps, sensors, host=GATEWAY_HOST, tcp_port=GATEWAY_TCP_PORT,
+                 udp_port=GATEWAY_UDP_PORT, source_ip=None, seed=None, prefix="sim", heartbeats=True,
+                 nodes=None, reconnect=True):
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        if source_ip is None and host in ('127.0.0.1', 'localhost'):
+            source_ip = LOCAL_SOURCE_IP
+        self.source_ip = source_ip
+        self.random = random.Random(seed)
+        self.stats = SimulatorStats()
+        self.lamps = [SimulatedLamp(f"{prefix}_lamp_{i:05d}", ZONES[i % len(ZONES)]) for i in range(lamps)]
+        self.sensors = [SimulatedSensor(f"{prefix}_sensor_{i:05d}", ZONES[i % len(ZONES)],
+                                        self.random.uniform(20, 35)) for i in range(sensors)]
+        self.heartbeats = heartbeats
+        self.reconnect = reconnect
+        self.ring = HashRing(nodes or [])
+        self._udp_addresses = {} #id do sensor -> (host, porta UDP) do seu Gateway
+        self._tasks = set()
+        self._udp_sock = None
+        self._heartbeat_task = None
+        self._semaphore = None
+
+    @property
+    def devices(self):
+        return self.lamps + self.sensors
+
+    def address(self, device_id):
+        '''(host, porta TCP, porta UDP) do Gateway responsável pelo dispositivo.'''
+        node = self.ring.owner(device_id)
+        if node is None:
+            return self.host, self.tcp_port, self.udp_port
+        return node.host or self.host, node.tcp_port, node.udp_port
+
+    async def open_connection(self, device_id):
+        host, tcp_port, _ = self.address(device_id)
+        local_addr = (self.source_ip, 0) if self.source_ip else None
+        return await asyncio.open_connection(host, tcp_port, local_addr=local_addr)
+
+    async def _connect(self, device):
+        '''Registra o dispositivo; devolve o reader da conexão, ou None se ela falhou.'''
+        async with self._semaphore:
+            try:
+                reader = await device.register(self)
+            except OSError:
+                self.stats.failed += 1
+                return None
+        self.stats.connected += 1
+        return reader
+
+    async def _start_device(self, device):
+        reader = await self._connect(device)
+        if reader is not None or self.reconnect:
+            task = asyncio.create_task(self._serve(device, reader))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _serve(self, device, reader):
+        attempt = 0
+        while True:
+            connected_at = time.monotonic()
+            if reader is not None:
+                try:
+                    await device.serve(self, reader)
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    device.writer.close()
+                self.stats.disconnected += 1
+            if not self.reconnect:
+                return
+            stable = reader is not None and time.monotonic() - connected_at >= STABLE_CONNECTION
+            attempt = 0 if stable else attempt + 1
+            await asyncio.sleep(backoff_delay(attempt, rng=self.random))
+            reader = await self._connect(device)
+            if reader is not None:
+                self.stats.reconnects += 1
+
+    async def start(self, concurrency=CONNECT_CONCURRENCY):
+        '''Conecta e registra todos os dispositivos; retorna quando todos enviaram o registro.'''
+        raise_fd_limit()
+        self._udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.source_ip:
+            self._udp_sock.bind((self.source_ip, 0))
+        for sensor in self.sensors:
+            host, _, udp_port = self.address(sensor.id)
+            self._udp_addresses[sensor.id] = (host, udp_port)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(self._start_device(device) for device in self.devices))
+        if self.heartbeats:
+            self._heartbeat_task = asyncio.create_task(self._send_heartbeats())
+
+    async def _send_heartbeats(self):
+        frames = [(device, encode_message(device.heartbeat())) for device in self.devices]
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for i, (device, frame) in enumerate(frames):
+                if device.writer is not None and not device.writer.is_closing():
+                    device.writer.write(frame)
+                if i % 256 == 255:
+                    await asyncio.sleep(0)
+
+    def _send(self, batch):
+        self._udp_sock.sendto(batch.SerializeToString(), self._udp_addresses[batch.device_id])
+        self.stats.datagrams += 1
+        self.stats.readings += len(batch.values)
+
+    async def run_sensors(self, sample_rate_hz=sensor_temperatura.SAMPLE_RATE_HZ,
+                          batch_interval=sensor_temperatura.BATCH_INTERVAL):
+        '''Envia, a cada batch_interval, um lote por sensor com as leituras do intervalo.'''
+        count = max(1, int(sample_rate_hz * batch_interval))
+        interval_ms = int(1000 / sample_rate_hz)
+        while True:
+            now_ms = int(time.time() * 1000)
+            for i, sensor in enumerate(self.sensors):
+                self._send(sensor.batch(count, interval_ms, now_ms))
+                if i % 256 == 255:
+                    await asyncio.sleep(0)
+            await asyncio.sleep(batch_interval)
+
+    async def blast(self, duration, readings_per_batch=10):
+        '''Envia lotes dos sensores, em rodízio, o mais rápido possível por duration segundos.'''
+        if not self.sensors:
+            return 0
+        datagrams = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            now_ms = int(time.time() * 1000)
+            for sensor in self.sensors:
+                self._send(sensor.batch(readings_per_batch, 1, now_ms))
+                datagrams += 1
+                if datagrams % 256 == 0:
+                    await asyncio.sleep(0)
+                    if time.monotonic() >= deadline:
+                        break
+        return datagrams
+
+    async def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        for device in self.devices:
+            if device.writer is not None:
+                device.writer.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._udp_sock is not None:
+            self._udp_sock.close()
+            self._udp_sock = None
+
+async def main(args):
+    simulator = Simulator(args.lamps, args.sensors, args.host, args.tcp_port, args.udp_port,
+                          args.source_ip, args.seed, args.prefix, not args.no_heartbeat,
+                          parse_nodes(args.cluster), not args.no_reconnect)
+    started = time.perf_counter()
+    await simulator.start(args.concurrency)
+    print(f"Simulador: {simulator.stats.connected} dispositivos registrados em "
+          f"{time.perf_counter() - started:.2f}s ({simulator.stats.failed} falhas).")
+
+    sensors_task = asyncio.create_task(simulator.run_sensors(args.sample_rate, args.batch_interval))
+    try:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            print(f"Simulador: {simulator.stats.as_dict()}")
+    finally:
+        sensors_task.cancel()
+        await simulator.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simula postes e sensores conectados ao Gateway.")
+    parser.add_argument('--lamps', type=int, default=1000)
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--host', default=GATEWAY_HOST)
+    parser.add_argument('--tcp-port', type=int, default=GATEWAY_TCP_PORT)
+    parser.add_argument('--udp-port', type=int, default=GATEWAY_UDP_PORT)
+    parser.add_argument('--source-ip', help=f"endereço local das conexões (padrão {LOCAL_SOURCE_IP} quando o Gateway é local)")
+    parser.add_argument('--concurrency', type=int, default=CONNECT_CONCURRENCY)
+    parser.add_argument('--sample-rate', type=float, default=sensor_temperatura.SAMPLE_RATE_HZ)
+    parser.add_argument('--batch-interval', type=float, default=sensor_temperatura.BATCH_INTERVAL)
+    parser.add_argument('--prefix', default="sim", help="prefixo dos ids dos dispositivos")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--cluster', default="",
+                        help="nós de um cluster (nome=host:porta_tcp:porta_udp,...); substitui --host e as portas")
+    parser.add_argument('--no-heartbeat', action='store_true',
+                        help="não envia heartbeats (os dispositivos devem expirar no Gateway)")
+    parser.add_argument('--no-reconnect', action='store_true',
+                        help="não reconecta os dispositivos cuja conexão caiu")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,196 @@
+import heapq
+from collections import Counter
+from proto import smart_city_pb2
+
+LAMP = smart_city_pb2.DeviceType.LAMP
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+UNKNOWN = smart_city_pb2.DeviceType.UNKNOWN
+
+ALL_ZONES = "*" #zona da consulta que pede uma entrada por zona
+
+class GroupStats:
+    '''
+    Contadores de um grupo (um tipo numa zona, ou o tipo inteiro). As leituras ficam em
+    décimos de grau inteiros: a soma é exata, sem o erro que somar e subtrair floats
+    acumularia em milhões de atualizações. Para o mínimo e o máximo, o Counter diz quais
+    valores ainda existem e dois heaps com remoção preguiçosa dão o próximo extremo
+    quando o último sensor no atual sai: O(log n) amortizado por atualização, sem
+    percorrer os sensores nem os valores distintos.'''
+
+    __slots__ = ('count', 'pending', 'on', 'off', 'readings', 'total', 'values', 'min', 'max',
+                 '_low', '_high')
+
+    def __init__(self):
+        self.count = 0
+        self.pending = 0
+        self.on = 0
+        self.off = 0
+        self.readings = 0 #sensores com leitura
+        self.total = 0 #soma das leituras, em décimos
+        self.values = Counter() #leitura em décimos -> quantos sensores estão nela
+        self.min = None
+        self.max = None
+        self._low = [] #heap dos valores distintos; pode ter valores que já saíram de values
+        self._high = [] #o mesmo, com os valores negados
+
+    def _push(self, tenths):
+        if len(self._low) > 2 * len(self.values) + 16:
+            #valores que saíram sem chegar ao topo só acumulam: reconstruir custa o que já entrou
+            self._low = list(self.values)
+            heapq.heapify(self._low)
+            self._high = [-value for value in self.values]
+            heapq.heapify(self._high)
+        heapq.heappush(self._low, tenths)
+        heapq.heappush(self._high, -tenths)
+
+    def add(self, contribution):
+        pending, lamp_on, tenths = contribution
+        self.count += 1
+        if pending:
+            self.pending += 1
+        elif lamp_on is not None:
+            if lamp_on:
+                self.on += 1
+            else:
+                self.off += 1
+        elif tenths is not None:
+            self.readings += 1
+            self.total += tenths
+            if not self.values[tenths]:
+                self._push(tenths)
+            self.values[tenths] += 1
+            if self.min is None or tenths < self.min:
+                self.min = tenths
+            if self.max is None or tenths > self.max:
+                self.max = tenths
+
+    def discard(self, contribution):
+        pending, lamp_on, tenths = contribution
+        self.count -= 1
+        if pending:
+            self.pending -= 1
+        elif lamp_on is not None:
+            if lamp_on:
+                self.on -= 1
+            else:
+                self.off -= 1
+        elif tenths is not None:
+            self.readings -= 1
+            self.total -= tenths
+            left = self.values[tenths] - 1
+            if left:
+                self.values[tenths] = left
+                return
+            del self.values[tenths]
+            #só sair o último sensor no extremo obriga a procurar o novo, no topo do heap
+            if tenths == self.min:
+                low = self._low
+                while low and low[0] not in self.values:
+                    heapq.heappop(low)
+                self.min = low[0] if low else None
+            if tenths == self.max:
+                high = self._high
+                while high and -high[0] not in self.values:
+                    heapq.heappop(high)
+                self.max = -high[0] if high else None
+
+    def fill(self, aggregate_proto, device_type, zone):
+        aggregate_proto.type = device_type
+        aggregate_proto.zone = zone
+        aggregate_proto.count = self.count
+        aggregate_proto.pending = self.pending
+        aggregate_proto.on = self.on
+        aggregate_proto.off = self.off
+        aggregate_proto.readings = self.readings
+        if self.readings:
+            aggregate_proto.mean = self.total / self.readings / 10
+            aggregate_proto.min = self.min / 10
+            aggregate_proto.max = self.max / 10
+
+def contribution(record):
+    '''(pendente, poste ligado, leitura em décimos) de um registro; None onde não se aplica.'''
+    if record.pending:
+        return (True, None, None)
+    if record.type == LAMP:
+        return (False, bool(record.status), None)
+    if record.type == TEMP_SENSOR and record.status is not None:
+        return (False, None, round(record.status * 10))
+    return (False, None, None)
+
+class Aggregates:
+    '''
+    Agregados do registro por tipo e por zona, mantidos a cada mudança em vez de
+    calculados a cada consulta:
+        - é listener do registro, e cada mudança tira a contribuição anterior do
+         dispositivo dos dois grupos dele ((tipo, zona) e (tipo, "")) e soma a nova,
+         em tempo constante;
+        - guarda a contribuição de cada id, porque o listener só vê o registro já
+         alterado (uma leitura nova chega no mesmo DeviceRecord);
+        - dispositivos pendentes (restaurados do journal) entram em count e pending, mas
+         não em on/off nem nas leituras: o estado deles é o último antes do reinício.
+
+    Uma consulta custa o número de grupos pedidos, não o de dispositivos.'''
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._groups = {} #(tipo, zona) -> GroupStats; zona "" é o total do tipo
+        self._devices = {} #id -> (tipo, zona, contribuição, GroupStats dos grupos do dispositivo)
+        for record in registry:
+            self.on_change(record, False)
+        registry.add_listener(self.on_change)
+
+    def on_change(self, record, removed):
+        previous = self._devices.get(record.id)
+        new = None if removed else contribution(record)
+        if previous is not None:
+            device_type, zone, old, groups = previous
+            if new is not None and device_type == record.type and zone == record.zone:
+                #caso comum, uma leitura ou um poste que mudou: os grupos são os mesmos
+                if new != old:
+                    for group in groups:
+                        group.discard(old)
+                        group.add(new)
+                    self._devices[record.id] = (device_type, zone, new, groups)
+                return
+            for key, group in zip(self._keys(device_type, zone), groups):
+                group.discard(old)
+                if not group.count:
+                    #zonas que deixaram de existir não ficam para trás nas consultas
+                    del self._groups[key]
+            del self._devices[record.id]
+        if new is None:
+            return
+        groups = []
+        for key in self._keys(record.type, record.zone):
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = GroupStats()
+            group.add(new)
+            groups.append(group)
+        self._devices[record.id] = (record.type, record.zone, new, tuple(groups))
+
+    @staticmethod
+    def _keys(device_type, zone):
+        #um dispositivo sem zona só entra no total do tipo
+        return ((device_type, zone), (device_type, "")) if zone else ((device_type, ""),)
+
+    def query(self, device_type=UNKNOWN, zone=""):
+        '''
+        [((tipo, zona), GroupStats)] pedidos: device_type UNKNOWN = todos os tipos; zone ""
+        = o total de cada tipo, ALL_ZONES = cada zona, ou uma zona específica.'''
+        matches = []
+        for (group_type, group_zone), group in self._groups.items():
+            if device_type != UNKNOWN and group_type != device_type:
+                continue
+            if zone == ALL_ZONES:
+                if not group_zone:
+                    continue
+            elif group_zone != zone:
+                continue
+            matches.append(((group_type, group_zone), group))
+        matches.sort(key=lambda item: item[0])
+        return matches
+
+    def fill(self, response_proto, query_proto):
+        for (device_type, zone), group in self.query(query_proto.type, query_proto.zone):
+            group.fill(response_proto.aggregates.add(), device_type, zone)
@@ -0,0 +1,58 @@
+import argparse
+import signal
+import subprocess
+import sys
+import time
+from proto.cluster import Node
+
+BASE_TCP_PORT = 10000
+PORT_STEP = 10 #nó i usa BASE_TCP_PORT + i * PORT_STEP (TCP) e a porta seguinte (UDP)
+BASE_METRICS_PORT = 9100
+
+def cluster_nodes(count, host="", base_port=BASE_TCP_PORT):
+    return [Node(f"node{i}", host, base_port + i * PORT_STEP, base_port + i * PORT_STEP + 1)
+            for i in range(count)]
+
+def format_nodes(nodes, default_host=""):
+    return ','.join(f"{node.name}={node.host or default_host}:{node.tcp_port}:{node.udp_port}" for node in nodes)
+
+def main():
+    '''
+    Inicia um cluster de Gateways locais, um processo por nó, e espera até Ctrl+C.
+    Todos os nós recebem a mesma lista (--cluster) e anunciam essa lista no DISCOVER.
+    Imprime o valor de GATEWAY_NODES que o backend deve usar para falar com o cluster.'''
+    parser = argparse.ArgumentParser(description="Inicia vários nós do Gateway nesta máquina.")
+    parser.add_argument('--nodes', type=int, default=2)
+    parser.add_argument('--host', default="", help="host anunciado aos dispositivos (vazio = endereço do anúncio)")
+    parser.add_argument('--base-port', type=int, default=BASE_TCP_PORT)
+    parser.add_argument('--workers', type=int, default=1, help="workers de cada nó (--workers do gateway)")
+    args = parser.parse_args()
+
+    nodes = cluster_nodes(args.nodes, args.host, args.base_port)
+    spec = format_nodes(nodes)
+    processes = []
+    for i, node in enumerate(nodes):
+        processes.append(subprocess.Popen([
+            sys.executable, '-m', 'gateway.gateway', '--cluster', spec, '--node', node.name,
+            '--metrics-port', str(BASE_METRICS_PORT + i), '--workers', str(args.workers)]))
+        print(f"Cluster: {node.name} em TCP {node.tcp_port}, UDP {node.udp_port}, métricas {BASE_METRICS_PORT + i}")
+    print(f"Cluster: para o backend, GATEWAY_NODES={format_nodes(nodes, '127.0.0.1')}")
+
+    try:
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        print("Cluster: um dos nós encerrou; parando os demais.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from proto import smart_city_pb2
+from proto.framing import encode_message
+from gateway import metrics
+
+OUTBOX_SIZE = 64 #frames aguardando envio por dispositivo
+DEFAULT_COMMAND_TIMEOUT_MS = 2000
+MAX_COMMAND_TIMEOUT_MS = 30000
+PEER_TIMEOUT_MARGIN = 1 #segundos a mais esperando outro worker, que responde TIMEOUT por dispositivo
+
+Outcome = smart_city_pb2.CommandResult.Outcome
+
+log = logging.getLogger('gateway.commands')
+
+def command_timeout_ms(timeout_ms):
+    '''Timeout efetivo de um comando: o pedido, ou o padrão, limitado a MAX_COMMAND_TIMEOUT_MS.'''
+    return min(timeout_ms or DEFAULT_COMMAND_TIMEOUT_MS, MAX_COMMAND_TIMEOUT_MS)
+
+class DeviceOutbox:
+    '''
+    Fila de saída de uma conexão de dispositivo. Uma única tarefa escreve no socket,
+    então comandos de vários clientes web nunca se intercalam na mesma conexão, e
+    um dispositivo lento só acumula até OUTBOX_SIZE frames antes de recusar novos.'''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._queue = asyncio.Queue(OUTBOX_SIZE)
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, message):
+        '''Enfileira uma mensagem; devolve False se a fila estiver cheia.'''
+        try:
+            self._queue.put_nowait(encode_message(message))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _run(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                self.writer.write(frame)
+                await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, OSError):
+            self.writer.close()
+
+    def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+class CommandDispatcher:
+    '''
+    Envia comandos aos dispositivos e espera a confirmação de cada um:
+        - cada Command recebe um correlation_id e uma Future pendente;
+        - o atuador responde com um DiscoveryPacket que ecoa o correlation_id, e
+         acknowledge() resolve a Future com o status informado. A confirmação só vale se
+         vier do dispositivo que recebeu o comando, pela conexão dele: outro dispositivo
+         que ecoe ou adivinhe o id não resolve o comando alheio;
+        - sem resposta dentro do timeout, o resultado é TIMEOUT;
+        - se a conexão do dispositivo cai antes da resposta, drop() falha os comandos
+         dela na hora, com NOT_CONNECTED, em vez de deixá-los esperar o timeout.
+    send_bulk dispara o mesmo comando para um grupo de dispositivos em paralelo e
+    devolve um CommandResult por dispositivo.
+
+    No modo --workers, peers é o WorkerLink: os comandos de dispositivos conectados a
+    outro worker são encaminhados a ele, agrupados por worker.'''
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.peers = None
+        self._pending = {} #correlation_id -> (id do dispositivo, Future)
+        self._by_device = {} #id do dispositivo -> {correlation_id: outbox pela qual o comando saiu}
+        self._last_id = 0
+
+    def _next_id(self):
+        self._last_id = self._last_id % 0xFFFFFFFF + 1
+        return self._last_id
+
+    def acknowledge(self, device_id, packet):
+        '''
+        Chamado para cada DiscoveryPacket recebido pela conexão do dispositivo device_id;
+        resolve o comando correspondente, se houver e se foi enviado a esse dispositivo.'''
+        entry = self._pending.get(packet.correlation_id)
+        if entry is None:
+            return
+        target, future = entry
+        if device_id != target or packet.info.id != target:
+            log.warning("Confirmação do comando %d, enviado a %s, recebida da conexão de %s como %s; ignorada.",
+                        packet.correlation_id, target, device_id, packet.info.id)
+            return
+        del self._pending[packet.correlation_id]
+        if not future.done():
+            future.set_result(packet.info.status)
+
+    def drop(self, device_id, outbox=None):
+        '''
+        Chamado quando a conexão de um dispositivo cai: falha os comandos dele que
+        aguardam confirmação. Se outbox for informado, só os enviados por essa conexão,
+        como em registry.remove: os de uma conexão nova do mesmo dispositivo continuam.'''
+        for correlation_id, sent_by in self._by_device.get(device_id, {}).items():
+            future = self._pending[correlation_id][1]
+            if (outbox is None or sent_by is outbox) and not future.done():
+                future.set_exception(ConnectionError())
+
+    def _remote_worker(self, device_id):
+        '''Worker que tem a conexão do dispositivo, se ela não estiver neste processo.'''
+        record = self.registry.get(device_id)
+        if self.peers is not None and record is not None and record.outbox is None \
+                and record.worker != self.peers.worker:
+            return record.worker
+        return 0
+
+    async def send(self, device_id, action, timeout_ms=0):
+        worker = self._remote_worker(device_id)
+        if worker:
+            return (await self._send_remote(worker, [device_id], action, timeout_ms))[0]
+        return await self.send_local(device_id, action, timeout_ms)
+
+    async def send_local(self, device_id, action, timeout_ms=0):
+        '''Envia o comando pela conexão deste processo, sem encaminhar a outro worker.'''
+        result = await self._send(device_id, action, timeout_ms)
+        metrics.COMMANDS.labels(Outcome.Name(result.outcome)).inc()
+        return result
+
+    async def _send_remote(self, worker, device_ids, action, timeout_ms):
+        request = smart_city_pb2.ClientGatewayRequest()
+        request.bulk_command.action = action
+        request.bulk_command.device_ids.extend(device_ids)
+        request.bulk_command.timeout_ms = timeout_ms
+        timeout = command_timeout_ms(timeout_ms) / 1000 + PEER_TIMEOUT_MARGIN
+        response = (await self.peers.call(worker, request, timeout)).get(worker)
+        #pelo id, não pela posição: uma resposta de erro do worker não traz resultado nenhum
+        answered = {} if response is None else {result.device_id: result for result in response.command_results}
+
+        results = []
+        for device_id in device_ids:
+            result = answered.get(device_id)
+            if result is None:
+                result = smart_city_pb2.CommandResult()
+                result.device_id = device_id
+                if response is None:
+                    result.outcome = Outcome.TIMEOUT
+                    result.message = f"O worker {worker} não respondeu pelo dispositivo {device_id}."
+                else:
+                    result.outcome = Outcome.NOT_CONNECTED
+                    result.message = f"O worker {worker} não enviou o comando a {device_id}: " \
+                                     f"{response.status.message or 'sem resultado'}."
+            results.append(result)
+        return results
+
+    async def _send(self, device_id, action, timeout_ms):
+        result = smart_city_pb2.CommandResult()
+        result.device_id = device_id
+        record = self.registry.get(device_id)
+        if record is None or record.outbox is None:
+            result.outcome = Outcome.NOT_CONNECTED
+            if record is not None and record.pending:
+                result.message = f"Dispositivo {device_id} ainda não reconectou após o reinício do Gateway."
+            else:
+                result.message = f"Dispositivo {device_id} não está conectado."
+            return result
+
+        command = smart_city_pb2.Command()
+        command.device_id = device_id
+        command.action = action
+        command.correlation_id = self._next_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command.correlation_id] = (device_id, future)
+        self._by_device.setdefault(device_id, {})[command.correlation_id] = record.outbox
+
+        timeout_ms = command_timeout_ms(timeout_ms)
+        try:
+            if not record.outbox.send(command):
+                result.outcome = Outcome.QUEUE_FULL
+                result.message = f"Fila de comandos de {device_id} está cheia."
+                return result
+            started = time.perf_counter()
+            result.status = await asyncio.wait_for(future, timeout_ms / 1000)
+            metrics.COMMAND_ROUND_TRIP_SECONDS.observe(time.perf_counter() - started)
+            result.outcome = Outcome.ACKED
+        except asyncio.TimeoutError:
+            result.outcome = Outcome.TIMEOUT
+            result.message = f"{device_id} não confirmou o comando em {timeout_ms} ms."
+        except ConnectionError:
+            result.outcome = Outcome.NOT_CONNECTED
+            result.message = f"Conexão com {device_id} encerrada antes de confirmar o comando."
+        finally:
+            self._pending.pop(command.correlation_id, None)
+            sent = self._by_device[device_id]
+            del sent[command.correlation_id]
+            if not sent:
+                del self._by_device[device_id]
+        return result
+
+    def select(self, bulk):
+        '''Dispositivos alvo de um BulkCommand: ids explícitos ou filtros de tipo, zona e prefixo.'''
+        if bulk.device_ids:
+            return list(bulk.device_ids)
+        if bulk.zone:
+            records = self.registry.by_zone(bulk.zone)
+        elif bulk.type != smart_city_pb2.DeviceType.UNKNOWN:
+            records = self.registry.by_type(bulk.type)
+        else:
+            records = self.registry
+        return [record.id for record in records
+                if (bulk.type == smart_city_pb2.DeviceType.UNKNOWN or record.type == bulk.type)
+                and record.id.startswith(bulk.id_prefix)]
+
+    async def send_bulk(self, bulk):
+        local, remote = [], {}
+        for device_id in self.select(bulk):
+            worker = self._remote_worker(device_id)
+            if worker:
+                remote.setdefault(worker, []).append(device_id)
+            else:
+                local.append(device_id)
+
+        groups = await asyncio.gather(
+            asyncio.gather(*(self.send_local(device_id, bulk.action, bulk.timeout_ms) for device_id in local)),
+            *(self._send_remote(worker, device_ids, bulk.action, bulk.timeout_ms)
+              for worker, device_ids in remote.items()))
+        return [result for group in groups for result in group]
@@ -0,0 +1,117 @@
+import random
+import time
+from proto import smart_city_pb2
+from proto.discovery import filter_shape, id_hashes, seed_masks
+
+ADMISSION_RATE = 2000 #registros de dispositivos aceitos por segundo (por nó; 0 = sem limite)
+ADMISSION_BURST = 2000 #conexões aceitas de uma vez antes de o limite valer
+DISCOVERY_MIN_INTERVAL = 2 #segundos entre anúncios enquanto há dispositivos chegando ou pendentes
+DISCOVERY_MAX_INTERVAL = 30 #segundos entre anúncios com o registro estável
+DISCOVERY_JITTER = 0.2 #fração sorteada para mais ou para menos em cada intervalo
+
+class TokenBucket:
+    '''
+    Limite de admissões: rate fichas por segundo, acumuladas até burst. take() gasta
+    uma ficha, ou devolve False se não houver nenhuma. Com rate 0 não há limite.'''
+
+    def __init__(self, rate, burst=ADMISSION_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._last = clock()
+
+    def take(self):
+        if not self.rate:
+            return True
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+def build_filter(h1, h2, seed):
+    '''
+    Bytes do filtro de Bloom (proto.discovery.BloomFilter) para os ids cujos hashes estão
+    nos arrays uint64 h1 e h2, de uma vez com numpy: montar o filtro de 50 mil ids em
+    Python puro levaria centenas de milissegundos do event loop a cada anúncio.
+    Devolve (bytes, número de hashes).'''
+    import numpy as np #só no primeiro anúncio, depois de o Gateway já aceitar conexões
+    size, hashes = filter_shape(len(h1))
+    bits = size * 8
+    mask1, mask2 = seed_masks(seed)
+    h1 = h1 ^ np.uint64(mask1)
+    h2 = (h2 ^ np.uint64(mask2)) | np.uint64(1)
+    marked = np.zeros(bits, dtype=bool)
+    for i in range(hashes):
+        #a soma e o produto em uint64 dão a volta em 2^64, como o MASK64 de BloomFilter
+        marked[(h1 + np.uint64(i) * h2) % np.uint64(bits)] = True
+    return np.packbits(marked, bitorder='little').tobytes(), hashes
+
+class Announcer:
+    '''
+    Monta os anúncios de descoberta e decide quando enviar o próximo:
+        - o DISCOVER leva a lista de nós, o nome deste nó, a taxa de admissão, quantos
+         dispositivos estão conectados e quantos ainda devem voltar (restaurados do
+         journal) e um filtro de Bloom com os ids registrados, que não precisam responder;
+        - enquanto o número de conectados muda ou há pendentes, os anúncios saem a cada
+         DISCOVERY_MIN_INTERVAL; com o registro estável, o intervalo dobra até
+         DISCOVERY_MAX_INTERVAL. Cada intervalo tem DISCOVERY_JITTER sorteado, para que
+         os nós de um cluster não anunciem sempre juntos.'''
+
+    def __init__(self, registry, node="", nodes=(), admission_rate=ADMISSION_RATE, rng=random):
+        self.registry = registry
+        self.node = node
+        self.nodes = list(nodes)
+        self.admission_rate = admission_rate
+        self.interval = DISCOVERY_MIN_INTERVAL
+        self.sequence = 0
+        self._rng = rng
+        self._last_connected = None
+        self._hashes = {} #id -> id_hashes(id), para não recalcular o blake2b a cada anúncio
+
+    def build(self):
+        '''GatewayRequest do próximo anúncio; também ajusta o intervalo até o seguinte.'''
+        registered = [record.id for record in self.registry if not record.pending]
+        expected = len(self.registry) - len(registered)
+        self.sequence = self.sequence % 0xFFFFFFFF + 1
+
+        request = smart_city_pb2.GatewayRequest()
+        request.action = "DISCOVER"
+        for node in self.nodes:
+            request.nodes.add(name=node.name, host=node.host, tcp_port=node.tcp_port, udp_port=node.udp_port)
+        request.node = self.node
+        request.admission_rate = self.admission_rate
+        request.connected = len(registered)
+        request.expected = expected
+        if registered:
+            h1, h2 = self._id_hashes(registered)
+            request.registered_filter, request.filter_hashes = build_filter(h1, h2, self.sequence)
+            request.filter_seed = self.sequence
+
+        if expected or len(registered) != self._last_connected:
+            self.interval = DISCOVERY_MIN_INTERVAL
+        else:
+            self.interval = min(DISCOVERY_MAX_INTERVAL, self.interval * 2)
+        self._last_connected = len(registered)
+        return request
+
+    def _id_hashes(self, device_ids):
+        import numpy as np
+        cache = self._hashes
+        if len(cache) > 2 * len(device_ids) + 1024:
+            #descarta os ids que saíram do registro
+            self._hashes = cache = {device_id: cache[device_id] for device_id in device_ids if device_id in cache}
+        rows = []
+        for device_id in device_ids:
+            pair = cache.get(device_id)
+            if pair is None:
+                pair = cache[device_id] = id_hashes(device_id)
+            rows.append(pair)
+        return (np.fromiter((h1 for h1, _ in rows), dtype=np.uint64, count=len(rows)),
+                np.fromiter((h2 for _, h2 in rows), dtype=np.uint64, count=len(rows)))
+
+    def next_delay(self):
+        return self.interval * self._rng.uniform(1 - DISCOVERY_JITTER, 1 + DISCOVERY_JITTER)
@@ -0,0 +1,79 @@
+import asyncio
+from proto import smart_city_pb2
+from proto.framing import encode_message
+
+EVENT_FLUSH_INTERVAL = 0.1 #segundos acumulando eventos antes de enviar um lote
+
+class Subscriber:
+    '''
+    Cliente web inscrito nas mudanças de estado dos dispositivos.
+
+    As mudanças não são enfileiradas uma a uma: pending guarda só o DeviceRecord de
+    cada dispositivo alterado (ou None se ele foi removido), lido no momento do envio.
+    Se o cliente for lento e o envio anterior ainda estiver esperando o drain, novas
+    leituras do mesmo sensor apenas sobrescrevem a entrada. Assim a memória por
+    cliente fica limitada ao número de dispositivos, e o Gateway nunca espera por um
+    cliente lento.'''
+
+    def __init__(self, writer, request_id):
+        self.writer = writer
+        self.request_id = request_id
+        self.pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def push(self, device_id, record):
+        self.pending[device_id] = record
+        self._wakeup.set()
+
+    def close(self):
+        self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+                self._wakeup.clear()
+                pending, self.pending = self.pending, {}
+
+                response_proto = smart_city_pb2.GatewayClientResponse()
+                response_proto.request_id = self.request_id
+                for device_id, record in pending.items():
+                    event = response_proto.events.add()
+                    if record is None:
+                        event.kind = smart_city_pb2.DeviceEvent.REMOVED
+                        event.device.id = device_id
+                    else:
+                        event.kind = smart_city_pb2.DeviceEvent.UPDATED
+                        record.fill_info(event.device)
+
+                self.writer.write(encode_message(response_proto))
+                await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, OSError):
+            self.writer.close()
+
+class EventHub:
+    '''
+    Distribui as mudanças do DeviceRegistry para os clientes inscritos. É registrado
+    como listener do registro: on_change(record, removed) é chamado quando um dispositivo
+    é registrado, tem o status alterado ou é removido.'''
+
+    def __init__(self):
+        self.subscribers = set()
+
+    def subscribe(self, writer, request_id):
+        subscriber = Subscriber(writer, request_id)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe_writer(self, writer):
+        for subscriber in [s for s in self.subscribers if s.writer is writer]:
+            subscriber.close()
+            self.subscribers.discard(subscriber)
+
+    def on_change(self, record, removed):
+        for subscriber in self.subscribers:
+            subscriber.push(record.id, None if removed else record)
@@ -1,7 +1,27 @@
+import argparse
+import asyncio
+import logging
+import signal
 import socket
-import threading
 import time
+from google.protobuf.internal import api_implementation
 from proto import smart_city_pb2
+from proto.cluster import HashRing, parse_nodes
+from proto.framing import FrameDecoder, encode_frame, read_frame, read_message
+from proto.limits import raise_fd_limit
+from gateway import metrics, workers
+from gateway.aggregates import Aggregates
+from gateway.commands import CommandDispatcher, DeviceOutbox
+from gateway.discovery import ADMISSION_BURST, ADMISSION_RATE, Announcer, TokenBucket
+from gateway.events import EventHub
+from gateway.ingest import UdpIngest
+from gateway.journal import RegistryJournal
+from gateway.liveness import LivenessMonitor
+from gateway.logs import setup_logging
+from gateway.registry import DeviceRegistry
+from gateway.rules import RULES_FILE, RuleError, RulesEngine, load_rules
+from gateway.snapshot import DeviceSnapshot
+from gateway.workers import WorkerLink, merge_histories
 
 #definição do endereço e portas
 MCAST_GRP = '224.1.1.1'
@@ -9,195 +29,615 @@ MCAST_PORT = 5007
 GATEWAY_TCP_PORT = 10000
 GATEWAY_UDP_PORT = 10001
 
-devices = {} #guarda informações sobre os dispositivos conectados
-device_sockets = {} #mantem as conexões TCP ativas com os dispositivos
-lock = threading.Lock()
+TCP_BACKLOG = 4096 #fila de conexões pendentes do listen
+TIMESERIES_DIR = 'data/timeseries' #histórico dos sensores (arquivos memmap)
+TIMESERIES_FLUSH_INTERVAL = 10 #segundos entre gravações do histórico em disco
+REGISTRY_DIR = 'data/registry' #journal do registro, para responder logo após um reinício
+METRICS_PORT = metrics.METRICS_PORT
 
-def handle_device_tcp(conn, addr):
+NODE_NAME = "" #nome deste nó no cluster; vazio quando o Gateway roda sozinho
+CLUSTER = [] #todos os nós do cluster (proto.cluster.Node), anunciados no DISCOVER
+ring = HashRing([]) #anel de hash do cluster, para saber se um dispositivo pertence a este nó
+
+WORKERS = 1 #processos que dividem as portas do Gateway (SO_REUSEPORT)
+WORKER_ID = 0 #número deste worker (1..WORKERS) no modo --workers; 0 com um só processo
+peers = None #WorkerLink com os outros workers; None com um só processo
+
+registry = DeviceRegistry() #dispositivos conectados, com a fila de saída de cada conexão
+event_hub = EventHub() #clientes web inscritos nas mudanças do registro
+registry.add_listener(event_hub.on_change)
+snapshot = DeviceSnapshot(registry) #lista de dispositivos pré-serializada para list_devices
+aggregates = Aggregates(registry) #contagens e leituras por tipo e zona, mantidas a cada mudança
+udp_ingest = UdpIngest(registry, GATEWAY_UDP_PORT) #leituras dos sensores recebidas por UDP
+timeseries = None #TimeSeriesStore, aberto em main() depois que o Gateway já aceita conexões
+journal = None #RegistryJournal, carregado em main() antes de aceitar conexões
+dispatcher = CommandDispatcher(registry) #comandos aguardando confirmação dos dispositivos
+liveness = LivenessMonitor(registry) #prazos de heartbeat de cada dispositivo
+RULES = [] #regras de automação lidas de RULES_FILE (ou --rules) em configure()
+rules_engine = None #RulesEngine, criado em main() depois do journal
+admission = TokenBucket(ADMISSION_RATE) #limite de conexões de dispositivos por segundo
+
+log = logging.getLogger('gateway')
+
+#requisições que esperam resposta dos dispositivos e por isso rodam em tarefas próprias
+COMMAND_REQUESTS = ('command_device', 'bulk_command')
+#no modo --workers, consultas que juntam o estado de todos os workers (também em tarefas próprias)
+PEER_REQUESTS = ('history', 'metrics')
+
+async def handle_device_tcp(reader, writer):
     '''
-    Conexões TCP dos dispositivos:
-        - Quando um dispositivo se conecta, ele envia um pacote de descoberta com suas 
-          informações, então o Gateway registra essas informações nos dicionários;
-          
+    Conexões TCP dos dispositivos. Cada frame recebido é uma DeviceMessage:
+        - Quando um dispositivo se conecta, ele envia um pacote de descoberta com suas
+          informações, então o Gateway registra essas informações no registry;
+
         - O gateway continua a ouvir dados na mesma conexão TCP, se o atuador alterar
          seu estado, ele envia um discovery_packet atualizado, atualiza também o status
-         correspondente em devices.'''
-    
+         correspondente no registry. Se o pacote ecoar um correlation_id, ele é a
+         confirmação de um comando e é repassado ao dispatcher;
+
+        - Entre uma mensagem e outra, o dispositivo envia Heartbeats. Qualquer mensagem
+         renova o prazo do dispositivo no LivenessMonitor, que o remove (e fecha a
+         conexão) se ele ficar MISSED_HEARTBEATS intervalos em silêncio;
+
+        - Tudo o que o Gateway envia ao dispositivo passa pela DeviceOutbox da conexão.
+
+    Cada conexão é uma corrotina no mesmo event loop, então não há threads nem lock:
+    as alterações no registro acontecem sempre entre dois await.'''
+
     device_id = None
+    decoder = FrameDecoder()
+    outbox = DeviceOutbox(writer)
+    #uma única DeviceMessage por conexão, decodificada direto do buffer do FrameDecoder
+    message = smart_city_pb2.DeviceMessage()
     try:
-        data = conn.recv(1024)
-        if not data:
+        if not await read_message(reader, decoder, message):
             return
 
-        discovery_packet = smart_city_pb2.DiscoveryPacket()
-        discovery_packet.ParseFromString(data)
+        if message.WhichOneof('message') != 'discovery':
+            log.warning("Conexão de dispositivo sem pacote de descoberta; encerrando.")
+            return
 
+        discovery_packet = message.discovery
         device_id = discovery_packet.info.id
-        with lock:
-            devices[device_id] = {
-                "id": device_id,
-                "type": smart_city_pb2.DeviceType.Name(discovery_packet.info.type),
-                "status": discovery_packet.info.status,
-                "address": discovery_packet.ip_address,
-                "port": discovery_packet.port
-            }
-            device_sockets[device_id] = conn
-        print(f"Gateway: Dispositivo registrado/atualizado: {devices[device_id]}")
+        record = registry.register(
+            device_id, discovery_packet.info.type, discovery_packet.info.status,
+            discovery_packet.info.zone, discovery_packet.ip_address, discovery_packet.port, outbox, WORKER_ID)
+        metrics.DEVICE_REGISTRATIONS.inc()
+        log.info("Dispositivo registrado/atualizado: %r", record)
+        owner = ring.owner(device_id)
+        if owner is not None and owner.name != NODE_NAME:
+            #aceito mesmo assim: o dispositivo pode ter recebido um anúncio com outra lista de nós
+            log.warning("Dispositivo %s pertence ao nó %s, não a %s.", device_id, owner.name, NODE_NAME)
 
-        while True:
-            data = conn.recv(1024)
-            if not data:
-                break
-            
-            response_packet = smart_city_pb2.DiscoveryPacket()
-            response_packet.ParseFromString(data)
-            device_id_update = response_packet.info.id
-            with lock:
-                if device_id_update in devices:
-                    devices[device_id_update]['status'] = response_packet.info.status
-                    print(f"Gateway: Estado do atuador {device_id_update} atualizado para {devices[device_id_update]['status']}")
+        while await read_message(reader, decoder, message):
+            liveness.touch(device_id, message.heartbeat.interval_ms)
+            kind = message.WhichOneof('message')
+            if kind == 'heartbeat':
+                metrics.HEARTBEATS.inc()
+            if kind != 'discovery':
+                continue
+
+            response_packet = message.discovery
+            if response_packet.info.id != device_id:
+                #uma conexão só atualiza o próprio dispositivo, como em dispatcher.acknowledge
+                log.warning("Pacote de %s recebido pela conexão de %s; ignorado.", response_packet.info.id, device_id)
+                continue
+            if registry.set_status_text(device_id, response_packet.info.status):
+                log.debug("Estado do atuador %s atualizado para %s", device_id, response_packet.info.status)
+            if response_packet.correlation_id:
+                dispatcher.acknowledge(device_id, response_packet)
 
     except ConnectionResetError:
-        print(f"Gateway: Conexão com {device_id or 'dispositivo desconhecido'} perdida.")
+        log.info("Conexão com %s perdida.", device_id or 'dispositivo desconhecido')
     except Exception as e:
-        print(f"Gateway: Erro na conexão com o dispositivo: {e}")
+        log.warning("Erro na conexão com o dispositivo %s: %s", device_id or 'desconhecido', e)
     finally:
-        with lock:
-            if device_id and device_id in devices:
-                del devices[device_id]
-                if device_id in device_sockets:
-                    del device_sockets[device_id]
-        conn.close()
-        print(f"Gateway: Dispositivo {device_id} removido.")
+        if device_id:
+            dispatcher.drop(device_id, outbox)
+        if device_id and registry.remove(device_id, outbox):
+            metrics.DEVICE_REMOVALS.inc()
+            log.info("Dispositivo %s removido.", device_id)
+        outbox.close()
+
+def fill_history(response_proto, history_request):
+    '''Responde a uma HistoryRequest a partir do TimeSeriesStore.'''
+    if timeseries is None:
+        response_proto.status.success = False
+        response_proto.status.message = "Histórico ainda não disponível: o Gateway está iniciando."
+        return
+    from gateway.timeseries import HOUR_MS
+    to_ms = history_request.to_ms or int(time.time() * 1000)
+    from_ms = history_request.from_ms or to_ms - HOUR_MS
+    try:
+        resolution, columns = timeseries.query(
+            history_request.device_id, from_ms, to_ms, history_request.resolution or 'auto')
+    except ValueError as e:
+        response_proto.status.success = False
+        response_proto.status.message = str(e)
+        return
+
+    history = response_proto.history
+    history.device_id = history_request.device_id
+    history.resolution = resolution
+    history.timestamps_ms.extend(columns['t'].tolist())
+    history.min.extend(columns['min'].tolist())
+    history.max.extend(columns['max'].tolist())
+    history.mean.extend(columns['mean'].tolist())
+    history.count.extend(columns['count'].tolist())
+
+def handle_client_request(request_proto):
+    '''
+    Executa uma requisição de cliente web e devolve a GatewayClientResponse já serializada.
+
+    As listas de dispositivos não são montadas como mensagem: os bytes do campo devices
+    vêm prontos do snapshot e o restante da resposta (request_id, status, cursor, versão)
+    é serializado à parte e concatenado, o que o protobuf interpreta como uma só mensagem.'''
+
+    request_type = request_proto.WhichOneof('request')
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    response_proto.request_id = request_proto.request_id
+    response_proto.status.success = True
+    response_proto.worker = WORKER_ID
+    devices_bytes = b''
+
+    if request_type in ('list_devices', 'subscribe'):
+        started = time.perf_counter()
+        devices_bytes = snapshot.full()
+        metrics.LIST_SERIALIZE_SECONDS.observe(time.perf_counter() - started)
+        response_proto.version = registry.version
 
-def handle_web_client(conn, addr):
+    elif request_type == 'query_devices':
+        started = time.perf_counter()
+        devices_bytes, response_proto.next_cursor = snapshot.page(request_proto.query_devices)
+        metrics.LIST_SERIALIZE_SECONDS.observe(time.perf_counter() - started)
+        response_proto.version = registry.version
+
+    elif request_type == 'history':
+        fill_history(response_proto, request_proto.history)
+
+    elif request_type == 'metrics':
+        response_proto.metrics_text = metrics.REGISTRY.render()
+
+    elif request_type == 'aggregates':
+        aggregates.fill(response_proto, request_proto.aggregates)
+        response_proto.version = registry.version
+
+    elif request_type == 'ping':
+        #a versão permite ao backend saber, com uma requisição mínima, se a lista mudou
+        response_proto.version = registry.version
+
+    else:
+        response_proto.status.success = False
+        response_proto.status.message = "Requisição desconhecida."
+
+    return devices_bytes + response_proto.SerializeToString()
+
+async def handle_command_request(request_proto):
+    '''
+    Executa command_device ou bulk_command: envia os comandos pelo dispatcher, espera as
+    confirmações (ou o timeout) e devolve a resposta serializada com um CommandResult
+    por dispositivo. status.success só é verdadeiro se todos confirmaram.'''
+
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    response_proto.request_id = request_proto.request_id
+
+    if request_proto.WhichOneof('request') == 'command_device':
+        command = request_proto.command_device
+        results = [await dispatcher.send(command.device_id, command.action, command.timeout_ms)]
+    else:
+        results = await dispatcher.send_bulk(request_proto.bulk_command)
+
+    response_proto.command_results.extend(results)
+    failed = [result for result in results if result.outcome != smart_city_pb2.CommandResult.ACKED]
+    response_proto.status.success = not failed
+    if failed:
+        response_proto.status.message = failed[0].message if len(results) == 1 else \
+            f"{len(failed)} de {len(results)} dispositivos não confirmaram o comando."
+    return response_proto.SerializeToString()
+
+async def handle_peer_request(request_proto):
+    '''
+    Requisição encaminhada por outro worker, respondida só com o estado deste processo:
+    comandos para os dispositivos conectados aqui, histórico gravado aqui e métricas locais.'''
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    response_proto.status.success = True
+    request_type = request_proto.WhichOneof('request')
+    if request_type == 'bulk_command':
+        bulk = request_proto.bulk_command
+        response_proto.command_results.extend(await asyncio.gather(
+            *(dispatcher.send_local(device_id, bulk.action, bulk.timeout_ms) for device_id in bulk.device_ids)))
+    elif request_type == 'history':
+        fill_history(response_proto, request_proto.history)
+    elif request_type == 'metrics':
+        response_proto.metrics_text = metrics.REGISTRY.render()
+    return response_proto
+
+async def render_metrics():
+    '''Métricas deste processo ou, no modo --workers, de todos os workers (com o label worker).'''
+    if peers is None:
+        return metrics.REGISTRY.render()
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.metrics = "METRICS"
+    responses = await peers.call(0, request_proto)
+    texts = {str(WORKER_ID): metrics.REGISTRY.render()}
+    texts.update((str(worker), response.metrics_text) for worker, response in sorted(responses.items()))
+    return metrics.merge_texts(texts, 'worker')
+
+async def handle_gathered_request(request_proto):
+    '''Executa history ou metrics no modo --workers, juntando a resposta local à dos outros workers.'''
+    response_proto = await handle_peer_request(request_proto)
+    response_proto.request_id = request_proto.request_id
+    if request_proto.WhichOneof('request') == 'metrics':
+        response_proto.metrics_text = await render_metrics()
+    elif response_proto.status.success:
+        responses = await peers.call(0, request_proto)
+        local = smart_city_pb2.HistoryResponse()
+        local.CopyFrom(response_proto.history)
+        response_proto.ClearField('history')
+        merge_histories(response_proto.history, [local] + [r.history for r in responses.values()])
+        response_proto.history.device_id = request_proto.history.device_id
+        response_proto.history.resolution = local.resolution
+    return response_proto.SerializeToString()
+
+async def respond_command(writer, request_proto):
+    response_bytes = await handle_command_request(request_proto)
+    writer.write(encode_frame(response_bytes))
+
+async def respond_gathered(writer, request_proto):
+    response_bytes = await handle_gathered_request(request_proto)
+    writer.write(encode_frame(response_bytes))
+
+async def handle_web_client(reader, writer):
 
     '''Gerencia conexões TCP de clientes web:
-    Espera receber uma requisição do cliente. Suporta dois tipos
-    de requisição:
-    
+    A conexão é de longa duração: o cliente envia várias requisições em sequência,
+    uma por frame, e cada resposta ecoa o request_id da requisição, o que permite
+    ao backend manter poucas conexões abertas e multiplexar as chamadas nelas.
+    Suporta os tipos de requisição:
+
         - list_devices: retorna uma lista de todos os dispositivos registrados;
-        - command_device: Permite enviar um comando ("TURN_ON", "TURN_OFF"). 
-    O Gateway busca a conexão TCP do dispositivo e retransmite o comando.'''
-    
+        - query_devices: lista filtrada por tipo, prefixo de id e status, paginada por cursor;
+        - history: histórico de um sensor (bruto ou agregado por minuto/hora);
+        - aggregates: contagem de postes ligados/desligados e média/mínima/máxima das
+    leituras por tipo e zona, sem montar a lista de dispositivos;
+        - command_device: Permite enviar um comando ("TURN_ON", "TURN_OFF").
+    O Gateway enfileira o comando na conexão do dispositivo e responde quando ele
+    confirmar ou o tempo esgotar;
+        - bulk_command: o mesmo para um grupo de dispositivos (por ids, tipo, zona ou
+    prefixo), com um resultado por dispositivo;
+        - ping: verificação de saúde da conexão, responde com status e a versão do registro;
+        - metrics: as métricas do Gateway em formato de texto do Prometheus;
+        - subscribe: responde com a lista atual de dispositivos e, a partir daí, envia
+    na mesma conexão (com o mesmo request_id) lotes de DeviceEvent com as mudanças.
+
+    As respostas de comandos podem chegar fora de ordem: cada uma roda numa tarefa
+    própria para não travar as demais requisições da conexão.'''
+
+    decoder = FrameDecoder()
+    command_tasks = set()
     try:
-        data = conn.recv(1024)
-        if not data:
-            return
+        while True:
+            data = await read_frame(reader, decoder)
+            if data is None:
+                break
+
+            request_proto = smart_city_pb2.ClientGatewayRequest()
+            request_proto.ParseFromString(data)
+            request_type = request_proto.WhichOneof('request')
+            metrics.CLIENT_REQUESTS.labels(request_type or 'unknown').inc()
+            if request_type in COMMAND_REQUESTS:
+                task = asyncio.create_task(respond_command(writer, request_proto))
+                command_tasks.add(task)
+                task.add_done_callback(command_tasks.discard)
+                continue
+            if peers is not None and request_type in PEER_REQUESTS:
+                task = asyncio.create_task(respond_gathered(writer, request_proto))
+                command_tasks.add(task)
+                task.add_done_callback(command_tasks.discard)
+                continue
+
+            response_bytes = handle_client_request(request_proto)
+
+            if request_type == 'subscribe':
+                event_hub.subscribe(writer, request_proto.request_id)
+
+            writer.write(encode_frame(response_bytes))
+            await writer.drain()
 
-        request_proto = smart_city_pb2.ClientGatewayRequest()
-        request_proto.ParseFromString(data)
-        request_type = request_proto.WhichOneof('request')
-
-        if request_type == 'list_devices':
-            response_proto = smart_city_pb2.GatewayClientResponse()
-            with lock:
-                for device_dict in devices.values():
-                    device_info_proto = response_proto.devices.add()
-                    device_info_proto.id = device_dict['id']
-                    device_info_proto.type = smart_city_pb2.DeviceType.Value(device_dict['type'])
-                    device_info_proto.status = device_dict['status']
-            
-            conn.sendall(response_proto.SerializeToString())
-
-        elif request_type == 'command_device':
-            command = request_proto.command_device
-            device_id = command.device_id
-            
-            with lock:
-                device_conn = device_sockets.get(device_id)
-
-            if device_conn:
-                device_conn.send(command.SerializeToString())
-            
-            conn.sendall(b'')
-            
     except Exception as e:
-        print(f"Gateway: Erro no cliente web: {e}")
+        log.warning("Erro no cliente web: %s", e)
     finally:
-        conn.close()
+        for task in command_tasks:
+            task.cancel()
+        event_hub.unsubscribe_writer(writer)
+        writer.close()
 
-def start_tcp_server():
+async def handle_connection(reader, writer):
     '''
-    - Inicia um servidor TCP principal na GATEWAY_TCP_PORT;
-    - Aceita novas conexões, se a conexão vier do 127.0.0.1 (localhost), 
-     ele assume que é um cliente web e delega o tratamento para handle_web_client em uma nova thread,
-     caso não, assume que é um dispositivo e delega para handle_device_tcp em uma nova thread.
-     Isso permite que o Gateway lide com múltiplas conexões simultaneamente sem bloquear.
+    Ponto de entrada de toda conexão TCP aceita pelo servidor: se a conexão vier
+    do 127.0.0.1 (localhost), ela é tratada como cliente web, caso não, como dispositivo.
+    Conexões de dispositivos passam antes pelo limite de admissão (token bucket).'''
+
+    addr = writer.get_extra_info('peername')
+    if addr[0] == '127.0.0.1':
+        metrics.TCP_ACCEPTS.labels('web').inc()
+        await handle_web_client(reader, writer)
+    elif not admission.take():
+        #acima da taxa de admissão a conexão é fechada antes de qualquer leitura; o
+        #dispositivo tenta de novo com backoff exponencial (proto.discovery.backoff_delay)
+        metrics.DEVICE_ADMISSIONS_REJECTED.inc()
+        writer.close()
+    else:
+        metrics.TCP_ACCEPTS.labels('device').inc()
+        await handle_device_tcp(reader, writer)
+
+async def start_tcp_server():
+    '''
+    - Inicia um servidor TCP principal na GATEWAY_TCP_PORT com asyncio streams;
+    - Cada conexão aceita vira uma corrotina (handle_connection) no mesmo event loop,
+     em vez de uma thread por conexão. Uma conexão parada em read() custa só o buffer
+     do socket e o estado da corrotina, o que permite manter dezenas de milhares de
+     dispositivos conectados num único processo.
+    - No modo --workers, cada worker abre o seu próprio socket na mesma porta com
+     SO_REUSEPORT e o kernel distribui as conexões novas entre eles.
      '''
-    
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind(('', GATEWAY_TCP_PORT))
-    server.listen(10)
-    print(f"Gateway: Servidor TCP escutando na porta {GATEWAY_TCP_PORT}")
 
-    while True:
-        conn, addr = server.accept()
-        if addr[0] == '127.0.0.1':
-             client_thread = threading.Thread(target=handle_web_client, args=(conn, addr))
-             client_thread.start()
-        else:
-            device_thread = threading.Thread(target=handle_device_tcp, args=(conn, addr))
-            device_thread.start()
+    server = await asyncio.start_server(
+        handle_connection, '', GATEWAY_TCP_PORT,
+        reuse_address=True, reuse_port=peers is not None or None, backlog=TCP_BACKLOG)
+    log.info("Servidor TCP escutando na porta %d", GATEWAY_TCP_PORT)
+    return server
 
 def start_udp_server():
     '''
-    - Inicia um servidor UDP na GATEWAY_UDP_PORT
-    - Este servidor é usado pra receber os dados do sensor de temperatura;
-    - Ao receber dados de um sensor, ele extrai o ID do dispositivo
-     e o valor do sensor, atualizando o status do dispositivo correspondente 
-     dicionário devices
+    - Inicia a ingestão UDP na GATEWAY_UDP_PORT
+    - Este servidor é usado pra receber os dados dos sensores de temperatura
+     (SensorData ou SensorBatch), atualizando o status de cada sensor no registry;
      '''
-    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server.bind(('', GATEWAY_UDP_PORT))
-    print(f"Gateway: Servidor UDP escutando na porta {GATEWAY_UDP_PORT}")
+    udp_ingest.start()
+    log.info("Servidor UDP escutando na porta %d", GATEWAY_UDP_PORT)
+    return udp_ingest
 
-    while True:
-        data, addr = server.recvfrom(1024)
-        sensor_data = smart_city_pb2.SensorData()
-        sensor_data.ParseFromString(data)
-        
-        device_id = sensor_data.device_id
-        with lock:
-            if device_id in devices:
-                devices[device_id]['status'] = f"{int(sensor_data.value)}°C"
-
-def discover_devices():
+def discover_devices(announcer):
     '''
     - Envia uma mensagem de descoberta (GatewayRequest com ação "DISCOVER") via multicast UDP
     para o grupo MCAST_GRP e MCAST_PORT;
     - Esta mensagem serve para que novos dispositivos na rede saibam que há um Gateway disponível
      e possam se conectar a ele.
+    - Em cluster, a mensagem leva a lista de nós: cada dispositivo calcula no anel de hash
+     o dono do seu id e se conecta direto a ele.
+    - O anúncio leva também a carga do nó e o filtro dos dispositivos já registrados
+     (ver gateway.discovery.Announcer).
      '''
-    
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
-    
-    request = smart_city_pb2.GatewayRequest()
-    request.action = "DISCOVER"
-    
-    sock.sendto(request.SerializeToString(), (MCAST_GRP, MCAST_PORT))
-
-def periodic_discovery():
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.sendto(announcer.build().SerializeToString(), (MCAST_GRP, MCAST_PORT))
+    metrics.DISCOVERY_ANNOUNCEMENTS.inc()
+
+async def periodic_discovery():
     '''
-       Executa a função discover_devices a cada 15 segundos em um loop infinito. 
-       Garantindo que o Gateway anuncie sua presença regularmente e permita que 
-       novos dispositivos se registrem.
+       Executa a função discover_devices em um loop infinito, garantindo que o Gateway
+       anuncie sua presença regularmente e permita que novos dispositivos se registrem.
+       O intervalo é adaptativo: curto enquanto dispositivos chegam ou são esperados de
+       volta, e cada vez mais longo com o registro estável.
        '''
+    announcer = Announcer(registry, NODE_NAME, CLUSTER, ADMISSION_RATE)
     while True:
-        print("Gateway: Enviando pulso de descoberta periódica....")
-        discover_devices()
-        time.sleep(30)
+        log.debug("Enviando pulso de descoberta periódica.")
+        try:
+            discover_devices(announcer)
+        except OSError as e:
+            log.warning("Falha ao enviar descoberta: %s", e)
+        await asyncio.sleep(announcer.next_delay())
 
-if __name__ == "__main__":
-    tcp_thread = threading.Thread(target=start_tcp_server, daemon=True)
-    udp_thread = threading.Thread(target=start_udp_server, daemon=True)
-    discovery_thread = threading.Thread(target=periodic_discovery, daemon=True)
+def load_timeseries(directory):
+    #importado só aqui: o numpy sozinho leva perto de 100 ms para carregar
+    from gateway.timeseries import TimeSeriesStore
+    return TimeSeriesStore(directory)
 
-    tcp_thread.start()
-    udp_thread.start()
-    discovery_thread.start()
+async def open_timeseries():
+    '''
+    Abre o histórico dos sensores numa thread, com o event loop já atendendo conexões,
+    e o conecta à ingestão UDP. Leituras que chegarem antes disso não entram no histórico.'''
+    global timeseries
+    timeseries = await asyncio.get_running_loop().run_in_executor(None, load_timeseries, TIMESERIES_DIR)
+    udp_ingest.add_listener(timeseries.append_readings)
+
+def open_journal():
+    '''Restaura o registro gravado em disco (dispositivos pendentes de reconexão) e passa a gravar as mudanças.'''
+    global journal
+    journal = RegistryJournal(registry, REGISTRY_DIR, WORKER_ID)
+    journal.load()
+
+def open_rules():
+    '''Liga as regras de automação ao registro. No modo --workers, só no worker 1.'''
+    global rules_engine
+    if RULES and WORKER_ID <= 1:
+        rules_engine = RulesEngine(registry, dispatcher, RULES)
+        log.info("%d regras de automação carregadas.", len(RULES))
 
+async def periodic_flush():
+    '''Grava periodicamente em disco as páginas alteradas do histórico dos sensores.'''
     while True:
-        time.sleep(1)
+        await asyncio.sleep(TIMESERIES_FLUSH_INTERVAL)
+        timeseries.flush()
+
+def collect_metrics():
+    '''
+    Liga as métricas que são lidas só na coleta aos objetos que já mantêm esses
+    valores (registro, contadores da ingestão UDP, inscritos), sem custo por evento.'''
+    counters = udp_ingest.counters
+    metrics.DEVICES.set_function(lambda: {
+        (name,): len(registry.by_type(value)) for name, value in smart_city_pb2.DeviceType.items()})
+    metrics.REGISTRY_VERSION.set_function(lambda: registry.version)
+    metrics.UDP_DATAGRAMS.set_function(lambda: {
+        ('parsed',): counters.datagrams - counters.malformed, ('malformed',): counters.malformed})
+    metrics.UDP_READINGS.set_function(lambda: {
+        ('applied',): counters.readings, ('dropped',): counters.dropped})
+    metrics.UDP_WAKEUPS.set_function(lambda: counters.wakeups)
+    metrics.TRACKED_DEVICES.set_function(lambda: len(liveness.wheel))
+    metrics.SUBSCRIBERS.set_function(lambda: len(event_hub.subscribers))
+    metrics.RULE_EVALUATIONS.set_function(lambda: rules_engine.evaluations if rules_engine else 0)
+
+async def start_metrics_server():
+    '''Endpoint HTTP /metrics na METRICS_PORT; sem ele o Gateway continua funcionando.'''
+    try:
+        server = await metrics.start_http_server(METRICS_PORT, render_metrics, reuse_port=peers is not None)
+    except OSError as e:
+        log.warning("Endpoint de métricas indisponível na porta %d: %s", METRICS_PORT, e)
+        return None
+    log.info("Métricas em http://0.0.0.0:%d/metrics", METRICS_PORT)
+    return server
+
+def configure(args):
+    '''
+    Aplica a linha de comando. Com --cluster e --node, as portas deste nó vêm da
+    lista de nós e o histórico fica num diretório próprio do nó, para que vários nós
+    possam rodar na mesma máquina.'''
+    global GATEWAY_TCP_PORT, GATEWAY_UDP_PORT, METRICS_PORT, TIMESERIES_DIR, REGISTRY_DIR
+    global NODE_NAME, CLUSTER, ring, WORKERS, ADMISSION_RATE, RULES
+    WORKERS = max(1, args.workers)
+    ADMISSION_RATE = max(0, args.admission_rate)
+    GATEWAY_TCP_PORT = args.tcp_port
+    GATEWAY_UDP_PORT = args.udp_port
+    METRICS_PORT = args.metrics_port
+    if args.cluster:
+        CLUSTER = parse_nodes(args.cluster)
+        own = [node for node in CLUSTER if node.name == args.node]
+        if not own:
+            raise SystemExit(f"Gateway: o nó {args.node!r} não está na lista do cluster.")
+        NODE_NAME = own[0].name
+        GATEWAY_TCP_PORT = own[0].tcp_port
+        GATEWAY_UDP_PORT = own[0].udp_port
+        TIMESERIES_DIR = f"{TIMESERIES_DIR}/{NODE_NAME}"
+        REGISTRY_DIR = f"{REGISTRY_DIR}/{NODE_NAME}"
+        ring = HashRing(CLUSTER)
+    udp_ingest.port = GATEWAY_UDP_PORT
+    admission.rate = ADMISSION_RATE
+    try:
+        RULES = load_rules(args.rules)
+    except (RuleError, OSError) as e:
+        raise SystemExit(f"Gateway: {e}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway da cidade inteligente.")
+    parser.add_argument('--tcp-port', type=int, default=GATEWAY_TCP_PORT)
+    parser.add_argument('--udp-port', type=int, default=GATEWAY_UDP_PORT)
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT)
+    parser.add_argument('--cluster', default="",
+                        help="nós do cluster: nome=host:porta_tcp:porta_udp,... (host vazio = endereço do anúncio)")
+    parser.add_argument('--node', default="", help="nome deste nó na lista do cluster")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="processos que dividem as portas do Gateway (SO_REUSEPORT)")
+    parser.add_argument('--admission-rate', type=int, default=ADMISSION_RATE,
+                        help="conexões de dispositivos aceitas por segundo (0 = sem limite)")
+    parser.add_argument('--rules', default=RULES_FILE, help="arquivo JSON com as regras de automação")
+    return parser.parse_args(argv)
+
+def run_worker(worker, sock):
+    '''
+    Corpo de um worker, já no processo filho: histórico e journal em diretórios próprios
+    (cada processo mantém os seus índices), réplica do registro ligada aos outros
+    workers pelo WorkerLink e sockets abertos com SO_REUSEPORT. O kernel divide as
+    conexões entre os workers, então cada um admite a sua parte da taxa do nó.'''
+    global WORKER_ID, TIMESERIES_DIR, REGISTRY_DIR, peers
+    WORKER_ID = worker
+    TIMESERIES_DIR = f"{TIMESERIES_DIR}/worker{worker}"
+    REGISTRY_DIR = f"{REGISTRY_DIR}/worker{worker}"
+    peers = WorkerLink(worker, WORKERS, sock, registry)
+    peers.handler = handle_peer_request
+    dispatcher.peers = peers
+    udp_ingest.reuse_port = True
+    admission.rate = ADMISSION_RATE / WORKERS
+    admission.burst = admission.tokens = ADMISSION_BURST / WORKERS
+    asyncio.run(main())
+
+async def supervise(children):
+    '''
+    Processo principal do modo --workers: não aceita conexões. Repassa as mensagens entre
+    os workers e, se um worker encerrar ou chegar um Ctrl+C, encerra os demais.'''
+    log_listener = setup_logging()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    log.info("Gateway com %d workers (pids %s) nas portas TCP %d e UDP %d.", len(children),
+             ', '.join(str(pid) for pid, _ in children), GATEWAY_TCP_PORT, GATEWAY_UDP_PORT)
+    try:
+        await workers.relay(children)
+    finally:
+        workers.stop(children)
+        log_listener.stop()
+
+async def main():
+    '''
+    Inicialização em duas etapas, para que um reinício não recuse conexões:
+        - primeiro as portas TCP e UDP passam a escutar: a partir daí o kernel já aceita
+         as conexões e guarda os datagramas, e os dispositivos que reconectam não caem no
+         backoff por conexão recusada;
+        - em seguida o registro é restaurado do journal, antes de qualquer conexão ser
+         atendida (o event loop só as atende quando main() cede a vez);
+        - o restante (métricas HTTP, histórico com numpy, regras, anúncios) sobe com o
+         Gateway já atendendo.'''
+    log_listener = setup_logging()
+    if NODE_NAME:
+        log.info("Nó %s de um cluster com %d nós.", NODE_NAME, len(CLUSTER))
+    if api_implementation.Type() == 'python':
+        log.warning("protobuf sem a implementação em C (upb): decodificação bem mais lenta.")
+    #SIGTERM (kill, systemd, docker) encerra como o Ctrl+C, gravando o journal e o histórico
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    if peers is not None:
+        log.info("Worker %d de %d.", WORKER_ID, WORKERS)
+        #sem o processo principal o worker fica isolado dos outros: encerra também
+        (await peers.start()).add_done_callback(lambda _: main_task.cancel())
+    raise_fd_limit()
+    tcp_server = await start_tcp_server()
+    udp_server = start_udp_server()
+    open_journal()
+    collect_metrics()
+    journal_task = asyncio.create_task(journal.run())
+    liveness_task = asyncio.create_task(liveness.run())
+    loop_monitor_task = asyncio.create_task(metrics.monitor_event_loop())
+    metrics_server = discovery_task = flush_task = None
+
+    try:
+        metrics_server = await start_metrics_server()
+        await open_timeseries()
+        flush_task = asyncio.create_task(periodic_flush())
+        open_rules()
+        #no modo --workers, o worker 1 faz os anúncios (um só para todo o Gateway): a réplica
+        #do registro dele tem os dispositivos de todos os workers, para o filtro e a carga
+        if WORKER_ID <= 1:
+            discovery_task = asyncio.create_task(periodic_discovery())
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        #antes das conexões caírem, senão o journal gravaria a remoção de todos
+        journal_task.cancel()
+        journal.close()
+        tcp_server.close()
+        if rules_engine is not None:
+            rules_engine.close()
+        if discovery_task is not None:
+            discovery_task.cancel()
+        if peers is not None:
+            peers.close()
+        if flush_task is not None:
+            flush_task.cancel()
+        liveness_task.cancel()
+        loop_monitor_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        udp_server.close()
+        if timeseries is not None:
+            timeseries.flush()
+        log_listener.stop()
+
+if __name__ == "__main__":
+    configure(parse_args())
+    try:
+        if WORKERS > 1:
+            asyncio.run(supervise(workers.prefork(WORKERS, run_worker)))
+        else:
+            asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,175 @@
+import asyncio
+import socket
+import struct
+import time
+from itertools import accumulate
+from google.protobuf.message import DecodeError
+from proto import smart_city_pb2
+
+MAX_DATAGRAM_SIZE = 65535
+MAX_DATAGRAMS_PER_WAKEUP = 512 #limite por rodada para não monopolizar o event loop
+UDP_RCVBUF = 4 * 1024 * 1024 #buffer do kernel para absorver rajadas entre as rodadas
+
+SENSOR_DATA_ID_TAG = 0x0A #campo 1 (device_id), tipo length-delimited
+SENSOR_DATA_VALUE_TAG = 0x15 #campo 2 (value), tipo 32 bits
+_FLOAT = struct.Struct('<f')
+
+class IngestCounters:
+    '''Contadores da ingestão UDP.'''
+
+    __slots__ = ('wakeups', 'datagrams', 'readings', 'batches', 'malformed', 'dropped')
+
+    def __init__(self):
+        self.wakeups = 0
+        self.datagrams = 0
+        self.readings = 0 #leituras aplicadas a sensores registrados
+        self.batches = 0 #datagramas SensorBatch
+        self.malformed = 0 #datagramas que não são SensorData nem SensorBatch válidos
+        self.dropped = 0 #leituras de ids desconhecidos ou que não são sensores
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def decode_sensor_data(data):
+    '''
+    Caminho rápido para o SensorData no formato em que os sensores o serializam: device_id
+    (tag, tamanho de um byte, texto) seguido do value (tag e float de 4 bytes), que o
+    proto3 omite quando vale 0. Devolve (device_id, valor) lendo os bytes diretamente,
+    sem mensagem protobuf, ou None para qualquer outro formato (SensorBatch inclusive),
+    que segue pelo parser do protobuf.'''
+    size = len(data)
+    if size < 3 or data[0] != SENSOR_DATA_ID_TAG or data[1] > 0x7F:
+        return None
+    end = 2 + data[1]
+    if end == size:
+        value = 0.0
+    elif end + 5 == size and data[end] == SENSOR_DATA_VALUE_TAG:
+        value = _FLOAT.unpack_from(data, end + 1)[0]
+    else:
+        return None
+    try:
+        return str(data[2:end], 'utf-8'), value
+    except UnicodeDecodeError:
+        return None
+
+class SensorDecoder:
+    '''
+    Decodifica datagramas de sensor (bytes ou memoryview) em
+    (device_id, [(timestamp_ms, valor), ...], se é um SensorBatch). Aceita SensorBatch e,
+    por compatibilidade, SensorData com uma única leitura, que recebe o instante de
+    chegada como timestamp.
+
+    O SensorData passa por decode_sensor_data; os demais datagramas são lidos em duas
+    mensagens protobuf criadas uma única vez e reaproveitadas (ParseFromString limpa a
+    mensagem antes de ler), em vez de duas mensagens novas por datagrama.'''
+
+    __slots__ = ('_batch', '_sensor_data')
+
+    def __init__(self):
+        self._batch = smart_city_pb2.SensorBatch()
+        self._sensor_data = smart_city_pb2.SensorData()
+
+    def decode(self, data, received_ms):
+        reading = decode_sensor_data(data)
+        if reading is not None:
+            return reading[0], [(received_ms, reading[1])], False
+
+        batch = self._batch
+        batch.ParseFromString(data)
+        values = batch.values
+        if values:
+            deltas = batch.timestamp_deltas_ms
+            if len(deltas) != len(values):
+                raise DecodeError("SensorBatch com deltas e valores de tamanhos diferentes")
+            #instantes absolutos somando os deltas a partir da base (o primeiro item é a própria base)
+            timestamps = accumulate(deltas, initial=batch.base_timestamp_ms)
+            next(timestamps)
+            return batch.device_id, list(zip(timestamps, values)), True
+
+        sensor_data = self._sensor_data
+        sensor_data.ParseFromString(data)
+        if not sensor_data.device_id:
+            raise DecodeError("Datagrama sem device_id")
+        return sensor_data.device_id, [(received_ms, sensor_data.value)], False
+
+class UdpIngest:
+    '''
+    Recebe os dados dos sensores pela porta UDP do Gateway.
+
+    Em vez de tratar um datagrama por callback, o socket fica não bloqueante e a cada
+    vez que o event loop indica que há dados, _drain lê todos os datagramas disponíveis
+    (até MAX_DATAGRAMS_PER_WAKEUP) e só então aplica as mudanças em bloco:
+        - cada datagrama é recebido com recv_into no mesmo bytearray, alocado uma vez, e
+         decodificado a partir de uma memoryview dele pelo SensorDecoder, sem bytes novos;
+        - o registro recebe apenas a leitura mais recente de cada sensor da rodada;
+        - os listeners (add_listener) recebem todas as leituras da rodada como uma lista
+         de (device_id, timestamp_ms, valor), para quem precisa do histórico completo.'''
+
+    def __init__(self, registry, port):
+        self.registry = registry
+        self.port = port
+        self.reuse_port = False #True no modo --workers: todos os workers escutam a mesma porta
+        self.counters = IngestCounters()
+        self.decoder = SensorDecoder()
+        self._listeners = []
+        self._sock = None
+        self._view = memoryview(bytearray(MAX_DATAGRAM_SIZE))
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        sock.setblocking(False)
+        self._sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._drain)
+
+    def close(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+    def _drain(self):
+        counters = self.counters
+        counters.wakeups += 1
+        received_ms = int(time.time() * 1000)
+        latest = {}
+        readings = []
+        recv_into = self._sock.recv_into
+        view = self._view
+        decode = self.decoder.decode
+
+        for _ in range(MAX_DATAGRAMS_PER_WAKEUP):
+            try:
+                size = recv_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            counters.datagrams += 1
+            try:
+                device_id, device_readings, is_batch = decode(view[:size], received_ms)
+            except DecodeError:
+                counters.malformed += 1
+                continue
+            if is_batch:
+                counters.batches += 1
+
+            record = self.registry.get(device_id)
+            if record is None or record.type != smart_city_pb2.DeviceType.TEMP_SENSOR:
+                counters.dropped += len(device_readings)
+                continue
+
+            counters.readings += len(device_readings)
+            latest[device_id] = device_readings[-1][1]
+            if self._listeners:
+                readings.extend((device_id, timestamp, value) for timestamp, value in device_readings)
+
+        for device_id, value in latest.items():
+            self.registry.set_reading(device_id, value)
+        if readings:
+            for listener in self._listeners:
+                listener(readings)
@@ -0,0 +1,219 @@
+import asyncio
+import glob
+import logging
+import mmap
+import os
+import time
+from google.protobuf.message import DecodeError
+from proto import smart_city_pb2
+from proto.framing import FrameError, encode_message, iter_frames
+
+JOURNAL_FLUSH_INTERVAL = 1 #segundos acumulando mudanças antes de gravá-las no log
+COMPACT_MIN_BYTES = 4 * 1024 * 1024 #o log só é compactado depois de passar deste tamanho...
+COMPACT_RATIO = 4 #...e de ficar esse número de vezes maior que o snapshot
+PENDING_RECONNECT_TIMEOUT = 90 #segundos para um dispositivo restaurado voltar (três pulsos de descoberta)
+
+log = logging.getLogger('gateway.journal')
+
+def _stored(record):
+    stored = smart_city_pb2.StoredDevice()
+    record.fill_info(stored.info)
+    stored.info.pending_reconnect = False
+    stored.address = record.address
+    stored.port = record.port
+    return stored
+
+def _write_snapshot(path, rows):
+    '''
+    Grava o snapshot a partir das linhas copiadas do registro, com fsync, e troca o
+    arquivo com rename. Roda fora do event loop na compactação em segundo plano.'''
+    stored = smart_city_pb2.StoredDevice()
+    with open(path + '.tmp', 'wb') as f:
+        for device_id, device_type, status, zone, address, port in rows:
+            stored.info.id = device_id
+            stored.info.type = device_type
+            stored.info.status = status
+            stored.info.zone = zone
+            stored.address = address
+            stored.port = port
+            f.write(encode_message(stored))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(path + '.tmp', path)
+    return size
+
+class RegistryJournal:
+    '''
+    Guarda o registro em disco para que um Gateway reiniciado já responda list_devices
+    com os dispositivos e o último estado de cada um, em vez de esperar todos ouvirem o
+    próximo DISCOVER:
+        - snapshot-<geração>.bin: todos os dispositivos na última compactação;
+        - journal-<geração>.log: log append-only com as mudanças desde aquele snapshot,
+         um StoredDevice por mudança (remoções inclusive). As mudanças são acumuladas por
+         id e gravadas a cada JOURNAL_FLUSH_INTERVAL, então um sensor que muda dez vezes
+         por segundo gera uma entrada por intervalo;
+        - a compactação grava o snapshot da próxima geração a partir do registro, troca o
+         arquivo com rename e só então abre o log novo e apaga os antigos. Uma queda no
+         meio do processo deixa sempre um par snapshot/log consistente. Em run(), o
+         registro é copiado no event loop e a gravação e o fsync do snapshot rodam num
+         executor, então compactar 100 mil dispositivos não trava as conexões.
+
+    Durabilidade: o snapshot passa por fsync; o log só por flush() a cada
+    JOURNAL_FLUSH_INTERVAL, o que sobrevive à queda do processo, mas não à do sistema
+    ou de energia, em que se perdem as mudanças ainda não gravadas pelo sistema
+    operacional. Como todos os dispositivos reconectam de qualquer forma, o journal só
+    adianta a lista; ele não é a fonte da verdade.
+    Na inicialização, load() mapeia os arquivos em memória, aplica o log sobre o snapshot
+    e restaura os dispositivos como pendentes de reconexão (registry.restore). A
+    compactação que começa a geração seguinte fica para o primeiro flush(), já com o
+    Gateway atendendo conexões. Os que não voltarem em PENDING_RECONNECT_TIMEOUT
+    segundos são removidos.
+
+    No modo --workers, cada worker tem o seu diretório e só grava os dispositivos
+    conectados a ele.'''
+
+    def __init__(self, registry, directory, worker=0):
+        self.registry = registry
+        self.directory = directory
+        self.worker = worker
+        self.generation = 0
+        self._pending = {} #id -> (DeviceRecord, removido) ainda não gravados
+        self._log = None
+        self._log_size = 0
+        self._snapshot_size = 0
+
+    def _path(self, kind, generation):
+        extension = 'bin' if kind == 'snapshot' else 'log'
+        return os.path.join(self.directory, f"{kind}-{generation:08d}.{extension}")
+
+    def _read(self, path, devices):
+        '''Aplica os StoredDevice de um arquivo (snapshot ou log) ao dicionário devices.'''
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for frame in iter_frames(data):
+                stored = smart_city_pb2.StoredDevice()
+                try:
+                    stored.ParseFromString(frame)
+                finally:
+                    #sem isso, um registro corrompido impede o mmap de fechar
+                    frame.release()
+                if stored.removed:
+                    devices.pop(stored.info.id, None)
+                else:
+                    devices[stored.info.id] = stored
+
+    def load(self):
+        '''
+        Lê o snapshot mais recente e o seu log e restaura os dispositivos no registro.
+        As mudanças seguintes ficam acumuladas até o primeiro flush() compactar (os
+        dispositivos restaurados viram o snapshot da próxima geração) e abrir o log novo.
+        Devolve quantos dispositivos foram restaurados.'''
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = sorted(glob.glob(os.path.join(self.directory, 'snapshot-*.bin')))
+        if snapshots:
+            self.generation = int(os.path.basename(snapshots[-1])[9:17])
+
+        started = time.perf_counter()
+        devices = {}
+        try:
+            self._read(self._path('snapshot', self.generation), devices)
+            self._read(self._path('journal', self.generation), devices)
+        except (FrameError, DecodeError) as e:
+            log.warning("Journal do registro corrompido (%s); usando o que foi lido até o erro.", e)
+
+        for stored in devices.values():
+            info = stored.info
+            self.registry.restore(info.id, info.type, info.status, info.zone,
+                                  stored.address, stored.port, self.worker)
+        if devices:
+            log.info("%d dispositivos restaurados do disco em %.1f ms; aguardando reconexão.",
+                     len(devices), (time.perf_counter() - started) * 1000)
+        self.registry.add_listener(self.on_change)
+        return len(devices)
+
+    def on_change(self, record, removed):
+        if record.worker == self.worker:
+            self._pending[record.id] = (record, removed)
+
+    def flush(self):
+        '''
+        Grava no log as mudanças acumuladas. Devolve True se é hora de compactar: o log
+        cresceu demais, ou ainda não há log (o primeiro depois de load(); o snapshot do
+        registro já inclui as mudanças acumuladas).'''
+        if self._log is None:
+            return True
+        if not self._pending:
+            return False
+        pending, self._pending = self._pending, {}
+        frames = []
+        for device_id, (record, removed) in pending.items():
+            if removed:
+                stored = smart_city_pb2.StoredDevice()
+                stored.info.id = device_id
+                stored.removed = True
+            else:
+                stored = _stored(record)
+            frames.append(encode_message(stored))
+        data = b''.join(frames)
+        self._log.write(data)
+        self._log.flush()
+        self._log_size += len(data)
+        return self._log_size >= COMPACT_MIN_BYTES and self._log_size >= COMPACT_RATIO * self._snapshot_size
+
+    def _begin_compact(self):
+        '''
+        Copia o registro para o snapshot da próxima geração. As mudanças acumuladas até
+        aqui já estão na cópia; as seguintes vão para o log novo.'''
+        self.generation += 1
+        rows = [(record.id, record.type, record.status_text, record.zone, record.address, record.port)
+                for record in self.registry if record.worker == self.worker]
+        self._pending.clear()
+        return self.generation, rows
+
+    def _finish_compact(self, generation, size):
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self._path('journal', generation), 'ab')
+        self._log_size = 0
+        self._snapshot_size = size
+        current = {self._path('snapshot', generation), self._path('journal', generation)}
+        for old in glob.glob(os.path.join(self.directory, '*-*.*')):
+            if old not in current:
+                os.remove(old)
+
+    def compact(self):
+        '''Grava um snapshot novo com os dispositivos deste processo e recomeça o log.'''
+        generation, rows = self._begin_compact()
+        self._finish_compact(generation, _write_snapshot(self._path('snapshot', generation), rows))
+
+    async def compact_async(self):
+        '''compact() com a gravação e o fsync do snapshot num executor.'''
+        generation, rows = self._begin_compact()
+        size = await asyncio.get_running_loop().run_in_executor(
+            None, _write_snapshot, self._path('snapshot', generation), rows)
+        self._finish_compact(generation, size)
+
+    def close(self):
+        '''Grava um snapshot final; chamado no encerramento, antes de as conexões caírem.'''
+        self.registry.remove_listener(self.on_change)
+        self.compact()
+        self._log.close()
+        self._log = None
+
+    def expire_pending(self):
+        '''Remove os dispositivos restaurados que não reconectaram.'''
+        expired = [record.id for record in self.registry if record.pending and record.worker == self.worker]
+        for device_id in expired:
+            self.registry.remove(device_id)
+        if expired:
+            log.info("%d dispositivos restaurados não reconectaram em %ds; removidos.",
+                     len(expired), PENDING_RECONNECT_TIMEOUT)
+
+    async def run(self):
+        asyncio.get_running_loop().call_later(PENDING_RECONNECT_TIMEOUT, self.expire_pending)
+        while True:
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            if self.flush():
+                await self.compact_async()
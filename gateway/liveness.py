@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from gateway import metrics
+from gateway.timer_wheel import TimerWheel
+
+DEFAULT_HEARTBEAT_INTERVAL_MS = 5000 #usado até o dispositivo informar o seu intervalo
+MISSED_HEARTBEATS = 3 #intervalos sem notícias antes de remover o dispositivo
+TICK_SECONDS = 0.25 #resolução do timer wheel
+
+log = logging.getLogger('gateway.liveness')
+
+class LivenessMonitor:
+    '''
+    Remove dispositivos que pararam de dar sinal de vida, inclusive os de conexões
+    meio abertas, que nunca recebem um fechamento do TCP.
+
+    Cada dispositivo tem um prazo: MISSED_HEARTBEATS vezes o seu intervalo de heartbeat,
+    contado a partir da última mensagem recebida dele. Receber uma mensagem (touch) só
+    atualiza o prazo no dicionário; o timer wheel guarda no máximo uma entrada por
+    dispositivo e, quando ela vence, o prazo real é conferido: se foi adiado, a entrada
+    é reagendada, se não, o dispositivo expira. Assim um heartbeat custa uma escrita num
+    dict, e cada tick só processa os prazos que vencem nele.'''
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.wheel = TimerWheel(TICK_SECONDS, time.monotonic())
+        self._deadlines = {} #id -> [prazo (monotonic), timeout em segundos]
+        registry.add_listener(self.on_change)
+
+    def on_change(self, record, removed):
+        if record.outbox is None:
+            return #conexão em outro worker, que cuida do prazo dele
+        if removed:
+            self._deadlines.pop(record.id, None)
+            self.wheel.cancel(record.id)
+        elif record.id not in self._deadlines:
+            timeout = DEFAULT_HEARTBEAT_INTERVAL_MS * MISSED_HEARTBEATS / 1000
+            deadline = time.monotonic() + timeout
+            self._deadlines[record.id] = [deadline, timeout]
+            self.wheel.schedule(record.id, deadline)
+
+    def touch(self, device_id, interval_ms=0):
+        '''Registra que o dispositivo deu sinal de vida; interval_ms vem do Heartbeat.'''
+        entry = self._deadlines.get(device_id)
+        if entry is None:
+            return
+        if interval_ms:
+            entry[1] = interval_ms * MISSED_HEARTBEATS / 1000
+        entry[0] = time.monotonic() + entry[1]
+
+    def expire_due(self, now):
+        '''Remove do registro os dispositivos cujo prazo venceu e fecha suas conexões.'''
+        expired = 0
+        for device_id in self.wheel.advance(now):
+            entry = self._deadlines.get(device_id)
+            if entry is None:
+                continue
+            if entry[0] > now:
+                self.wheel.schedule(device_id, entry[0])
+                continue
+            record = self.registry.remove(device_id)
+            if record is not None:
+                record.outbox.close()
+                metrics.DEVICE_EXPIRATIONS.inc()
+                log.info("Dispositivo %s sem heartbeat há %.1fs; removido.", device_id, entry[1])
+                expired += 1
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            self.expire_due(time.monotonic())
@@ -0,0 +1,70 @@
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from gateway import metrics
+
+LOG_LEVEL = os.environ.get('GATEWAY_LOG_LEVEL', 'INFO') #DEBUG mostra também cada mudança de estado
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+LOG_QUEUE_SIZE = 10000 #mensagens aguardando a thread de escrita; além disso são descartadas
+RATE_LIMIT_PER_SECOND = 10 #mensagens por segundo de um mesmo modelo (logger + texto sem argumentos)
+RATE_LIMIT_BURST = 50
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Limita a taxa de cada modelo de mensagem com um token bucket: uma tempestade de
+    "Dispositivo registrado" durante um reinício não inunda o terminal nem ocupa o
+    event loop formatando linhas. As mensagens descartadas são contadas, e a próxima
+    mensagem aceita do mesmo modelo informa quantas foram suprimidas.'''
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {} #(logger, msg) -> [tokens, último instante, suprimidas]
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            metrics.LOG_SUPPRESSED.inc()
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.msg} (+{bucket[2]} mensagens semelhantes suprimidas)"
+            bucket[2] = 0
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    '''QueueHandler que descarta a mensagem, em vez de bloquear ou falhar, se a fila estiver cheia.'''
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_SUPPRESSED.inc()
+
+def setup_logging(level=LOG_LEVEL):
+    '''
+    Configura o logger "gateway": o event loop só filtra a mensagem e a coloca numa fila,
+    e uma thread separada (QueueListener) faz a escrita no terminal. Devolve o listener,
+    que deve ser parado no encerramento para esvaziar a fila.'''
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(RateLimitFilter())
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(handler.queue, output)
+
+    logger = logging.getLogger('gateway')
+    logger.setLevel(level)
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    listener.start()
+    return listener
@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import math
+import time
+from bisect import bisect_left
+from proto.metrics_text import escape_label, merge_texts
+
+METRICS_PORT = 9100 #porta HTTP do endpoint /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#limites (em segundos) dos buckets dos histogramas de latência
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) #o último é o bucket +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Metric:
+    '''
+    Base das métricas: cada combinação de valores de label tem seu próprio valor
+    (labels(...) devolve o valor dessa combinação, criado na primeira vez). Métricas
+    sem labels repassam inc/set/observe direto para o único valor.
+
+    Com set_function, o valor é lido só na hora da coleta: serve para expor contadores
+    que já existem em outros objetos (IngestCounters, tamanho do registro) sem custo
+    nenhum no caminho quente. A função devolve um número ou, para métricas com labels,
+    um dict {tupla de valores de label: número}.'''
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        if not self.labelnames:
+            self._values[()] = self._new_value()
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def labels(self, *values):
+        value = self._values.get(values)
+        if value is None:
+            value = self._values[values] = self._new_value()
+        return value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            for labels, value in self._values.items():
+                yield self.name, labels, '', value.value
+            return
+        result = self._function()
+        items = result.items() if isinstance(result, dict) else [((), result)]
+        for labels, value in items:
+            yield self.name, labels, '', value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._values[()].inc(amount)
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value):
+        self._values[()].set(value)
+
+    def inc(self, amount=1):
+        self._values[()].inc(amount)
+
+    def dec(self, amount=1):
+        self._values[()].dec(amount)
+
+class Histogram(Metric):
+    '''Histograma com buckets fixos; observe() custa um bisect e duas somas.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._values[()].observe(value)
+
+    def _samples(self):
+        for labels, value in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), value.counts):
+                cumulative += count
+                yield self.name + '_bucket', labels, f'le="{_format_value(bound)}"', cumulative
+            yield self.name + '_sum', labels, '', value.sum
+            yield self.name + '_count', labels, '', cumulative
+
+class MetricsRegistry:
+    '''Conjunto de métricas expostas juntas no formato de texto do Prometheus.'''
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+#métricas do Gateway; os módulos atualizam estes objetos diretamente
+REGISTRY = MetricsRegistry()
+
+TCP_ACCEPTS = REGISTRY.counter(
+    'gateway_tcp_accepts_total', "Conexões TCP aceitas, por tipo de cliente.", ('kind',))
+DEVICE_REGISTRATIONS = REGISTRY.counter(
+    'gateway_device_registrations_total', "Dispositivos registrados (inclui re-registros).")
+DEVICE_REMOVALS = REGISTRY.counter(
+    'gateway_device_removals_total', "Dispositivos removidos ao fechar a conexão.")
+DEVICE_EXPIRATIONS = REGISTRY.counter(
+    'gateway_device_expirations_total', "Dispositivos removidos por falta de heartbeat.")
+DEVICE_ADMISSIONS_REJECTED = REGISTRY.counter(
+    'gateway_device_admissions_rejected_total', "Conexões de dispositivos recusadas pelo limite de admissão.")
+DISCOVERY_ANNOUNCEMENTS = REGISTRY.counter(
+    'gateway_discovery_announcements_total', "Anúncios DISCOVER enviados por multicast.")
+HEARTBEATS = REGISTRY.counter(
+    'gateway_heartbeats_total', "Heartbeats recebidos dos dispositivos.")
+TRACKED_DEVICES = REGISTRY.gauge(
+    'gateway_liveness_tracked_devices', "Dispositivos com prazo de heartbeat no timer wheel.")
+DEVICES = REGISTRY.gauge(
+    'gateway_devices', "Dispositivos registrados no momento, por tipo.", ('type',))
+REGISTRY_VERSION = REGISTRY.gauge(
+    'gateway_registry_version', "Versão do registro (número de mudanças desde o início).")
+UDP_DATAGRAMS = REGISTRY.counter(
+    'gateway_udp_datagrams_total', "Datagramas UDP recebidos, por resultado.", ('result',))
+UDP_READINGS = REGISTRY.counter(
+    'gateway_udp_readings_total', "Leituras de sensores recebidas por UDP, por resultado.", ('result',))
+UDP_WAKEUPS = REGISTRY.counter(
+    'gateway_udp_wakeups_total', "Rodadas de leitura do socket UDP.")
+CLIENT_REQUESTS = REGISTRY.counter(
+    'gateway_client_requests_total', "Requisições de clientes web, por tipo.", ('type',))
+LIST_SERIALIZE_SECONDS = REGISTRY.histogram(
+    'gateway_list_devices_serialize_seconds', "Tempo para montar a resposta de list_devices/query_devices.")
+COMMAND_ROUND_TRIP_SECONDS = REGISTRY.histogram(
+    'gateway_command_round_trip_seconds', "Tempo entre enviar um comando e receber a confirmação do dispositivo.")
+COMMANDS = REGISTRY.counter(
+    'gateway_commands_total', "Comandos enviados a dispositivos, por resultado.", ('outcome',))
+RULE_EVALUATIONS = REGISTRY.counter(
+    'gateway_rule_evaluations_total', "Avaliações de regras de automação (uma por regra afetada por mudança).")
+RULE_FIRINGS = REGISTRY.counter(
+    'gateway_rule_firings_total', "Comandos disparados por regras de automação, por regra.", ('rule',))
+SUBSCRIBERS = REGISTRY.gauge(
+    'gateway_subscribers', "Clientes web inscritos nas mudanças de estado.")
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    'gateway_event_loop_lag_seconds', "Atraso do event loop: quanto uma tarefa pronta espera para rodar.")
+LOG_SUPPRESSED = REGISTRY.counter(
+    'gateway_log_messages_suppressed_total', "Mensagens de log descartadas pelo limite de taxa ou fila cheia.")
+
+EVENT_LOOP_LAG_INTERVAL = 0.25 #segundos entre medições do atraso do event loop
+
+async def monitor_event_loop():
+    '''
+    Mede periodicamente quanto um sleep atrasa além do pedido. O registro não tem lock
+    (tudo roda no mesmo event loop), então esse atraso é o equivalente à espera por lock:
+    o tempo que uma conexão pronta para rodar espera enquanto outra usa o loop.'''
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - EVENT_LOOP_LAG_INTERVAL))
+
+async def render_local():
+    return REGISTRY.render()
+
+async def handle_http(reader, writer, render=render_local):
+    '''Servidor HTTP mínimo: responde GET /metrics (com o texto de render()) e 404 para o resto.'''
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', (await render()).encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(port=METRICS_PORT, render=render_local, reuse_port=False):
+    return await asyncio.start_server(functools.partial(handle_http, render=render), '', port,
+                                      reuse_address=True, reuse_port=reuse_port or None)
@@ -0,0 +1,203 @@
+import enum
+import re
+from proto import smart_city_pb2
+
+LAMP = smart_city_pb2.DeviceType.LAMP
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+class LampState(enum.IntEnum):
+    OFF = 0
+    ON = 1
+
+def parse_status(device_type, text):
+    '''
+    Converte o status textual enviado pelos dispositivos no valor tipado guardado no registro:
+        - LAMP: "ON"/"OFF" -> LampState;
+        - TEMP_SENSOR: "25°C" -> 25.0 (float), ou None se não houver número;
+        - outros tipos mantêm o texto.'''
+    if device_type == LAMP:
+        return LampState.ON if text == "ON" else LampState.OFF
+    if device_type == TEMP_SENSOR:
+        match = _NUMBER.search(text)
+        return float(match.group()) if match else None
+    return text
+
+def format_status(device_type, status):
+    '''Operação inversa de parse_status, usada só ao montar as respostas para os clientes.'''
+    if status is None:
+        return ""
+    if device_type == LAMP:
+        return status.name
+    if device_type == TEMP_SENSOR:
+        return f"{int(status)}°C"
+    return status
+
+class DeviceRecord:
+    '''Estado de um dispositivo registrado. Usa __slots__ para ocupar o mínimo por dispositivo.'''
+
+    __slots__ = ('id', 'type', 'status', 'zone', 'address', 'port', 'outbox', 'worker', 'pending')
+
+    def __init__(self, device_id, device_type, status, zone, address, port, outbox, worker=0):
+        self.id = device_id
+        self.type = device_type
+        self.status = status
+        self.zone = zone
+        self.address = address
+        self.port = port
+        self.outbox = outbox #DeviceOutbox da conexão TCP do dispositivo; None se ela está em outro worker
+        self.worker = worker #worker com a conexão (modo --workers); 0 com um só processo
+        self.pending = False #restaurado do journal, aguardando o dispositivo reconectar
+
+    @property
+    def status_text(self):
+        return format_status(self.type, self.status)
+
+    def fill_info(self, device_info_proto):
+        device_info_proto.id = self.id
+        device_info_proto.type = self.type
+        device_info_proto.status = self.status_text
+        device_info_proto.zone = self.zone
+        device_info_proto.pending_reconnect = self.pending
+
+    def __repr__(self):
+        return (f"DeviceRecord(id={self.id!r}, type={smart_city_pb2.DeviceType.Name(self.type)}, "
+                f"status={self.status_text!r}, zone={self.zone!r}, address={self.address!r}, port={self.port})")
+
+class DeviceRegistry:
+    '''
+    Registro dos dispositivos conectados ao Gateway:
+        - _by_id: id -> DeviceRecord, índice principal;
+        - _by_type: DeviceType -> {id: DeviceRecord}, para listar/filtrar por tipo sem
+         percorrer todos os dispositivos;
+        - _by_zone: zona -> {id: DeviceRecord}, para comandos e consultas por grupo;
+        - _by_address: endereço IP -> {id: DeviceRecord};
+        - version: incrementada a cada mudança, permite a quem lê saber se algo mudou.
+
+    O registro é usado apenas dentro do event loop do Gateway, então não há lock:
+    leituras e escritas nunca são concorrentes e a ingestão UDP não espera por ninguém.
+    Toda mudança é repassada aos listeners como listener(record, removed).'''
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_type = {}
+        self._by_zone = {}
+        self._by_address = {}
+        self._listeners = []
+        self.version = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _changed(self, record, removed=False):
+        self.version += 1
+        for listener in self._listeners:
+            listener(record, removed)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, device_id):
+        return device_id in self._by_id
+
+    def get(self, device_id):
+        return self._by_id.get(device_id)
+
+    def by_type(self, device_type):
+        return self._by_type.get(device_type, {}).values()
+
+    def by_zone(self, zone):
+        return self._by_zone.get(zone, {}).values()
+
+    def by_address(self, address):
+        return self._by_address.get(address, {}).values()
+
+    def register(self, device_id, device_type, status_text, zone, address, port, outbox, worker=0):
+        '''
+        Registra um dispositivo a partir do seu DiscoveryPacket. Se o id já existir, o
+        registro antigo é removido antes (os listeners veem a remoção e o novo registro).'''
+        return self._add(DeviceRecord(device_id, device_type, parse_status(device_type, status_text),
+                                      zone, address, port, outbox, worker))
+
+    def restore(self, device_id, device_type, status_text, zone, address, port, worker=0):
+        '''
+        Registra um dispositivo lido do journal num reinício: fica com o último estado
+        conhecido, sem conexão, e pendente até se registrar de novo (register o substitui).'''
+        record = DeviceRecord(device_id, device_type, parse_status(device_type, status_text),
+                              zone, address, port, None, worker)
+        record.pending = True
+        return self._add(record)
+
+    def _add(self, record):
+        old = self._by_id.pop(record.id, None)
+        if old is not None:
+            self._unindex(old)
+            self._changed(old, removed=True)
+        self._index(record)
+        self._changed(record)
+        return record
+
+    def set_status(self, device_id, status):
+        '''Atualiza o status tipado de um dispositivo. Devolve True se o valor mudou.'''
+        record = self._by_id.get(device_id)
+        if record is None or record.status == status:
+            return False
+        record.status = status
+        self._changed(record)
+        return True
+
+    def set_reading(self, device_id, value):
+        '''Atualiza a leitura de um sensor de temperatura; ids que não são sensores são ignorados.'''
+        record = self._by_id.get(device_id)
+        if record is None or record.type != TEMP_SENSOR or record.status == value:
+            return False
+        record.status = value
+        self._changed(record)
+        return True
+
+    def set_status_text(self, device_id, status_text):
+        record = self._by_id.get(device_id)
+        if record is None:
+            return False
+        return self.set_status(device_id, parse_status(record.type, status_text))
+
+    def remove(self, device_id, outbox=None):
+        '''
+        Remove um dispositivo. Se outbox for informado, só remove se o registro ainda
+        pertencer a essa conexão: um dispositivo que reconectou antes da conexão antiga
+        cair não pode perder o registro novo.'''
+        record = self._by_id.get(device_id)
+        if record is None or (outbox is not None and record.outbox is not outbox):
+            return None
+        del self._by_id[device_id]
+        self._unindex(record)
+        self._changed(record, removed=True)
+        return record
+
+    def _index(self, record):
+        self._by_id[record.id] = record
+        self._by_type.setdefault(record.type, {})[record.id] = record
+        self._by_zone.setdefault(record.zone, {})[record.id] = record
+        self._by_address.setdefault(record.address, {})[record.id] = record
+
+    def _unindex(self, record):
+        by_type = self._by_type.get(record.type)
+        if by_type is not None:
+            by_type.pop(record.id, None)
+        by_zone = self._by_zone.get(record.zone)
+        if by_zone is not None:
+            by_zone.pop(record.id, None)
+            if not by_zone:
+                del self._by_zone[record.zone]
+        by_address = self._by_address.get(record.address)
+        if by_address is not None:
+            by_address.pop(record.id, None)
+            if not by_address:
+                del self._by_address[record.address]
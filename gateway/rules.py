@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import os
+from proto import smart_city_pb2
+from gateway import metrics
+
+RULES_FILE = 'rules.json' #regras carregadas na inicialização, se o arquivo existir
+DEFAULT_HOLD_SECONDS = 5 #tempo que a condição precisa se manter antes de a regra agir
+
+UNKNOWN = smart_city_pb2.DeviceType.UNKNOWN
+Outcome = smart_city_pb2.CommandResult.Outcome
+
+log = logging.getLogger('gateway.rules')
+
+class RuleError(ValueError):
+    '''Regra inválida no arquivo de regras.'''
+
+def _device_type(name, rule_name):
+    if not name:
+        return UNKNOWN
+    try:
+        return smart_city_pb2.DeviceType.Value(name)
+    except ValueError:
+        raise RuleError(f"Regra {rule_name!r}: tipo de dispositivo desconhecido {name!r}.") from None
+
+def _bulk(spec, rule_name):
+    '''BulkCommand de uma ação ("then"/"otherwise"): action e os mesmos filtros do comando em grupo.'''
+    if not spec.get('action'):
+        raise RuleError(f"Regra {rule_name!r}: ação sem 'action'.")
+    bulk = smart_city_pb2.BulkCommand()
+    bulk.action = spec['action']
+    bulk.type = _device_type(spec.get('type'), rule_name)
+    bulk.zone = spec.get('zone', "")
+    bulk.id_prefix = spec.get('id_prefix', "")
+    bulk.device_ids.extend(spec.get('device_ids', ()))
+    bulk.timeout_ms = spec.get('timeout_ms', 0)
+    return bulk
+
+class Condition:
+    '''
+    Condição sobre o estado de um dispositivo. Os dispositivos observados são escolhidos
+    por device_id ou por tipo e zona (vazios = qualquer um), e o estado é comparado com
+    above/below (leituras numéricas, como a dos sensores) ou equals (texto do status,
+    como "ON" de um poste).'''
+
+    __slots__ = ('device_id', 'type', 'zone', 'above', 'below', 'equals')
+
+    def __init__(self, spec, rule_name):
+        self.device_id = spec.get('device_id', "")
+        self.type = _device_type(spec.get('type'), rule_name)
+        self.zone = spec.get('zone', "")
+        self.above = spec.get('above')
+        self.below = spec.get('below')
+        self.equals = spec.get('equals')
+        if self.above is None and self.below is None and self.equals is None:
+            raise RuleError(f"Regra {rule_name!r}: condição sem 'above', 'below' ou 'equals'.")
+
+    @property
+    def key(self):
+        '''Chave do índice do RulesEngine: um id, ou (tipo, zona) com curingas.'''
+        if self.device_id:
+            return (self.device_id, UNKNOWN, "")
+        return ("", self.type, self.zone)
+
+    def test(self, record):
+        if self.equals is not None:
+            return record.status_text == self.equals
+        value = record.status
+        if not isinstance(value, (int, float)):
+            return False
+        return (self.above is None or value > self.above) and (self.below is None or value < self.below)
+
+class Rule:
+    '''
+    Uma automação: quando a condição vale para algum dos dispositivos observados por
+    hold_seconds seguidos, envia o comando "then"; quando deixa de valer pelo mesmo
+    tempo, envia "otherwise" (opcional). Uma condição que oscila dentro desse tempo
+    não dispara nada.'''
+
+    __slots__ = ('name', 'condition', 'then', 'otherwise', 'hold', 'matching', 'active', 'target', 'timer')
+
+    def __init__(self, spec):
+        self.name = spec.get('name') or "sem nome"
+        if 'when' not in spec or 'then' not in spec:
+            raise RuleError(f"Regra {self.name!r}: 'when' e 'then' são obrigatórios.")
+        self.condition = Condition(spec['when'], self.name)
+        self.then = _bulk(spec['then'], self.name)
+        self.otherwise = _bulk(spec['otherwise'], self.name) if spec.get('otherwise') else None
+        self.hold = spec.get('hold_seconds', DEFAULT_HOLD_SECONDS)
+        self.matching = set() #ids dos dispositivos para os quais a condição vale agora
+        self.active = False #último lado disparado ("then" = True)
+        self.target = False #lado para onde a condição foi, aguardando hold
+        self.timer = None
+
+def parse_rules(specs):
+    if not isinstance(specs, list):
+        raise RuleError("O arquivo de regras deve conter uma lista de regras.")
+    return [Rule(spec) for spec in specs]
+
+def load_rules(path=RULES_FILE):
+    '''Regras do arquivo JSON em path; nenhuma se o arquivo não existir.'''
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        try:
+            return parse_rules(json.load(f))
+        except json.JSONDecodeError as e:
+            raise RuleError(f"Arquivo de regras {path} inválido: {e}") from None
+
+class RulesEngine:
+    '''
+    Automações avaliadas no Gateway a cada mudança do registro, sem varreduras:
+        - é listener do registro, então recebe tanto as leituras UDP dos sensores quanto
+         os DiscoveryPacket de estado dos postes;
+        - as regras ficam indexadas pela chave da condição (id, ou tipo e zona), e cada
+         mudança só avalia as regras das chaves que casam com o dispositivo: o próprio id,
+         (tipo, zona), (tipo, qualquer), (qualquer, zona) e (qualquer, qualquer);
+        - cada regra guarda o conjunto de dispositivos para os quais a condição vale, então
+         avaliar uma mudança é um teste e uma operação de conjunto;
+        - a mudança de lado da condição agenda o disparo para hold segundos depois (debounce),
+         e voltar antes disso cancela o agendamento;
+        - os comandos saem pelo CommandDispatcher (send_bulk), como um comando em grupo de
+         um cliente web, com confirmação de cada dispositivo.
+
+    Em cluster, cada nó avalia as regras com os seus dispositivos: a condição e os alvos de
+    uma regra precisam estar no mesmo nó. No modo --workers, só o worker 1 avalia, com a
+    réplica completa do registro, e o dispatcher encaminha os comandos aos outros workers.'''
+
+    def __init__(self, registry, dispatcher, rules=()):
+        self.registry = registry
+        self.dispatcher = dispatcher
+        self.rules = []
+        self.evaluations = 0
+        self._index = {} #chave da condição -> [Rule]
+        self._tasks = set()
+        for rule in rules:
+            self.add_rule(rule)
+        registry.add_listener(self.on_change)
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self._index.setdefault(rule.condition.key, []).append(rule)
+        #dispositivos já registrados entram no estado inicial, sem disparar a regra por si
+        for record in self.registry:
+            if self._observes(rule, record) and not record.pending and rule.condition.test(record):
+                rule.matching.add(record.id)
+        rule.active = rule.target = bool(rule.matching)
+
+    @staticmethod
+    def _observes(rule, record):
+        condition = rule.condition
+        if condition.device_id:
+            return condition.device_id == record.id
+        return (condition.type in (UNKNOWN, record.type)) and condition.zone in ("", record.zone)
+
+    def _rules_for(self, record):
+        keys = [(record.id, UNKNOWN, ""), ("", UNKNOWN, "")]
+        if record.type != UNKNOWN:
+            keys.append(("", record.type, ""))
+        if record.zone:
+            keys.append(("", UNKNOWN, record.zone))
+            if record.type != UNKNOWN:
+                keys.append(("", record.type, record.zone))
+        for key in keys:
+            rules = self._index.get(key)
+            if rules:
+                yield from rules
+
+    def on_change(self, record, removed):
+        for rule in self._rules_for(record):
+            self.evaluations += 1
+            if not removed and not record.pending and rule.condition.test(record):
+                rule.matching.add(record.id)
+            else:
+                rule.matching.discard(record.id)
+            satisfied = bool(rule.matching)
+            if satisfied != rule.target:
+                self._flip(rule, satisfied)
+
+    def _flip(self, rule, satisfied):
+        rule.target = satisfied
+        if rule.timer is not None:
+            rule.timer.cancel()
+            rule.timer = None
+        if satisfied != rule.active:
+            #nunca dispara dentro do listener: o registro ainda está no meio da mudança
+            rule.timer = asyncio.get_running_loop().call_later(rule.hold, self._fire, rule)
+
+    def _fire(self, rule):
+        rule.timer = None
+        rule.active = rule.target
+        bulk = rule.then if rule.active else rule.otherwise
+        if bulk is None:
+            return
+        metrics.RULE_FIRINGS.labels(rule.name).inc()
+        log.info("Regra %s %s: %s.", rule.name, "ativada" if rule.active else "desativada", bulk.action)
+        task = asyncio.create_task(self._send(rule, bulk))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, rule, bulk):
+        results = await self.dispatcher.send_bulk(bulk)
+        failed = [result.device_id for result in results if result.outcome != Outcome.ACKED]
+        if failed:
+            log.warning("Regra %s: %d de %d dispositivos não confirmaram %s.",
+                        rule.name, len(failed), len(results), bulk.action)
+
+    def close(self):
+        self.registry.remove_listener(self.on_change)
+        for rule in self.rules:
+            if rule.timer is not None:
+                rule.timer.cancel()
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,97 @@
+from bisect import bisect_left, bisect_right, insort
+from proto import smart_city_pb2
+from proto.framing import encode_frame
+
+#tag do campo "repeated DeviceInfo devices = 1" da GatewayClientResponse (campo 1, wire type 2)
+DEVICES_FIELD_TAG = b'\x0a'
+
+class DeviceSnapshot:
+    '''
+    Cópia pré-serializada da lista de dispositivos, mantida como listener do registro.
+
+    Uma GatewayClientResponse serializada é só a concatenação dos seus campos, então
+    cada dispositivo é guardado já codificado como um elemento do campo devices
+    (tag + tamanho + DeviceInfo). Montar a resposta de list_devices vira um join de
+    bytes prontos, e só os dispositivos que mudaram desde a última leitura são
+    serializados de novo. A lista completa fica em cache até a próxima mudança.
+
+    Os ids ficam em listas ordenadas (geral e por tipo), o que permite paginar por
+    cursor (o último id da página anterior) e filtrar por prefixo com bisect.'''
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._entries = {} #id -> bytes codificados, ou None se precisa ser refeito
+        self._ids = []
+        self._ids_by_type = {}
+        self._full = None
+        self._info = smart_city_pb2.DeviceInfo()
+        registry.add_listener(self.on_change)
+
+    def on_change(self, record, removed):
+        device_id = record.id
+        self._full = None
+        if removed:
+            self._entries.pop(device_id, None)
+            self._discard(self._ids, device_id)
+            self._discard(self._ids_by_type.get(record.type, []), device_id)
+            return
+
+        if device_id not in self._entries:
+            insort(self._ids, device_id)
+            insort(self._ids_by_type.setdefault(record.type, []), device_id)
+        self._entries[device_id] = None
+
+    @staticmethod
+    def _discard(ids, device_id):
+        i = bisect_left(ids, device_id)
+        if i < len(ids) and ids[i] == device_id:
+            del ids[i]
+
+    def _entry(self, device_id):
+        entry = self._entries[device_id]
+        if entry is None:
+            info = self._info
+            info.Clear()
+            self.registry.get(device_id).fill_info(info)
+            entry = DEVICES_FIELD_TAG + encode_frame(info.SerializeToString())
+            self._entries[device_id] = entry
+        return entry
+
+    def full(self):
+        '''Campo devices com todos os dispositivos, já serializado.'''
+        if self._full is None:
+            self._full = b''.join([self._entry(device_id) for device_id in self._ids])
+        return self._full
+
+    def page(self, query):
+        '''
+        Aplica um ListDevicesQuery e devolve (bytes do campo devices, próximo cursor):
+            - type: restringe ao índice daquele tipo (UNKNOWN = todos);
+            - id_prefix: começa no primeiro id com o prefixo e para no primeiro que não tiver;
+            - status: compara com o status textual ("ON", "25°C"...);
+            - page_size/cursor: devolve até page_size ids maiores que cursor (0 = sem limite).'''
+        if query.type != smart_city_pb2.DeviceType.UNKNOWN:
+            ids = self._ids_by_type.get(query.type, [])
+        else:
+            ids = self._ids
+
+        start = bisect_left(ids, query.id_prefix) if query.id_prefix else 0
+        if query.cursor:
+            start = max(start, bisect_right(ids, query.cursor))
+
+        limit = query.page_size or len(ids)
+        prefix = query.id_prefix
+        status = query.status
+        entries = []
+        last_id = ""
+        for i in range(start, len(ids)):
+            device_id = ids[i]
+            if prefix and not device_id.startswith(prefix):
+                break
+            if status and self.registry.get(device_id).status_text != status:
+                continue
+            if len(entries) == limit:
+                return b''.join(entries), last_id
+            entries.append(self._entry(device_id))
+            last_id = device_id
+        return b''.join(entries), ""
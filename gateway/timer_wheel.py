@@ -0,0 +1,90 @@
+import math
+
+WHEEL_BITS = 6 #64 posições por nível
+WHEEL_LEVELS = 4 #com tick de 0,25 s, o último nível alcança ~48 dias
+
+class TimerWheel:
+    '''
+    Timer wheel hierárquico: agenda milhares de prazos sem um timer por item.
+
+    O tempo é contado em ticks. O nível 0 tem uma posição por tick; cada nível acima
+    cobre 64 vezes o intervalo do anterior. Um prazo vai para o nível mais baixo que o
+    alcança a partir do tick atual, e quando o nível inferior completa uma volta, a
+    posição correspondente do nível de cima é redistribuída ("cascata") para baixo.
+    Assim agendar e cancelar são O(1), e cada tick só visita a posição atual de cada
+    nível, independentemente de quantos prazos estejam agendados.
+
+    Prazos além do alcance do último nível ficam na posição mais distante e são
+    reagendados quando ela vence.'''
+
+    def __init__(self, tick, now, bits=WHEEL_BITS, levels=WHEEL_LEVELS):
+        self.tick = tick
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self._slots = [[{} for _ in range(self.size)] for _ in range(levels)] #key -> tick do prazo
+        self._where = {} #key -> (nível, posição)
+        self.current = int(now / tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def schedule(self, key, when):
+        '''Agenda (ou reagenda) key para o instante when, na mesma unidade de now.'''
+        self.cancel(key)
+        self._place(key, max(math.ceil(when / self.tick), self.current + 1))
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is not None:
+            del self._slots[where[0]][where[1]][key]
+
+    def _place(self, key, due):
+        delta = due - self.current
+        level = 0
+        while level < self.levels - 1 and delta >= 1 << (self.bits * (level + 1)):
+            level += 1
+        if delta >= 1 << (self.bits * self.levels):
+            #fora do alcance: fica na posição mais distante do último nível
+            index = ((self.current >> (self.bits * level)) - 1) & self.mask
+        else:
+            index = (due >> (self.bits * level)) & self.mask
+        self._slots[level][index][key] = due
+        self._where[key] = (level, index)
+
+    def _cascade(self, level):
+        '''Redistribui a posição atual de um nível nos níveis abaixo.'''
+        index = (self.current >> (self.bits * level)) & self.mask
+        slot = self._slots[level][index]
+        self._slots[level][index] = {}
+        for key, due in slot.items():
+            self._place(key, due)
+
+    def advance(self, now):
+        '''Avança até o instante now e devolve as chaves cujos prazos venceram.'''
+        target = int(now / self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            level = 1
+            while level < self.levels and (self.current & ((1 << (self.bits * level)) - 1)) == 0:
+                level += 1
+            for upper in range(level - 1, 0, -1):
+                self._cascade(upper)
+
+            index = self.current & self.mask
+            slot = self._slots[0][index]
+            if not slot:
+                continue
+            self._slots[0][index] = {}
+            for key, due in slot.items():
+                if due > self.current:
+                    self._place(key, due)
+                else:
+                    del self._where[key]
+                    expired.append(key)
+        return expired
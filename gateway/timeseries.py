@@ -0,0 +1,286 @@
+import json
+import os
+import numpy as np
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+
+INITIAL_SERIES = 256 #séries (sensores) alocadas inicialmente; dobra quando esgota
+RAW_CAPACITY = 8192 #leituras brutas guardadas por sensor (~13 min a 10 Hz)
+MINUTE_CAPACITY = 7 * 24 * 60 #uma semana de agregados por minuto
+HOUR_CAPACITY = 90 * 24 #noventa dias de agregados por hora
+
+RESOLUTIONS = ('raw', 'minute', 'hour')
+AUTO_MINUTE_MAX_RANGE_MS = 6 * HOUR_MS #consultas "auto" até esse intervalo usam minutos
+
+RAW_COLUMNS = {'t': np.int64, 'v': np.float32}
+ROLLUP_COLUMNS = {'t': np.int64, 'min': np.float32, 'max': np.float32, 'sum': np.float64, 'count': np.int64}
+META_COLUMNS = {'head': np.int64, 'count': np.int64}
+
+class ColumnSet:
+    '''
+    Um grupo de colunas mapeadas em memória, cada uma num arquivo <nome>.<coluna>
+    com forma (séries,) + row_shape. Aumentar o número de séries só acrescenta linhas
+    no fim dos arquivos, então os dados já gravados não mudam de lugar.'''
+
+    def __init__(self, directory, name, columns, row_shape=()):
+        self.directory = directory
+        self.name = name
+        self.columns = columns
+        self.row_shape = row_shape
+        self.arrays = {}
+
+    def open(self, series):
+        self.flush()
+        self.arrays = {}
+        for column, dtype in self.columns.items():
+            path = os.path.join(self.directory, f"{self.name}.{column}")
+            size = series * int(np.prod(self.row_shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            with open(path, 'ab') as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            self.arrays[column] = np.memmap(path, dtype=dtype, mode='r+', shape=(series,) + self.row_shape)
+
+    def __getitem__(self, column):
+        return self.arrays[column]
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+
+class Ring:
+    '''
+    Buffer circular por série sobre um ColumnSet de forma (séries, capacidade).
+    head (próxima posição de escrita) e count de cada série ficam num ColumnSet à parte,
+    também em disco, para o buffer sobreviver a reinícios.
+
+    Cada série fica sempre em ordem de t, e window() usa busca binária: linhas anteriores
+    à última gravada (um lote UDP atrasado ou fora de ordem) são descartadas no append.
+    Leituras brutas descartadas assim continuam nos agregados, que as somam ao bucket aberto.'''
+
+    def __init__(self, directory, name, columns, capacity):
+        self.capacity = capacity
+        self.data = ColumnSet(directory, name, columns, (capacity,))
+        self.meta = ColumnSet(directory, name + '.meta', META_COLUMNS)
+
+    def open(self, series):
+        self.data.open(series)
+        self.meta.open(series)
+
+    def flush(self):
+        self.data.flush()
+        self.meta.flush()
+
+    def append(self, slot, columns):
+        head = int(self.meta['head'][slot])
+        if int(self.meta['count'][slot]):
+            late = columns['t'] < self.data['t'][slot, (head - 1) % self.capacity]
+            if late.any():
+                columns = {name: values[~late] for name, values in columns.items()}
+        n = len(columns['t'])
+        if n == 0:
+            return
+        if n > self.capacity:
+            columns = {name: values[-self.capacity:] for name, values in columns.items()}
+            n = self.capacity
+
+        positions = (head + np.arange(n)) % self.capacity
+        for name, values in columns.items():
+            self.data[name][slot, positions] = values
+        self.meta['head'][slot] = (head + n) % self.capacity
+        self.meta['count'][slot] = min(int(self.meta['count'][slot]) + n, self.capacity)
+
+    def window(self, slot, t_from, t_to):
+        '''Linhas da série com t_from <= t <= t_to, em ordem cronológica.'''
+        count = int(self.meta['count'][slot])
+        start = (int(self.meta['head'][slot]) - count) % self.capacity
+        if start + count <= self.capacity:
+            ordered = lambda array: array[slot, start:start + count]
+        else:
+            wrap = start + count - self.capacity
+            ordered = lambda array: np.concatenate((array[slot, start:], array[slot, :wrap]))
+
+        t = ordered(self.data['t'])
+        lo = np.searchsorted(t, t_from, 'left')
+        hi = np.searchsorted(t, t_to, 'right')
+        return {name: np.asarray(ordered(self.data[name])[lo:hi]) for name in self.data.columns}
+
+def _group(t, mins, maxs, sums, counts, width_ms):
+    '''Agrupa linhas ordenadas por t em buckets de width_ms (min/max/soma/contagem por bucket).'''
+    buckets = t - t % width_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return {
+        't': buckets[starts],
+        'min': np.minimum.reduceat(mins, starts),
+        'max': np.maximum.reduceat(maxs, starts),
+        'sum': np.add.reduceat(sums, starts),
+        'count': np.add.reduceat(counts, starts),
+    }
+
+class Rollup:
+    '''
+    Agregados min/max/soma/contagem em buckets de width_ms. O bucket ainda aberto de cada
+    série fica em open (também em disco); ao chegar dado de um bucket posterior ele é
+    fechado e gravado no Ring. Leituras atrasadas, de antes do bucket aberto, são
+    somadas a ele em vez de reabrir buckets já gravados.'''
+
+    def __init__(self, directory, name, width_ms, capacity):
+        self.width_ms = width_ms
+        self.ring = Ring(directory, name, ROLLUP_COLUMNS, capacity)
+        self.open_bucket = ColumnSet(directory, name + '.open', ROLLUP_COLUMNS)
+
+    def open(self, series):
+        self.ring.open(series)
+        self.open_bucket.open(series)
+
+    def flush(self):
+        self.ring.flush()
+        self.open_bucket.flush()
+
+    def add(self, slot, rows):
+        '''Soma linhas (ordenadas por t) aos buckets da série e devolve os buckets que fecharam.'''
+        groups = _group(rows['t'], rows['min'], rows['max'], rows['sum'], rows['count'], self.width_ms)
+        current = self.open_bucket
+        if current['count'][slot] > 0:
+            merge = int(np.searchsorted(groups['t'], current['t'][slot], 'right'))
+            if merge:
+                current['min'][slot] = min(current['min'][slot], groups['min'][:merge].min())
+                current['max'][slot] = max(current['max'][slot], groups['max'][:merge].max())
+                current['sum'][slot] += groups['sum'][:merge].sum()
+                current['count'][slot] += groups['count'][:merge].sum()
+                groups = {name: values[merge:] for name, values in groups.items()}
+            if len(groups['t']) == 0:
+                return None
+            closed = {name: np.r_[current[name][slot], values[:-1]] for name, values in groups.items()}
+        else:
+            closed = {name: values[:-1] for name, values in groups.items()}
+
+        for name, values in groups.items():
+            current[name][slot] = values[-1]
+        self.ring.append(slot, closed)
+        return closed if len(closed['t']) else None
+
+    def open_row(self, slot):
+        current = self.open_bucket
+        if current['count'][slot] == 0:
+            return None
+        return {name: np.asarray(current[name][slot:slot + 1]) for name in ROLLUP_COLUMNS}
+
+def _concat(rows, extra):
+    return {name: np.concatenate((rows[name], extra[name])) for name in rows}
+
+class TimeSeriesStore:
+    '''
+    Histórico das leituras dos sensores, só de acréscimo, guardado em arquivos de coluna
+    mapeados em memória (np.memmap) no diretório informado:
+        - raw: as últimas RAW_CAPACITY leituras de cada sensor (t, valor); leituras
+         atrasadas, anteriores à última do sensor, ficam só nos agregados;
+        - minute/hour: agregados min/max/média por minuto e por hora, atualizados a cada
+         rodada de ingestão; a hora é alimentada pelos minutos que fecham.
+
+    Cada sensor ocupa uma linha (slot) de todas as colunas; o mapa id -> slot fica em
+    index.jsonl. As consultas por minuto/hora leem apenas os agregados, com searchsorted
+    no intervalo pedido, sem percorrer as leituras brutas.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        self.slots = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.slots[entry['id']] = entry['slot']
+
+        self.raw = Ring(directory, 'raw', RAW_COLUMNS, RAW_CAPACITY)
+        self.minute = Rollup(directory, 'minute', MINUTE_MS, MINUTE_CAPACITY)
+        self.hour = Rollup(directory, 'hour', HOUR_MS, HOUR_CAPACITY)
+        self.series = INITIAL_SERIES
+        while self.series < len(self.slots):
+            self.series *= 2
+        self._open()
+
+    def _open(self):
+        self.raw.open(self.series)
+        self.minute.open(self.series)
+        self.hour.open(self.series)
+
+    def _slot(self, device_id):
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = len(self.slots)
+            if slot >= self.series:
+                self.series *= 2
+                self._open()
+            self.slots[device_id] = slot
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'id': device_id, 'slot': slot}) + '\n')
+        return slot
+
+    def append_readings(self, readings):
+        '''Listener da ingestão UDP: recebe [(device_id, timestamp_ms, valor), ...].'''
+        by_device = {}
+        for device_id, timestamp, value in readings:
+            by_device.setdefault(device_id, []).append((timestamp, value))
+
+        for device_id, samples in by_device.items():
+            slot = self._slot(device_id)
+            t = np.fromiter((s[0] for s in samples), dtype=np.int64, count=len(samples))
+            v = np.fromiter((s[1] for s in samples), dtype=np.float32, count=len(samples))
+            if len(t) > 1 and np.any(t[1:] < t[:-1]):
+                order = np.argsort(t, kind='stable')
+                t, v = t[order], v[order]
+
+            self.raw.append(slot, {'t': t, 'v': v})
+            closed = self.minute.add(slot, {'t': t, 'min': v, 'max': v, 'sum': v.astype(np.float64),
+                                            'count': np.ones(len(t), dtype=np.int64)})
+            if closed is not None:
+                self.hour.add(slot, closed)
+
+    def query(self, device_id, t_from, t_to, resolution='auto'):
+        '''
+        Série de um sensor entre t_from e t_to (ms), como colunas NumPy
+        t/min/max/mean/count. resolution é "raw", "minute", "hour" ou "auto".
+        Os buckets ainda abertos entram como último ponto (parcial).'''
+        if resolution == 'auto':
+            resolution = 'minute' if t_to - t_from <= AUTO_MINUTE_MAX_RANGE_MS else 'hour'
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Resolução inválida: {resolution}")
+
+        slot = self.slots.get(device_id)
+        if slot is None:
+            empty = np.empty(0, dtype=np.float32)
+            return resolution, {'t': np.empty(0, dtype=np.int64), 'min': empty, 'max': empty,
+                                'mean': empty, 'count': np.empty(0, dtype=np.int64)}
+
+        if resolution == 'raw':
+            rows = self.raw.window(slot, t_from, t_to)
+            return resolution, {'t': rows['t'], 'min': rows['v'], 'max': rows['v'], 'mean': rows['v'],
+                                'count': np.ones(len(rows['t']), dtype=np.int64)}
+
+        rollup = self.minute if resolution == 'minute' else self.hour
+        rows = rollup.ring.window(slot, t_from, t_to)
+        pending = rollup.open_row(slot)
+        if rollup is self.hour:
+            #a hora aberta ainda não recebeu o minuto aberto
+            minute_row = self.minute.open_row(slot)
+            if minute_row is not None:
+                partial = _group(minute_row['t'], minute_row['min'], minute_row['max'],
+                                 minute_row['sum'], minute_row['count'], HOUR_MS)
+                pending = partial if pending is None else _group(
+                    *(np.concatenate((pending[name], partial[name])) for name in ROLLUP_COLUMNS), HOUR_MS)
+        if pending is not None:
+            keep = (pending['t'] + rollup.width_ms > t_from) & (pending['t'] <= t_to)
+            rows = _concat(rows, {name: values[keep] for name, values in pending.items()})
+
+        counts = rows['count']
+        mean = np.divide(rows['sum'], counts, out=np.zeros(len(counts)), where=counts > 0)
+        return resolution, {'t': rows['t'], 'min': rows['min'], 'max': rows['max'],
+                            'mean': mean.astype(np.float32), 'count': counts}
+
+    def flush(self):
+        self.raw.flush()
+        self.minute.flush()
+        self.hour.flush()
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, encode_frame, encode_message, read_frame
+
+WORKER_CALL_TIMEOUT = 5 #segundos esperando a resposta de outro worker
+WORKER_STOP_TIMEOUT = 10 #segundos para os workers encerrarem antes do SIGKILL
+
+DeviceEvent = smart_city_pb2.DeviceEvent
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+
+log = logging.getLogger('gateway.workers')
+
+class WorkerLink:
+    '''
+    Canal de um worker (modo --workers) com os demais, através do processo principal.
+
+    Cada worker aceita as suas próprias conexões (SO_REUSEPORT) e guarda uma réplica
+    completa do registro, então list_devices, query_devices e subscribe são respondidos
+    por qualquer um deles sem IPC:
+        - é listener do registro: as mudanças feitas por este worker (dispositivos
+         conectados a ele, leituras UDP recebidas por ele) são acumuladas por id e
+         enviadas aos outros num único WorkerMessage ao fim da rodada do event loop;
+        - as mudanças recebidas dos outros workers são aplicadas ao registro local como
+         dispositivos sem outbox (a conexão está no worker dono) e não são reenviadas;
+        - call() encaminha uma ClientGatewayRequest a um worker, ou a todos os outros,
+         e devolve as respostas; é assim que comandos chegam ao worker com a conexão do
+         dispositivo e que histórico e métricas juntam o estado de todos.'''
+
+    def __init__(self, worker, workers, sock, registry):
+        self.worker = worker
+        self.workers = workers
+        self.registry = registry
+        self.handler = None #corrotina que responde às requisições encaminhadas
+        self._sock = sock
+        self._writer = None
+        self._task = None
+        self._pending = {} #id -> (DeviceRecord, removido) ainda não enviados
+        self._flush_scheduled = False
+        self._applying = False
+        self._calls = {} #call_id -> (Future, respostas esperadas, {worker: resposta})
+        self._last_call = 0
+        self._answers = set()
+        registry.add_listener(self.on_change)
+
+    async def start(self):
+        '''Abre o canal e devolve a tarefa que o lê, que termina se o processo principal sair.'''
+        reader, self._writer = await asyncio.open_connection(sock=self._sock)
+        self._task = asyncio.create_task(self._run(reader))
+        return self._task
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        for task in self._answers:
+            task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    def on_change(self, record, removed):
+        if self._applying:
+            return
+        self._pending[record.id] = (record, removed)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        if self._writer is None:
+            return
+        message = smart_city_pb2.WorkerMessage()
+        message.source = self.worker
+        for device_id, (record, removed) in pending.items():
+            change = message.changes.add()
+            change.worker = record.worker
+            if removed:
+                change.event.kind = DeviceEvent.REMOVED
+                change.event.device.id = device_id
+                continue
+            change.event.kind = DeviceEvent.UPDATED
+            record.fill_info(change.event.device)
+            change.address = record.address
+            change.port = record.port
+            change.status_only = record.worker != self.worker
+            if record.type == TEMP_SENSOR and record.status is not None:
+                change.reading = record.status
+        self._writer.write(encode_message(message))
+
+    def _apply(self, change):
+        '''
+        Aplica a mudança de outro worker. Só o dono (change.worker) registra ou remove
+        um dispositivo, e a remoção só vale se o registro local ainda for daquele dono:
+        se o dispositivo já reconectou em outro worker, o registro novo é mantido.'''
+        info = change.event.device
+        record = self.registry.get(info.id)
+        owned = record is not None and record.worker == change.worker
+        if change.event.kind == DeviceEvent.REMOVED:
+            if owned:
+                self.registry.remove(info.id)
+        elif owned and (record.type, record.zone, record.pending) == (info.type, info.zone, info.pending_reconnect):
+            if change.HasField('reading'):
+                self.registry.set_reading(info.id, change.reading)
+            else:
+                self.registry.set_status_text(info.id, info.status)
+        elif not change.status_only and change.worker != self.worker:
+            if info.pending_reconnect:
+                self.registry.restore(info.id, info.type, info.status, info.zone,
+                                      change.address, change.port, change.worker)
+            else:
+                self.registry.register(info.id, info.type, info.status, info.zone,
+                                       change.address, change.port, None, change.worker)
+            if change.HasField('reading'):
+                self.registry.set_reading(info.id, change.reading)
+
+    def _next_call(self):
+        self._last_call = self._last_call % 0xFFFFFFFF + 1
+        return self._last_call
+
+    async def call(self, target, request_proto, timeout=WORKER_CALL_TIMEOUT):
+        '''
+        Envia a requisição ao worker target (0 = todos os outros) e devolve
+        {worker: GatewayClientResponse} com as respostas que chegaram dentro do timeout.'''
+        expected = 1 if target else self.workers - 1
+        if expected == 0 or self._writer is None:
+            return {}
+        call_id = self._next_call()
+        future = asyncio.get_running_loop().create_future()
+        responses = {}
+        self._calls[call_id] = (future, expected, responses)
+
+        message = smart_city_pb2.WorkerMessage()
+        message.source = self.worker
+        message.target = target
+        message.call_id = call_id
+        message.request.CopyFrom(request_proto)
+        self._writer.write(encode_message(message))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            log.warning("Worker %s sem resposta em %.1fs.", target or 'algum', timeout)
+        finally:
+            self._calls.pop(call_id, None)
+        return responses
+
+    async def _answer(self, message):
+        reply = smart_city_pb2.WorkerMessage()
+        reply.source = self.worker
+        reply.target = message.source
+        reply.call_id = message.call_id
+        try:
+            reply.response.CopyFrom(await self.handler(message.request))
+        except Exception as e:
+            log.warning("Erro na requisição encaminhada pelo worker %d: %s", message.source, e)
+            reply.response.status.success = False
+            reply.response.status.message = str(e)
+        self._writer.write(encode_message(reply))
+
+    async def _run(self, reader):
+        decoder = FrameDecoder()
+        message = smart_city_pb2.WorkerMessage()
+        while True:
+            data = await read_frame(reader, decoder)
+            if data is None:
+                log.warning("Canal com o processo principal encerrado.")
+                return
+            message.ParseFromString(data)
+
+            if message.changes:
+                self._applying = True
+                try:
+                    for change in message.changes:
+                        self._apply(change)
+                finally:
+                    self._applying = False
+
+            if message.HasField('request'):
+                request = smart_city_pb2.WorkerMessage()
+                request.CopyFrom(message)
+                task = asyncio.create_task(self._answer(request))
+                self._answers.add(task)
+                task.add_done_callback(self._answers.discard)
+
+            elif message.HasField('response'):
+                call = self._calls.get(message.call_id)
+                if call is not None:
+                    future, expected, responses = call
+                    response = smart_city_pb2.GatewayClientResponse()
+                    response.CopyFrom(message.response)
+                    responses[message.source] = response
+                    if len(responses) == expected and not future.done():
+                        future.set_result(None)
+
+def merge_histories(target, histories):
+    '''
+    Junta num HistoryResponse as séries do mesmo sensor vindas de vários workers. Em
+    geral só um deles tem dados (as leituras de um sensor chegam sempre pelo mesmo
+    socket), mas depois de uma reconexão a série pode estar dividida: os pontos são
+    ordenados por instante, e buckets agregados do mesmo instante são somados.'''
+    points = {}
+    raw = []
+    for history in histories:
+        if not history.timestamps_ms:
+            continue
+        target.device_id = history.device_id
+        target.resolution = history.resolution
+        for row in zip(history.timestamps_ms, history.min, history.max, history.mean, history.count):
+            if history.resolution == 'raw':
+                raw.append(row)
+                continue
+            t, low, high, mean, count = row
+            merged = points.get(t)
+            if merged is None:
+                points[t] = [low, high, mean * count, count]
+            else:
+                merged[0] = min(merged[0], low)
+                merged[1] = max(merged[1], high)
+                merged[2] += mean * count
+                merged[3] += count
+    rows = sorted(raw) if raw else [(t, low, high, total / count if count else 0.0, count)
+                                    for t, (low, high, total, count) in sorted(points.items())]
+    for t, low, high, mean, count in rows:
+        target.timestamps_ms.append(t)
+        target.min.append(low)
+        target.max.append(high)
+        target.mean.append(mean)
+        target.count.append(count)
+
+def prefork(count, run_worker):
+    '''
+    Cria count workers com fork, antes de qualquer event loop, cada um ligado ao
+    processo principal por um socketpair. No filho, chama run_worker(número, socket)
+    e encerra o processo; no pai, devolve [(pid, socket)].'''
+    children = []
+    for worker in range(1, count + 1):
+        parent_end, child_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            #Ctrl+C chega a todo o grupo de processos; o principal encerra os workers com SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            parent_end.close()
+            for _, sock in children:
+                sock.close()
+            code = 0
+            try:
+                run_worker(worker, child_end)
+            except asyncio.CancelledError:
+                pass
+            except BaseException:
+                log.exception("Worker %d encerrado por erro.", worker)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        child_end.close()
+        children.append((pid, parent_end))
+    return children
+
+async def relay(children):
+    '''
+    Repassa os WorkerMessage entre os workers: target 0 vai para todos os outros,
+    os demais só para o destino. Retorna quando o canal de algum worker fechar.'''
+    writers = {}
+    readers = {}
+    for worker, (_, sock) in enumerate(children, 1):
+        readers[worker], writers[worker] = await asyncio.open_connection(sock=sock)
+
+    async def pump(worker, reader):
+        decoder = FrameDecoder()
+        header = smart_city_pb2.WorkerMessage()
+        while True:
+            data = await read_frame(reader, decoder)
+            if data is None:
+                return worker
+            header.ParseFromString(data)
+            frame = encode_frame(data)
+            if header.target:
+                writer = writers.get(header.target)
+                if writer is not None:
+                    writer.write(frame)
+            else:
+                for other, writer in writers.items():
+                    if other != worker:
+                        writer.write(frame)
+
+    tasks = [asyncio.create_task(pump(worker, reader)) for worker, reader in readers.items()]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            log.warning("Worker %d encerrou.", task.result())
+    finally:
+        for task in tasks:
+            task.cancel()
+        for writer in writers.values():
+            writer.close()
+
+def stop(children, timeout=WORKER_STOP_TIMEOUT):
+    '''Pede aos workers que encerrem (SIGTERM) e espera; quem não sair a tempo recebe SIGKILL.'''
+    alive = {pid for pid, _ in children}
+    for pid in alive:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while alive and time.monotonic() < deadline:
+        for pid in list(alive):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    alive.discard(pid)
+            except ChildProcessError:
+                alive.discard(pid)
+        time.sleep(0.05)
+    for pid in alive:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
@@ -0,0 +1,71 @@
+import hashlib
+from bisect import bisect
+from collections import namedtuple
+
+VIRTUAL_NODES = 128 #pontos de cada nó no anel; mais pontos = divisão mais uniforme
+DEFAULT_TCP_PORT = 10000
+DEFAULT_UDP_PORT = 10001
+
+Node = namedtuple('Node', ('name', 'host', 'tcp_port', 'udp_port'))
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HashRing:
+    '''
+    Anel de hash consistente que define o nó dono de cada dispositivo pelo seu id.
+
+    Cada nó ocupa VIRTUAL_NODES pontos do anel (hash de "nome#i"); o dono de um id é
+    o nó do primeiro ponto igual ou seguinte ao hash do id. Como os pontos dependem
+    só dos nomes, Gateway, dispositivos e backend chegam ao mesmo dono sem combinar
+    nada além da lista de nós, e adicionar ou remover um nó só muda o dono de cerca
+    de 1/N dos dispositivos.'''
+
+    def __init__(self, nodes, virtual_nodes=VIRTUAL_NODES):
+        self.nodes = {node.name: node for node in nodes}
+        points = sorted((_hash(f"{node.name}#{i}"), node.name)
+                        for node in nodes for i in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def owner(self, device_id):
+        '''Nó dono do id, ou None se o anel estiver vazio.'''
+        if not self._hashes:
+            return None
+        i = bisect(self._hashes, _hash(device_id)) % len(self._hashes)
+        return self.nodes[self._names[i]]
+
+def parse_nodes(spec):
+    '''
+    Lê uma lista de nós no formato "nome=host:porta_tcp[:porta_udp],...", por exemplo
+    "a=127.0.0.1:10000:10001,b=127.0.0.1:10010:10011". Sem "nome=", o nome é host:porta_tcp.'''
+    nodes = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, address = item.rpartition('=')
+        parts = address.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Nó inválido: {item!r} (esperado nome=host:porta_tcp[:porta_udp])")
+        host = parts[0]
+        tcp_port = int(parts[1])
+        udp_port = int(parts[2]) if len(parts) == 3 else tcp_port + 1
+        nodes.append(Node(name or f"{host}:{tcp_port}", host, tcp_port, udp_port))
+    return nodes
+
+def nodes_from_request(request):
+    '''Nós anunciados num GatewayRequest de descoberta.'''
+    return [Node(node.name, node.host, node.tcp_port, node.udp_port) for node in request.nodes]
+
+def owner_address(request, sender_ip, device_id):
+    '''
+    Para onde um dispositivo deve se conectar ao receber o DISCOVER: (host, porta TCP,
+    porta UDP) do nó dono do seu id. Um Gateway sem cluster não anuncia nós, e então
+    o próprio remetente, nas portas padrão, é o dono. Um nó anunciado sem host
+    (processos locais) é acessado pelo endereço de quem enviou o anúncio.'''
+    ring = HashRing(nodes_from_request(request))
+    node = ring.owner(device_id)
+    if node is None:
+        return sender_ip, DEFAULT_TCP_PORT, DEFAULT_UDP_PORT
+    return node.host or sender_ip, node.tcp_port, node.udp_port
@@ -0,0 +1,97 @@
+import hashlib
+import math
+import random
+from proto.cluster import HashRing, nodes_from_request
+
+BACKOFF_BASE = 1 #segundos de espera depois da primeira falha; dobra a cada nova falha...
+BACKOFF_CAP = 60 #...até este teto
+STABLE_CONNECTION = 30 #segundos conectado para que a próxima queda volte à espera mínima
+MIN_SPREAD = 1 #segundos: janela mínima em que os dispositivos espalham a conexão após um anúncio
+MAX_SPREAD = 120 #teto da janela, por maior que seja a fila de reconexões anunciada
+FILTER_BITS_PER_ID = 10 #cerca de 1% de falsos positivos com o número ideal de hashes
+FILTER_MAX_BYTES = 32768 #o filtro vai no datagrama do DISCOVER, junto com a lista de nós
+FILTER_MAX_HASHES = 8
+
+MASK64 = (1 << 64) - 1
+
+def id_hashes(device_id):
+    '''Os dois hashes de 64 bits de um id, independentes da semente (o Gateway os guarda em cache).'''
+    digest = hashlib.blake2b(device_id.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+def seed_masks(seed):
+    '''Máscaras aplicadas (xor) aos hashes dos ids, sorteadas pela semente do anúncio.'''
+    digest = hashlib.blake2b(seed.to_bytes(4, 'big'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+
+def filter_shape(count):
+    '''(bytes, hashes) do filtro para count ids: FILTER_BITS_PER_ID por id, até FILTER_MAX_BYTES.'''
+    size = min(FILTER_MAX_BYTES, max(8, math.ceil(count * FILTER_BITS_PER_ID / 8)))
+    hashes = round(size * 8 / max(1, count) * math.log(2))
+    return size, min(FILTER_MAX_HASHES, max(1, hashes))
+
+class BloomFilter:
+    '''
+    Filtro de Bloom com os ids dos dispositivos registrados num nó, enviado no DISCOVER.
+    Um id que não está no filtro certamente não está registrado; um id no filtro pode
+    ser um falso positivo, e por isso a semente muda a cada anúncio: o dispositivo
+    ignorado por engano num anúncio atende ao seguinte.
+
+    As posições usam hashing duplo sobre id_hashes, com as máscaras da semente e
+    aritmética de 64 bits: posição i = ((h1 ^ m1) + i * ((h2 ^ m2) | 1)) mod 2^64 mod bits.
+    O Gateway monta o mesmo filtro com numpy (gateway.discovery.build_filter).'''
+
+    def __init__(self, size_bytes, hashes, seed=0, data=None):
+        self.data = bytearray(data) if data is not None else bytearray(size_bytes)
+        self.bits = len(self.data) * 8
+        self.hashes = hashes
+        self.seed = seed
+        self._masks = seed_masks(seed)
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(0, request.filter_hashes, request.filter_seed, request.registered_filter)
+
+    def _positions(self, device_id):
+        h1, h2 = id_hashes(device_id)
+        h1 ^= self._masks[0]
+        h2 = (h2 ^ self._masks[1]) | 1
+        return (((h1 + i * h2) & MASK64) % self.bits for i in range(self.hashes))
+
+    def add(self, device_id):
+        for position in self._positions(device_id):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, device_id):
+        if not self.bits:
+            return False
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(device_id))
+
+def should_answer(request, device_id):
+    '''
+    Se o dispositivo deve se conectar ao receber este DISCOVER. Não deve quando:
+        - em cluster, o anúncio veio de um nó que não é o dono do seu id (o dono também
+         anuncia, com a carga e o filtro que valem para ele);
+        - o id está no filtro de registrados: o nó já tem este dispositivo.'''
+    if request.node:
+        owner = HashRing(nodes_from_request(request)).owner(device_id)
+        if owner is not None and owner.name != request.node:
+            return False
+    if request.registered_filter and device_id in BloomFilter.from_request(request):
+        return False
+    return True
+
+def connect_delay(request, rng=random):
+    '''
+    Espera antes de se conectar após um DISCOVER, sorteada numa janela proporcional à
+    fila anunciada: com expected dispositivos voltando e admission_rate registros por
+    segundo, a janela é expected / admission_rate (entre MIN_SPREAD e MAX_SPREAD). Assim
+    um Gateway reiniciado recebe as reconexões espalhadas, e não todas no mesmo instante.'''
+    spread = MIN_SPREAD
+    if request.admission_rate:
+        spread = min(MAX_SPREAD, max(MIN_SPREAD, request.expected / request.admission_rate))
+    return rng.uniform(0, spread)
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random):
+    '''Espera antes da tentativa seguinte à falha número attempt: exponencial com jitter total.'''
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,192 @@
+'''
+Framing das mensagens protobuf trocadas por TCP.
+
+TCP é um fluxo de bytes: um recv pode trazer meia mensagem ou várias mensagens
+grudadas, e ParseFromString não tem como saber onde cada uma termina. Por isso
+toda mensagem enviada por TCP vai prefixada com o seu tamanho em varint, o mesmo
+formato do writeDelimitedTo/parseDelimitedFrom da biblioteca protobuf (Java inclusive).
+
+    [tamanho varint][bytes da mensagem][tamanho varint][bytes da mensagem]...
+
+UDP não usa framing: cada datagrama já é uma mensagem inteira.
+'''
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024 #maior mensagem aceita, protege contra prefixos corrompidos
+RECV_SIZE = 65536
+ZERO_COPY_MIN_FRAME = 4096 #a partir deste tamanho, parse_next lê o frame por memoryview em vez de copiá-lo
+
+class FrameError(Exception):
+    '''Fluxo TCP com um prefixo de tamanho inválido ou encerrado no meio de um frame.'''
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def encode_frame(payload):
+    '''Prefixa os bytes de uma mensagem já serializada com o seu tamanho.'''
+    return encode_varint(len(payload)) + payload
+
+def encode_message(message):
+    '''Serializa uma mensagem protobuf e devolve o frame pronto para envio.'''
+    return encode_frame(message.SerializeToString())
+
+class FrameDecoder:
+    '''
+    Decodificador incremental de frames:
+        - feed() acrescenta os bytes recebidos ao buffer interno;
+        - next_frame() devolve o próximo frame completo ou None se ainda faltam bytes.
+
+    O buffer é um único bytearray reutilizado durante toda a conexão: os frames
+    consumidos só avançam um offset, e o espaço é compactado quando mais da metade
+    do buffer já foi lida, evitando realocar a cada mensagem. parse_next() vai além e
+    decodifica o frame numa mensagem reaproveitada, sem criar bytes intermediários.'''
+
+    __slots__ = ('_buffer', '_pos', 'max_frame_size')
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self._buffer = bytearray()
+        self._pos = 0
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        if self._pos and self._pos * 2 >= len(self._buffer):
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer += data
+
+    def pending(self):
+        '''Quantidade de bytes recebidos que ainda não formam um frame completo.'''
+        return len(self._buffer) - self._pos
+
+    def _next_span(self):
+        '''(início, fim) do próximo frame completo no buffer, já consumido, ou None.'''
+        buf = self._buffer
+        end = len(buf)
+        pos = self._pos
+        size = 0
+        shift = 0
+        while True:
+            if pos >= end:
+                return None
+            byte = buf[pos]
+            pos += 1
+            size |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+            if shift > 28:
+                raise FrameError("Prefixo de tamanho inválido")
+
+        if size > self.max_frame_size:
+            raise FrameError(f"Frame de {size} bytes excede o limite de {self.max_frame_size}")
+        if pos + size > end:
+            return None
+
+        self._pos = pos + size
+        return pos, pos + size
+
+    def next_frame(self):
+        span = self._next_span()
+        if span is None:
+            return None
+        return bytes(self._buffer[span[0]:span[1]])
+
+    def parse_next(self, message):
+        '''
+        Decodifica o próximo frame em message (ParseFromString, que limpa a mensagem antes).
+        Devolve False se ainda faltam bytes. Frames pequenos (heartbeats, estados) são
+        lidos de uma fatia do buffer, uma cópia só, que custa menos que criar e liberar
+        memoryviews; a partir de ZERO_COPY_MIN_FRAME, o frame é lido por uma memoryview,
+        sem cópia. A view é liberada antes de retornar, senão o bytearray não poderia
+        crescer no feed().'''
+        span = self._next_span()
+        if span is None:
+            return False
+        start, end = span
+        if end - start < ZERO_COPY_MIN_FRAME:
+            message.ParseFromString(self._buffer[start:end])
+            return True
+        with memoryview(self._buffer) as view, view[start:end] as frame:
+            message.ParseFromString(frame)
+        return True
+
+    def frames(self):
+        '''Itera sobre todos os frames completos já presentes no buffer.'''
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+def iter_frames(buffer):
+    '''
+    Itera sobre os frames de um buffer já completo, como um arquivo mapeado em memória,
+    devolvendo memoryviews sem copiar os bytes. Para no primeiro frame incompleto, que
+    é o fim de um arquivo cuja última escrita foi interrompida.
+
+    Um mmap só pode ser fechado depois que todas as views sobre ele forem liberadas:
+    quem consome deve chamar release() em cada frame e iterar até o fim.'''
+    with memoryview(buffer) as view:
+        end = len(view)
+        pos = 0
+        while pos < end:
+            size = 0
+            shift = 0
+            while True:
+                if pos >= end:
+                    return
+                byte = view[pos]
+                pos += 1
+                size |= (byte & 0x7F) << shift
+                if not byte & 0x80:
+                    break
+                shift += 7
+                if shift > 28:
+                    raise FrameError("Prefixo de tamanho inválido")
+            if pos + size > end:
+                return
+            yield view[pos:pos + size]
+            pos += size
+
+def _end_of_stream(decoder):
+    if decoder.pending():
+        raise FrameError("Conexão encerrada no meio de um frame")
+    return None
+
+def recv_frame(sock, decoder):
+    '''Lê o próximo frame de um socket bloqueante. Devolve None quando a conexão fecha.'''
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            return _end_of_stream(decoder)
+        decoder.feed(data)
+
+async def read_frame(reader, decoder):
+    '''Lê o próximo frame de um asyncio.StreamReader. Devolve None quando a conexão fecha.'''
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        data = await reader.read(RECV_SIZE)
+        if not data:
+            return _end_of_stream(decoder)
+        decoder.feed(data)
+
+async def read_message(reader, decoder, message):
+    '''
+    Como read_frame, mas decodifica o frame em message, reaproveitada entre as leituras,
+    sem cópia intermediária (FrameDecoder.parse_next). Devolve False quando a conexão fecha.'''
+    while not decoder.parse_next(message):
+        data = await reader.read(RECV_SIZE)
+        if not data:
+            _end_of_stream(decoder)
+            return False
+        decoder.feed(data)
+    return True
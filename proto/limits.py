@@ -0,0 +1,9 @@
+import resource
+
+def raise_fd_limit():
+    '''
+    Cada conexão TCP ocupa um descritor de arquivo, e o Gateway e o simulador abrem uma
+    por dispositivo: sobe o limite soft de descritores até o limite hard do processo.'''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
@@ -0,0 +1,32 @@
+'''
+Formato texto de métricas do Prometheus, compartilhado pelo Gateway (que junta as
+métricas dos workers) e pelo backend (que junta as dos nós do cluster).
+'''
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def merge_texts(texts, label):
+    '''
+    Junta o texto de métricas de várias origens ({valor do label: texto}) num único
+    documento: cada amostra recebe o label informado, e as amostras de uma mesma
+    métrica ficam agrupadas sob um só HELP/TYPE.'''
+    families = {}
+    for source, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                family = line.split(' ', 3)[2]
+                families.setdefault(family, ([], []))[0].append(line)
+            elif line.startswith('# TYPE '):
+                families.setdefault(family, ([], []))[0].append(line)
+            elif line and family is not None:
+                name, _, value = line.rpartition(' ')
+                extra = f'{label}="{escape_label(source)}"'
+                name = f'{name[:-1]},{extra}}}' if name.endswith('}') else f'{name}{{{extra}}}'
+                families[family][1].append(f"{name} {value}")
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header[:2])
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
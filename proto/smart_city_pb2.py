@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16proto/smart_city.proto\x12\nsmart_city\"N\n\nDeviceInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12$\n\x04type\x18\x02 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x0e\n\x06status\x18\x03 \x01(\t\"Y\n\x0f\x44iscoveryPacket\x12$\n\x04info\x18\x01 \x01(\x0b\x32\x16.smart_city.DeviceInfo\x12\x12\n\nip_address\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\x05\" \n\x0eGatewayRequest\x12\x0e\n\x06\x61\x63tion\x18\x01 \x01(\t\".\n\nSensorData\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x02\",\n\x07\x43ommand\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x0e\n\x06\x61\x63tion\x18\x02 \x01(\t\"2\n\x0eStatusResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"h\n\x14\x43lientGatewayRequest\x12\x16\n\x0clist_devices\x18\x01 \x01(\tH\x00\x12-\n\x0e\x63ommand_device\x18\x02 \x01(\x0b\x32\x13.smart_city.CommandH\x00\x42\t\n\x07request\"@\n\x15GatewayClientResponse\x12\'\n\x07\x64\x65vices\x18\x01 \x03(\x0b\x32\x16.smart_city.DeviceInfo*4\n\nDeviceType\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x08\n\x04LAMP\x10\x01\x12\x0f\n\x0bTEMP_SENSOR\x10\x02\x42#\n\x11\x62r.ufc.trab.protoB\x0eSmartCityProtob\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x16proto/smart_city.proto\x12\nsmart_city\"w\n\nDeviceInfo\x12\n\n\x02id\x18\x01 \x01(\t\x12$\n\x04type\x18\x02 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x0e\n\x06status\x18\x03 \x01(\t\x12\x0c\n\x04zone\x18\x04 \x01(\t\x12\x19\n\x11pending_reconnect\x18\x05 \x01(\x08\"q\n\x0f\x44iscoveryPacket\x12$\n\x04info\x18\x01 \x01(\x0b\x32\x16.smart_city.DeviceInfo\x12\x12\n\nip_address\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\x05\x12\x16\n\x0e\x63orrelation_id\x18\x04 \x01(\r\"3\n\tHeartbeat\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x13\n\x0binterval_ms\x18\x02 \x01(\r\"x\n\rDeviceMessage\x12\x30\n\tdiscovery\x18\x01 \x01(\x0b\x32\x1b.smart_city.DiscoveryPacketH\x00\x12*\n\theartbeat\x18\x02 \x01(\x0b\x32\x15.smart_city.HeartbeatH\x00\x42\t\n\x07message\"M\n\x0bGatewayNode\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04host\x18\x02 \x01(\t\x12\x10\n\x08tcp_port\x18\x03 \x01(\r\x12\x10\n\x08udp_port\x18\x04 \x01(\r\"\xda\x01\n\x0eGatewayRequest\x12\x0e\n\x06\x61\x63tion\x18\x01 \x01(\t\x12&\n\x05nodes\x18\x02 \x03(\x0b\x32\x17.smart_city.GatewayNode\x12\x0c\n\x04node\x18\x03 \x01(\t\x12\x16\n\x0e\x61\x64mission_rate\x18\x04 \x01(\r\x12\x11\n\tconnected\x18\x05 \x01(\r\x12\x10\n\x08\x65xpected\x18\x06 \x01(\r\x12\x19\n\x11registered_filter\x18\x07 \x01(\x0c\x12\x15\n\rfilter_hashes\x18\x08 \x01(\r\x12\x13\n\x0b\x66ilter_seed\x18\t \x01(\r\".\n\nSensorData\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x02\"h\n\x0bSensorBatch\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x19\n\x11\x62\x61se_timestamp_ms\x18\x03 \x01(\x04\x12\x1b\n\x13timestamp_deltas_ms\x18\x04 \x03(\x11\x12\x0e\n\x06values\x18\x05 \x03(\x02\"X\n\x07\x43ommand\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x0e\n\x06\x61\x63tion\x18\x02 \x01(\t\x12\x16\n\x0e\x63orrelation_id\x18\x03 \x01(\r\x12\x12\n\ntimeout_ms\x18\x04 \x01(\r\"\x8c\x01\n\x0b\x42ulkCommand\x12\x0e\n\x06\x61\x63tion\x18\x01 \x01(\t\x12$\n\x04type\x18\x02 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x0c\n\x04zone\x18\x03 \x01(\t\x12\x11\n\tid_prefix\x18\x04 \x01(\t\x12\x12\n\ndevice_ids\x18\x05 \x03(\t\x12\x12\n\ntimeout_ms\x18\x06 \x01(\r\"\xbd\x01\n\rCommandResult\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x32\n\x07outcome\x18\x02 \x01(\x0e\x32!.smart_city.CommandResult.Outcome\x12\x0e\n\x06status\x18\x03 \x01(\t\x12\x0f\n\x07message\x18\x04 \x01(\t\"D\n\x07Outcome\x12\t\n\x05\x41\x43KED\x10\x00\x12\x11\n\rNOT_CONNECTED\x10\x01\x12\x0b\n\x07TIMEOUT\x10\x02\x12\x0e\n\nQUEUE_FULL\x10\x03\"2\n\x0eStatusResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"~\n\x10ListDevicesQuery\x12$\n\x04type\x18\x01 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x11\n\tid_prefix\x18\x02 \x01(\t\x12\x0e\n\x06status\x18\x03 \x01(\t\x12\x11\n\tpage_size\x18\x04 \x01(\r\x12\x0e\n\x06\x63ursor\x18\x05 \x01(\t\"W\n\x0eHistoryRequest\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x0f\n\x07\x66rom_ms\x18\x02 \x01(\x03\x12\r\n\x05to_ms\x18\x03 \x01(\x03\x12\x12\n\nresolution\x18\x04 \x01(\t\"E\n\x0f\x41ggregatesQuery\x12$\n\x04type\x18\x01 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x0c\n\x04zone\x18\x02 \x01(\t\"\xb7\x01\n\x0eGroupAggregate\x12$\n\x04type\x18\x01 \x01(\x0e\x32\x16.smart_city.DeviceType\x12\x0c\n\x04zone\x18\x02 \x01(\t\x12\r\n\x05\x63ount\x18\x03 \x01(\r\x12\x0f\n\x07pending\x18\x04 \x01(\r\x12\n\n\x02on\x18\x05 \x01(\r\x12\x0b\n\x03off\x18\x06 \x01(\r\x12\x10\n\x08readings\x18\x07 \x01(\r\x12\x0c\n\x04mean\x18\x08 \x01(\x01\x12\x0b\n\x03min\x18\t \x01(\x01\x12\x0b\n\x03max\x18\n \x01(\x01\"\x86\x01\n\x0fHistoryResponse\x12\x11\n\tdevice_id\x18\x01 \x01(\t\x12\x12\n\nresolution\x18\x02 \x01(\t\x12\x15\n\rtimestamps_ms\x18\x03 \x03(\x03\x12\x0b\n\x03min\x18\x04 \x03(\x02\x12\x0b\n\x03max\x18\x05 \x03(\x02\x12\x0c\n\x04mean\x18\x06 \x03(\x02\x12\r\n\x05\x63ount\x18\x07 \x03(\x04\"\xfe\x02\n\x14\x43lientGatewayRequest\x12\x16\n\x0clist_devices\x18\x01 \x01(\tH\x00\x12-\n\x0e\x63ommand_device\x18\x02 \x01(\x0b\x32\x13.smart_city.CommandH\x00\x12\x0e\n\x04ping\x18\x03 \x01(\tH\x00\x12\x13\n\tsubscribe\x18\x04 \x01(\tH\x00\x12\x35\n\rquery_devices\x18\x05 \x01(\x0b\x32\x1c.smart_city.ListDevicesQueryH\x00\x12-\n\x07history\x18\x06 \x01(\x0b\x32\x1a.smart_city.HistoryRequestH\x00\x12/\n\x0c\x62ulk_command\x18\x07 \x01(\x0b\x32\x17.smart_city.BulkCommandH\x00\x12\x11\n\x07metrics\x18\x08 \x01(\tH\x00\x12\x31\n\naggregates\x18\t \x01(\x0b\x32\x1b.smart_city.AggregatesQueryH\x00\x12\x12\n\nrequest_id\x18\x0f \x01(\rB\t\n\x07request\"\x83\x01\n\x0b\x44\x65viceEvent\x12*\n\x04kind\x18\x01 \x01(\x0e\x32\x1c.smart_city.DeviceEvent.Kind\x12&\n\x06\x64\x65vice\x18\x02 \x01(\x0b\x32\x16.smart_city.DeviceInfo\" \n\x04Kind\x12\x0b\n\x07UPDATED\x10\x00\x12\x0b\n\x07REMOVED\x10\x01\"\x87\x03\n\x15GatewayClientResponse\x12\'\n\x07\x64\x65vices\x18\x01 \x03(\x0b\x32\x16.smart_city.DeviceInfo\x12\x12\n\nrequest_id\x18\x02 \x01(\r\x12*\n\x06status\x18\x03 \x01(\x0b\x32\x1a.smart_city.StatusResponse\x12\'\n\x06\x65vents\x18\x04 \x03(\x0b\x32\x17.smart_city.DeviceEvent\x12\x13\n\x0bnext_cursor\x18\x05 \x01(\t\x12\x0f\n\x07version\x18\x06 \x01(\x04\x12,\n\x07history\x18\x07 \x01(\x0b\x32\x1b.smart_city.HistoryResponse\x12\x32\n\x0f\x63ommand_results\x18\x08 \x03(\x0b\x32\x19.smart_city.CommandResult\x12\x14\n\x0cmetrics_text\x18\t \x01(\t\x12.\n\naggregates\x18\n \x03(\x0b\x32\x1a.smart_city.GroupAggregate\x12\x0e\n\x06worker\x18\x0b \x01(\r\"\x93\x01\n\x1bGatewayClientResponseHeader\x12\x12\n\nrequest_id\x18\x02 \x01(\r\x12*\n\x06status\x18\x03 \x01(\x0b\x32\x1a.smart_city.StatusResponse\x12\x13\n\x0bnext_cursor\x18\x05 \x01(\t\x12\x0f\n\x07version\x18\x06 \x01(\x04\x12\x0e\n\x06worker\x18\x0b \x01(\r\"\xa2\x01\n\x12WorkerDeviceChange\x12&\n\x05\x65vent\x18\x01 \x01(\x0b\x32\x17.smart_city.DeviceEvent\x12\x0e\n\x06worker\x18\x02 \x01(\r\x12\x0f\n\x07\x61\x64\x64ress\x18\x03 \x01(\t\x12\x0c\n\x04port\x18\x04 \x01(\x05\x12\x13\n\x0bstatus_only\x18\x05 \x01(\x08\x12\x14\n\x07reading\x18\x06 \x01(\x01H\x00\x88\x01\x01\x42\n\n\x08_reading\"\xd9\x01\n\rWorkerMessage\x12\x0e\n\x06source\x18\x01 \x01(\r\x12\x0e\n\x06target\x18\x02 \x01(\r\x12\x0f\n\x07\x63\x61ll_id\x18\x03 \x01(\r\x12/\n\x07\x63hanges\x18\x04 \x03(\x0b\x32\x1e.smart_city.WorkerDeviceChange\x12\x31\n\x07request\x18\x05 \x01(\x0b\x32 .smart_city.ClientGatewayRequest\x12\x33\n\x08response\x18\x06 \x01(\x0b\x32!.smart_city.GatewayClientResponse\"d\n\x0cStoredDevice\x12$\n\x04info\x18\x01 \x01(\x0b\x32\x16.smart_city.DeviceInfo\x12\x0f\n\x07\x61\x64\x64ress\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\x05\x12\x0f\n\x07removed\x18\x04 \x01(\x08*4\n\nDeviceType\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x08\n\x04LAMP\x10\x01\x12\x0f\n\x0bTEMP_SENSOR\x10\x02\x42#\n\x11\x62r.ufc.trab.protoB\x0eSmartCityProtob\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -32,22 +32,58 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.smart_city_pb2', _glo
 if not _descriptor._USE_C_DESCRIPTORS:
   _globals['DESCRIPTOR']._loaded_options = None
   _globals['DESCRIPTOR']._serialized_options = b'\n\021br.ufc.trab.protoB\016SmartCityProto'
-  _globals['_DEVICETYPE']._serialized_start=561
-  _globals['_DEVICETYPE']._serialized_end=613
+  _globals['_DEVICETYPE']._serialized_start=3541
+  _globals['_DEVICETYPE']._serialized_end=3593
   _globals['_DEVICEINFO']._serialized_start=38
-  _globals['_DEVICEINFO']._serialized_end=116
-  _globals['_DISCOVERYPACKET']._serialized_start=118
-  _globals['_DISCOVERYPACKET']._serialized_end=207
-  _globals['_GATEWAYREQUEST']._serialized_start=209
-  _globals['_GATEWAYREQUEST']._serialized_end=241
-  _globals['_SENSORDATA']._serialized_start=243
-  _globals['_SENSORDATA']._serialized_end=289
-  _globals['_COMMAND']._serialized_start=291
-  _globals['_COMMAND']._serialized_end=335
-  _globals['_STATUSRESPONSE']._serialized_start=337
-  _globals['_STATUSRESPONSE']._serialized_end=387
-  _globals['_CLIENTGATEWAYREQUEST']._serialized_start=389
-  _globals['_CLIENTGATEWAYREQUEST']._serialized_end=493
-  _globals['_GATEWAYCLIENTRESPONSE']._serialized_start=495
-  _globals['_GATEWAYCLIENTRESPONSE']._serialized_end=559
+  _globals['_DEVICEINFO']._serialized_end=157
+  _globals['_DISCOVERYPACKET']._serialized_start=159
+  _globals['_DISCOVERYPACKET']._serialized_end=272
+  _globals['_HEARTBEAT']._serialized_start=274
+  _globals['_HEARTBEAT']._serialized_end=325
+  _globals['_DEVICEMESSAGE']._serialized_start=327
+  _globals['_DEVICEMESSAGE']._serialized_end=447
+  _globals['_GATEWAYNODE']._serialized_start=449
+  _globals['_GATEWAYNODE']._serialized_end=526
+  _globals['_GATEWAYREQUEST']._serialized_start=529
+  _globals['_GATEWAYREQUEST']._serialized_end=747
+  _globals['_SENSORDATA']._serialized_start=749
+  _globals['_SENSORDATA']._serialized_end=795
+  _globals['_SENSORBATCH']._serialized_start=797
+  _globals['_SENSORBATCH']._serialized_end=901
+  _globals['_COMMAND']._serialized_start=903
+  _globals['_COMMAND']._serialized_end=991
+  _globals['_BULKCOMMAND']._serialized_start=994
+  _globals['_BULKCOMMAND']._serialized_end=1134
+  _globals['_COMMANDRESULT']._serialized_start=1137
+  _globals['_COMMANDRESULT']._serialized_end=1326
+  _globals['_COMMANDRESULT_OUTCOME']._serialized_start=1258
+  _globals['_COMMANDRESULT_OUTCOME']._serialized_end=1326
+  _globals['_STATUSRESPONSE']._serialized_start=1328
+  _globals['_STATUSRESPONSE']._serialized_end=1378
+  _globals['_LISTDEVICESQUERY']._serialized_start=1380
+  _globals['_LISTDEVICESQUERY']._serialized_end=1506
+  _globals['_HISTORYREQUEST']._serialized_start=1508
+  _globals['_HISTORYREQUEST']._serialized_end=1595
+  _globals['_AGGREGATESQUERY']._serialized_start=1597
+  _globals['_AGGREGATESQUERY']._serialized_end=1666
+  _globals['_GROUPAGGREGATE']._serialized_start=1669
+  _globals['_GROUPAGGREGATE']._serialized_end=1852
+  _globals['_HISTORYRESPONSE']._serialized_start=1855
+  _globals['_HISTORYRESPONSE']._serialized_end=1989
+  _globals['_CLIENTGATEWAYREQUEST']._serialized_start=1992
+  _globals['_CLIENTGATEWAYREQUEST']._serialized_end=2374
+  _globals['_DEVICEEVENT']._serialized_start=2377
+  _globals['_DEVICEEVENT']._serialized_end=2508
+  _globals['_DEVICEEVENT_KIND']._serialized_start=2476
+  _globals['_DEVICEEVENT_KIND']._serialized_end=2508
+  _globals['_GATEWAYCLIENTRESPONSE']._serialized_start=2511
+  _globals['_GATEWAYCLIENTRESPONSE']._serialized_end=2902
+  _globals['_GATEWAYCLIENTRESPONSEHEADER']._serialized_start=2905
+  _globals['_GATEWAYCLIENTRESPONSEHEADER']._serialized_end=3052
+  _globals['_WORKERDEVICECHANGE']._serialized_start=3055
+  _globals['_WORKERDEVICECHANGE']._serialized_end=3217
+  _globals['_WORKERMESSAGE']._serialized_start=3220
+  _globals['_WORKERMESSAGE']._serialized_end=3437
+  _globals['_STOREDDEVICE']._serialized_start=3439
+  _globals['_STOREDDEVICE']._serialized_end=3539
 # @@protoc_insertion_point(module_scope)
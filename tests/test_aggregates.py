@@ -0,0 +1,86 @@
+import random
+from proto import smart_city_pb2
+from gateway.aggregates import ALL_ZONES, Aggregates, GroupStats
+from gateway.registry import DeviceRegistry
+
+LAMP = smart_city_pb2.DeviceType.LAMP
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+
+def reading(tenths):
+    return (False, None, tenths)
+
+def test_removing_extremes_finds_next_ones():
+    group = GroupStats()
+    for tenths in (250, 300, 300, 180, 410):
+        group.add(reading(tenths))
+    assert (group.min, group.max) == (180, 410)
+    group.discard(reading(180))
+    group.discard(reading(410))
+    assert (group.min, group.max) == (250, 300)
+    group.discard(reading(300)) #ainda resta um sensor em 300
+    assert group.max == 300
+    group.discard(reading(300))
+    assert (group.min, group.max) == (250, 250)
+    group.discard(reading(250))
+    assert (group.min, group.max) == (None, None)
+    assert group.readings == 0 and not group.values
+
+def test_replacing_extreme_with_new_value():
+    group = GroupStats()
+    for tenths in (200, 220, 240):
+        group.add(reading(tenths))
+    group.discard(reading(240))
+    group.add(reading(230))
+    group.discard(reading(200))
+    group.add(reading(150))
+    assert (group.min, group.max) == (150, 230)
+
+def test_stale_heap_entries_are_compacted():
+    group = GroupStats()
+    group.add(reading(0))
+    group.add(reading(10000))
+    #valores que entram e saem sem nunca serem extremos deixam entradas velhas nos heaps
+    for tenths in range(1, 5000):
+        group.add(reading(tenths))
+        group.discard(reading(tenths))
+    assert len(group._low) <= 2 * len(group.values) + 17
+    assert len(group._high) <= 2 * len(group.values) + 17
+    assert (group.min, group.max) == (0, 10000)
+
+def test_randomized_against_brute_force():
+    rng = random.Random(3)
+    group = GroupStats()
+    live = []
+    for _ in range(20000):
+        if live and rng.random() < 0.5:
+            tenths = live.pop(rng.randrange(len(live)))
+            group.discard(reading(tenths))
+        else:
+            tenths = rng.randint(-100, 400)
+            live.append(tenths)
+            group.add(reading(tenths))
+        assert group.min == (min(live) if live else None)
+        assert group.max == (max(live) if live else None)
+        assert group.total == sum(live)
+
+def test_registry_changes_update_type_and_zone_groups():
+    registry = DeviceRegistry()
+    aggregates = Aggregates(registry)
+    registry.register("lamp_1", LAMP, "ON", "centro", "10.0.0.1", 0, None)
+    registry.register("lamp_2", LAMP, "OFF", "norte", "10.0.0.1", 0, None)
+    registry.register("sensor_1", TEMP_SENSOR, "20°C", "centro", "10.0.0.2", 0, None)
+    registry.register("sensor_2", TEMP_SENSOR, "30°C", "", "10.0.0.2", 0, None)
+    registry.set_reading("sensor_1", 24.5)
+
+    totals = dict(aggregates.query())
+    assert (totals[(LAMP, "")].on, totals[(LAMP, "")].off) == (1, 1)
+    sensors = totals[(TEMP_SENSOR, "")]
+    assert sensors.count == 2 and (sensors.min, sensors.max) == (245, 300)
+
+    zones = dict(aggregates.query(TEMP_SENSOR, ALL_ZONES))
+    assert list(zones) == [(TEMP_SENSOR, "centro")] #sem zona, só entra no total
+
+    registry.remove("lamp_2")
+    assert [key for key, _ in aggregates.query(LAMP, ALL_ZONES)] == [(LAMP, "centro")]
+    registry.remove("sensor_2")
+    assert aggregates.query(TEMP_SENSOR)[0][1].max == 245
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from proto import smart_city_pb2
+from web_client.backend import main
+
+def respond(monkeypatch, response_proto):
+    requests = []
+
+    async def request_owner(device_id, request_proto, timeout):
+        requests.append(request_proto)
+        return response_proto
+
+    monkeypatch.setattr(main.gateway_cluster, 'request_owner', request_owner)
+    return requests
+
+def send(command_req, device_id="lamp_1"):
+    return asyncio.run(main.send_device_command(device_id, command_req))
+
+def status_of(command_req):
+    with pytest.raises(HTTPException) as error:
+        send(command_req)
+    return error.value.status_code
+
+def test_missing_or_invalid_action_is_400(monkeypatch):
+    requests = respond(monkeypatch, smart_city_pb2.GatewayClientResponse())
+    assert status_of({}) == 400
+    assert status_of({"action": 1}) == 400
+    assert status_of({"action": "TURN_ON", "timeout_ms": "logo"}) == 400
+    assert requests == []
+
+def test_no_results_is_502(monkeypatch):
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    response_proto.status.success = False
+    response_proto.status.message = "worker 2 falhou"
+    respond(monkeypatch, response_proto)
+    with pytest.raises(HTTPException) as error:
+        send({"action": "TURN_ON"})
+    assert error.value.status_code == 502 and error.value.detail == "worker 2 falhou"
+
+def test_outcomes_map_to_http_status(monkeypatch):
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    result = response_proto.command_results.add(device_id="lamp_1")
+    respond(monkeypatch, response_proto)
+    for outcome, status in ((smart_city_pb2.CommandResult.NOT_CONNECTED, 404),
+                            (smart_city_pb2.CommandResult.TIMEOUT, 504),
+                            (smart_city_pb2.CommandResult.QUEUE_FULL, 503)):
+        result.outcome = outcome
+        assert status_of({"action": "TURN_ON"}) == status
+
+def test_acked_command(monkeypatch):
+    response_proto = smart_city_pb2.GatewayClientResponse()
+    response_proto.command_results.add(device_id="lamp_1", outcome=smart_city_pb2.CommandResult.ACKED, status="ON")
+    requests = respond(monkeypatch, response_proto)
+    assert send({"action": "TURN_ON", "timeout_ms": 500})["device_status"] == "ON"
+    assert requests[0].command_device.action == "TURN_ON" and requests[0].command_device.timeout_ms == 500
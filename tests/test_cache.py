@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+from types import SimpleNamespace
+from web_client.backend.cache import COMPRESS_MIN_SIZE, ResponseCache, choose_encoding, etag_matches
+
+class Upstream:
+    '''Gateway falso: versão do registro e contagem das consultas.'''
+
+    def __init__(self, body=b'{"devices":[]}'):
+        self.version = 1
+        self.body = body
+        self.probes = 0
+        self.fetches = 0
+        self.release = None #Event que segura o fetch, para testar requisições simultâneas
+
+    async def probe(self):
+        self.probes += 1
+        return (self.version,)
+
+    async def fetch(self):
+        self.fetches += 1
+        if self.release is not None:
+            await self.release.wait()
+        return (self.version,), self.body
+
+def cache_and_clock(**kwargs):
+    clock = SimpleNamespace(now=0.0)
+    return clock, ResponseCache(clock=lambda: clock.now, **kwargs)
+
+def test_within_ttl_served_without_upstream():
+    async def run():
+        clock, cache = cache_and_clock(ttl=1.0)
+        upstream = Upstream()
+        first = await cache.get('devices', upstream.probe, upstream.fetch)
+        clock.now = 0.5
+        assert await cache.get('devices', upstream.probe, upstream.fetch) is first
+        assert (upstream.probes, upstream.fetches) == (0, 1)
+    asyncio.run(run())
+
+def test_after_ttl_unchanged_version_only_probes():
+    async def run():
+        clock, cache = cache_and_clock(ttl=1.0)
+        upstream = Upstream()
+        first = await cache.get('devices', upstream.probe, upstream.fetch)
+        clock.now = 1.5
+        again = await cache.get('devices', upstream.probe, upstream.fetch)
+        assert again is first and again.etag == first.etag
+        assert (upstream.probes, upstream.fetches) == (1, 1)
+        #a validação renova o TTL
+        clock.now = 2.0
+        await cache.get('devices', upstream.probe, upstream.fetch)
+        assert upstream.probes == 1
+    asyncio.run(run())
+
+def test_new_version_refetches_with_new_etag():
+    async def run():
+        clock, cache = cache_and_clock(ttl=1.0)
+        upstream = Upstream()
+        first = await cache.get('devices', upstream.probe, upstream.fetch)
+        upstream.version = 2
+        clock.now = 1.5
+        second = await cache.get('devices', upstream.probe, upstream.fetch)
+        assert upstream.fetches == 2 and second.etag != first.etag
+    asyncio.run(run())
+
+def test_concurrent_misses_share_one_fetch():
+    async def run():
+        _, cache = cache_and_clock()
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        waiting = [asyncio.ensure_future(cache.get('devices', upstream.probe, upstream.fetch)) for _ in range(50)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        entries = await asyncio.gather(*waiting)
+        assert upstream.fetches == 1
+        assert all(entry is entries[0] for entry in entries)
+    asyncio.run(run())
+
+def test_cancelled_client_does_not_cancel_shared_fetch():
+    async def run():
+        _, cache = cache_and_clock()
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        impatient = asyncio.ensure_future(cache.get('devices', upstream.probe, upstream.fetch))
+        patient = asyncio.ensure_future(cache.get('devices', upstream.probe, upstream.fetch))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        upstream.release.set()
+        assert (await patient).body == upstream.body
+        assert upstream.fetches == 1
+    asyncio.run(run())
+
+def test_lru_eviction():
+    async def run():
+        _, cache = cache_and_clock(max_entries=2)
+        upstream = Upstream()
+        for key in ('a', 'b'):
+            await cache.get(key, upstream.probe, upstream.fetch)
+        await cache.get('a', upstream.probe, upstream.fetch) #'a' passa a ser a mais recente
+        await cache.get('c', upstream.probe, upstream.fetch)
+        assert list(cache._entries) == ['a', 'c']
+        await cache.get('b', upstream.probe, upstream.fetch)
+        assert upstream.fetches == 4
+    asyncio.run(run())
+
+def test_partial_answers_are_not_cached():
+    async def run():
+        _, cache = cache_and_clock()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return None, b'{"devices":[],"unavailable":["node1"]}'
+
+        entry = await cache.get('devices', None, fetch)
+        assert entry.etag is None
+        await cache.get('devices', None, fetch)
+        assert len(calls) == 2
+    asyncio.run(run())
+
+def test_etag_matching():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"abd"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"abc"', None)
+
+def test_compressed_representation_has_own_etag():
+    async def run():
+        _, cache = cache_and_clock()
+        upstream = Upstream(body=b'{"x":1}' * COMPRESS_MIN_SIZE)
+        entry = await cache.get('devices', upstream.probe, upstream.fetch)
+        encoding = entry.encoding_for(choose_encoding('gzip;q=1, identity'))
+        assert encoding == 'gzip'
+        assert entry.etag_for(encoding) != entry.etag
+        body = await entry.body_for(encoding)
+        assert gzip.decompress(body) == upstream.body
+        assert await entry.body_for(encoding) is body #comprimido uma vez só
+        assert choose_encoding('gzip;q=0') is None
+    asyncio.run(run())
+
+def test_small_bodies_are_not_compressed():
+    async def run():
+        _, cache = cache_and_clock()
+        upstream = Upstream()
+        entry = await cache.get('devices', upstream.probe, upstream.fetch)
+        assert entry.encoding_for('gzip') is None
+    asyncio.run(run())
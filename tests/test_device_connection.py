@@ -0,0 +1,45 @@
+import asyncio
+from proto import smart_city_pb2
+from proto.framing import encode_message
+from devices.atuador_poste import build_packet
+from gateway import gateway
+
+class FakeWriter:
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+class FakeOutbox:
+    def close(self):
+        pass
+
+def discovery(device_id, status):
+    return encode_message(smart_city_pb2.DeviceMessage(discovery=build_packet(status, device_id=device_id)))
+
+def run_connection(*messages):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b''.join(messages))
+        reader.feed_eof()
+        await gateway.handle_device_tcp(reader, FakeWriter())
+    asyncio.run(run())
+
+def test_connection_only_updates_its_own_device():
+    registry = gateway.registry
+    registry.register("lamp_b", smart_city_pb2.DeviceType.LAMP, "OFF", "centro", "10.0.0.2", 0, FakeOutbox())
+    seen = []
+    listener = lambda record, removed: seen.append((record.id, record.status_text, removed))
+    registry.add_listener(listener)
+    try:
+        run_connection(discovery("lamp_a", "OFF"), discovery("lamp_b", "ON"), discovery("lamp_a", "ON"))
+        assert registry.get("lamp_b").status_text == "OFF"
+        assert ("lamp_a", "ON", False) in seen
+        assert "lamp_a" not in registry #conexão encerrada
+    finally:
+        registry.remove_listener(listener)
+        registry.remove("lamp_b")
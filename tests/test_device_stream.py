@@ -0,0 +1,39 @@
+import asyncio
+import socket
+from proto import smart_city_pb2
+from proto.cluster import Node
+from web_client.backend import device_stream
+from web_client.backend.device_stream import DeviceStream
+
+class FakeClient:
+    def __init__(self):
+        self.resyncs = 0
+
+    def request_resync(self):
+        self.resyncs += 1
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_node_down_clears_mirror_once(monkeypatch):
+    monkeypatch.setattr(device_stream, 'RECONNECT_DELAY', 0.01)
+
+    async def run():
+        node = Node("node0", '127.0.0.1', free_port(), 0) #nada ouvindo: toda tentativa falha
+        stream = DeviceStream([node])
+        client = FakeClient()
+        stream.clients.add(client)
+        info = smart_city_pb2.DeviceInfo(id="lamp_1", type=smart_city_pb2.DeviceType.LAMP, status="ON")
+        stream._replace_devices(node, [info]) #como se a inscrição estivesse funcionando
+        assert client.resyncs == 1 and "lamp_1" in stream.devices
+
+        await stream.start()
+        await asyncio.sleep(0.2) #várias tentativas de reconexão
+        await stream.close()
+        return stream, client
+
+    stream, client = asyncio.run(run())
+    assert stream.devices == {}
+    assert client.resyncs == 2 #a perda da inscrição, e nada a cada tentativa
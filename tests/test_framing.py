@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, FrameError, ZERO_COPY_MIN_FRAME, encode_frame, encode_message, \
+    encode_varint, iter_frames, read_message
+
+def heartbeat(device_id):
+    message = smart_city_pb2.DeviceMessage()
+    message.heartbeat.interval_ms = 5000
+    message.heartbeat.device_id = device_id
+    return message
+
+def test_frame_split_across_feeds():
+    decoder = FrameDecoder()
+    frame = encode_frame(b'x' * 300) #prefixo de dois bytes
+    for i in range(len(frame) - 1):
+        decoder.feed(frame[i:i + 1])
+        assert decoder.next_frame() is None
+    decoder.feed(frame[-1:])
+    assert decoder.next_frame() == b'x' * 300
+    assert decoder.pending() == 0
+
+def test_several_frames_in_one_feed():
+    decoder = FrameDecoder()
+    payloads = [b'a', b'', b'b' * 200, b'c' * 70000]
+    decoder.feed(b''.join(encode_frame(payload) for payload in payloads) + encode_frame(b'd')[:1])
+    assert list(decoder.frames()) == payloads
+    assert decoder.pending() == 1
+
+def test_buffer_compaction_keeps_partial_frame():
+    decoder = FrameDecoder()
+    for i in range(1000):
+        frame = encode_frame(str(i).encode())
+        decoder.feed(frame[:1])
+        decoder.feed(frame[1:])
+        assert decoder.next_frame() == str(i).encode()
+    assert decoder.pending() == 0
+
+def test_bad_varint_raises():
+    decoder = FrameDecoder()
+    decoder.feed(b'\xff' * 6)
+    with pytest.raises(FrameError):
+        decoder.next_frame()
+
+def test_truncated_varint_waits_for_more_bytes():
+    decoder = FrameDecoder()
+    decoder.feed(encode_varint(300)[:1])
+    assert decoder.next_frame() is None
+
+def test_oversized_length_is_rejected():
+    decoder = FrameDecoder(max_frame_size=1024)
+    decoder.feed(encode_varint(1025))
+    with pytest.raises(FrameError):
+        decoder.next_frame()
+
+def test_parse_next_small_and_zero_copy_frames():
+    decoder = FrameDecoder()
+    big = heartbeat('x' * ZERO_COPY_MIN_FRAME)
+    decoder.feed(encode_message(heartbeat('lamp_1')) + encode_message(big))
+    message = smart_city_pb2.DeviceMessage()
+    assert decoder.parse_next(message)
+    assert message.heartbeat.device_id == 'lamp_1'
+    assert decoder.parse_next(message)
+    assert message == big
+    assert not decoder.parse_next(message)
+    decoder.feed(b'z') #nenhuma view ficou presa ao buffer
+
+def test_iter_frames_stops_at_truncated_tail():
+    data = encode_frame(b'one') + encode_frame(b'two') + encode_frame(b'three')[:-2]
+    frames = []
+    for frame in iter_frames(data):
+        frames.append(bytes(frame))
+        frame.release()
+    assert frames == [b'one', b'two']
+
+def test_iter_frames_bad_varint_raises():
+    with pytest.raises(FrameError):
+        for frame in iter_frames(encode_frame(b'ok') + b'\xff' * 6):
+            frame.release()
+
+def feed_reader(*chunks):
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+def test_read_message_until_end_of_stream():
+    async def run():
+        stream = encode_message(heartbeat('a')) + encode_message(heartbeat('b'))
+        reader = feed_reader(stream[:3], stream[3:])
+        decoder, message = FrameDecoder(), smart_city_pb2.DeviceMessage()
+        ids = []
+        while await read_message(reader, decoder, message):
+            ids.append(message.heartbeat.device_id)
+        return ids
+    assert asyncio.run(run()) == ['a', 'b']
+
+def test_read_message_stream_closed_mid_frame():
+    async def run():
+        reader = feed_reader(encode_message(heartbeat('a'))[:-1])
+        await read_message(reader, FrameDecoder(), smart_city_pb2.DeviceMessage())
+    with pytest.raises(FrameError):
+        asyncio.run(run())
@@ -0,0 +1,54 @@
+import asyncio
+import socket
+import pytest
+from google.protobuf.message import DecodeError
+from proto import smart_city_pb2
+from devices.sensor_temperatura import build_batch
+from gateway.ingest import SensorDecoder, UdpIngest
+from gateway.registry import DeviceRegistry
+
+def sensor_data(device_id, value):
+    return smart_city_pb2.SensorData(device_id=device_id, value=value).SerializeToString()
+
+def test_decode_sensor_data_and_batches():
+    decoder = SensorDecoder()
+    device_id, readings, is_batch = decoder.decode(memoryview(sensor_data("s1", 25.5)), 1000)
+    assert (device_id, readings, is_batch) == ("s1", [(1000, 25.5)], False)
+
+    batch = build_batch([(5000, 20.0), (5100, 21.0)], device_id="s2").SerializeToString()
+    assert decoder.decode(batch, 1000) == ("s2", [(5000, 20.0), (5100, 21.0)], True)
+
+    single = build_batch([(7000, 22.0)], device_id="s3").SerializeToString()
+    assert decoder.decode(single, 1000) == ("s3", [(7000, 22.0)], True)
+
+def test_decode_rejects_malformed():
+    decoder = SensorDecoder()
+    with pytest.raises(DecodeError):
+        decoder.decode(b'\xff\xff\xff', 0)
+    with pytest.raises(DecodeError):
+        decoder.decode(smart_city_pb2.SensorData(value=1.0).SerializeToString(), 0)
+
+def test_counters_count_batches_by_message_kind():
+    async def run():
+        registry = DeviceRegistry()
+        for device_id in ("s1", "s2"):
+            registry.register(device_id, smart_city_pb2.DeviceType.TEMP_SENSOR, "20°C", "", "10.0.0.2", 0, None)
+        ingest = UdpIngest(registry, 0)
+        ingest.start()
+        port = ingest._sock.getsockname()[1]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for datagram in (sensor_data("s1", 30.0),
+                             build_batch([(1000, 31.0)], device_id="s2").SerializeToString(),
+                             build_batch([(1000, 32.0), (1100, 33.0)], device_id="s2").SerializeToString(),
+                             sensor_data("desconhecido", 1.0), b'\xff\xff'):
+                sender.sendto(datagram, ('127.0.0.1', port))
+        for _ in range(100):
+            if ingest.counters.datagrams == 5:
+                break
+            await asyncio.sleep(0.01)
+        ingest.close()
+        return registry, ingest.counters
+    registry, counters = asyncio.run(run())
+    assert (counters.datagrams, counters.batches, counters.readings) == (5, 2, 4)
+    assert (counters.malformed, counters.dropped) == (1, 1)
+    assert registry.get("s1").status == 30.0 and registry.get("s2").status == pytest.approx(33.0)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+from proto import smart_city_pb2
+from proto.framing import encode_frame
+from gateway import journal as journal_module
+from gateway.journal import RegistryJournal
+from gateway.registry import DeviceRegistry
+
+LAMP = smart_city_pb2.DeviceType.LAMP
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+
+def files(directory):
+    return sorted(os.listdir(directory))
+
+def populate(registry, count):
+    for i in range(count):
+        registry.register(f"lamp_{i}", LAMP, "ON" if i % 2 else "OFF", "centro", "10.0.0.1", 5000 + i, None)
+
+def restored(directory):
+    registry = DeviceRegistry()
+    RegistryJournal(registry, directory).load()
+    return registry
+
+def test_restore_from_snapshot_and_log(tmp_path):
+    registry = DeviceRegistry()
+    journal = RegistryJournal(registry, str(tmp_path))
+    assert journal.load() == 0
+    populate(registry, 5)
+    assert journal.flush() #primeiro flush depois do load pede compactação
+    journal.compact()
+    assert files(tmp_path) == ['journal-00000001.log', 'snapshot-00000001.bin']
+
+    registry.set_status_text("lamp_0", "ON")
+    registry.remove("lamp_1")
+    registry.register("sensor_1", TEMP_SENSOR, "27°C", "norte", "10.0.0.2", 0, None)
+    assert not journal.flush()
+    assert os.path.getsize(tmp_path / 'journal-00000001.log') > 0
+
+    #sem close(): como depois de uma queda, o estado vem do snapshot mais o log
+    again = restored(str(tmp_path))
+    assert sorted(record.id for record in again) == ['lamp_0', 'lamp_2', 'lamp_3', 'lamp_4', 'sensor_1']
+    assert all(record.pending for record in again)
+    assert again.get("lamp_0").status_text == "ON"
+    assert again.get("sensor_1").status == 27.0
+    assert (again.get("lamp_3").address, again.get("lamp_3").port) == ("10.0.0.1", 5003)
+
+def test_compaction_starts_new_generation(tmp_path):
+    registry = DeviceRegistry()
+    journal = RegistryJournal(registry, str(tmp_path))
+    journal.load()
+    populate(registry, 3)
+    journal.compact()
+    registry.remove("lamp_0")
+    journal.flush()
+    journal.close()
+    assert files(tmp_path) == ['journal-00000002.log', 'snapshot-00000002.bin']
+    assert os.path.getsize(tmp_path / 'journal-00000002.log') == 0
+    assert sorted(record.id for record in restored(str(tmp_path))) == ['lamp_1', 'lamp_2']
+
+def test_log_growth_asks_for_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, 'COMPACT_MIN_BYTES', 100)
+    registry = DeviceRegistry()
+    journal = RegistryJournal(registry, str(tmp_path))
+    journal.load()
+    populate(registry, 1)
+    journal.compact()
+    for i in range(20):
+        registry.set_status_text("lamp_0", "ON" if i % 2 else "OFF")
+        if journal.flush():
+            break
+    else:
+        raise AssertionError("o log cresceu sem pedir compactação")
+
+def test_background_compaction_keeps_changes_made_meanwhile(tmp_path):
+    async def run():
+        registry = DeviceRegistry()
+        journal = RegistryJournal(registry, str(tmp_path))
+        journal.load()
+        populate(registry, 100)
+        compaction = asyncio.ensure_future(journal.compact_async())
+        await asyncio.sleep(0) #cópia feita; o snapshot está sendo gravado no executor
+        registry.register("late", LAMP, "ON", "sul", "10.0.0.3", 0, None)
+        await compaction
+        journal.flush()
+    asyncio.run(run())
+    again = restored(str(tmp_path))
+    assert len(again) == 101 and "late" in again
+
+def write_crashed_journal(directory):
+    registry = DeviceRegistry()
+    journal = RegistryJournal(registry, directory)
+    journal.load()
+    populate(registry, 3)
+    journal.compact()
+    registry.set_status_text("lamp_0", "ON")
+    journal.flush()
+    return os.path.join(directory, 'journal-00000001.log')
+
+def test_truncated_log_tail_is_ignored(tmp_path):
+    path = write_crashed_journal(str(tmp_path))
+    with open(path, 'ab') as f:
+        f.write(encode_frame(b'x' * 50)[:20]) #última escrita interrompida
+    again = restored(str(tmp_path))
+    assert len(again) == 3 and again.get("lamp_0").status_text == "ON"
+
+def test_bad_length_prefix_keeps_what_was_read(tmp_path):
+    path = write_crashed_journal(str(tmp_path))
+    with open(path, 'ab') as f:
+        f.write(b'\xff' * 6)
+    again = restored(str(tmp_path))
+    assert len(again) == 3 and again.get("lamp_0").status_text == "ON"
+
+def test_corrupt_record_keeps_what_was_read(tmp_path):
+    path = write_crashed_journal(str(tmp_path))
+    with open(path, 'ab') as f:
+        f.write(encode_frame(b'\xff\xff\xff\xff'))
+    again = restored(str(tmp_path))
+    assert len(again) == 3 and again.get("lamp_0").status_text == "ON"
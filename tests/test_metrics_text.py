@@ -0,0 +1,19 @@
+from proto.metrics_text import merge_texts
+
+def test_merge_adds_label_and_groups_families():
+    worker_1 = ('# HELP requests_total Requisições.\n# TYPE requests_total counter\n'
+                'requests_total{kind="web"} 3\nrequests_total{kind="device"} 1\n'
+                '# HELP up Processo no ar.\n# TYPE up gauge\nup 1\n')
+    worker_2 = ('# HELP requests_total Requisições.\n# TYPE requests_total counter\n'
+                'requests_total{kind="web"} 5\n')
+    merged = merge_texts({'1': worker_1, '2"x': worker_2}, 'worker').splitlines()
+    assert merged == [
+        '# HELP requests_total Requisições.',
+        '# TYPE requests_total counter',
+        'requests_total{kind="web",worker="1"} 3',
+        'requests_total{kind="device",worker="1"} 1',
+        'requests_total{kind="web",worker="2\\"x"} 5',
+        '# HELP up Processo no ar.',
+        '# TYPE up gauge',
+        'up{worker="1"} 1',
+    ]
@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from proto import smart_city_pb2
+from gateway.registry import DeviceRegistry
+from gateway.rules import RuleError, RulesEngine, parse_rules
+
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+HOLD = 0.05
+
+class FakeDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    async def send_bulk(self, bulk):
+        self.sent.append(bulk.action)
+        return []
+
+def heat_rule(hold=HOLD, otherwise=True):
+    spec = {
+        'name': 'calor',
+        'when': {'type': 'TEMP_SENSOR', 'zone': 'centro', 'above': 30},
+        'then': {'action': 'TURN_ON', 'type': 'LAMP', 'zone': 'centro'},
+        'hold_seconds': hold,
+    }
+    if otherwise:
+        spec['otherwise'] = {'action': 'TURN_OFF', 'type': 'LAMP', 'zone': 'centro'}
+    return parse_rules([spec])
+
+def engine_with_sensors(count=2, **rule_args):
+    registry = DeviceRegistry()
+    for i in range(count):
+        registry.register(f"sensor_{i}", TEMP_SENSOR, "25°C", "centro", "10.0.0.2", 0, None)
+    dispatcher = FakeDispatcher()
+    return registry, dispatcher, RulesEngine(registry, dispatcher, heat_rule(**rule_args))
+
+async def settle():
+    await asyncio.sleep(HOLD * 3)
+
+def test_fires_once_per_crossing():
+    async def run():
+        registry, dispatcher, engine = engine_with_sensors()
+        registry.set_reading("sensor_0", 31)
+        await settle()
+        assert dispatcher.sent == ['TURN_ON']
+        #continuar acima, ou outro sensor cruzar também, não dispara de novo
+        registry.set_reading("sensor_0", 33)
+        registry.set_reading("sensor_1", 35)
+        await settle()
+        assert dispatcher.sent == ['TURN_ON']
+        engine.close()
+    asyncio.run(run())
+
+def test_oscillation_within_hold_does_not_fire():
+    async def run():
+        registry, dispatcher, engine = engine_with_sensors(hold=HOLD * 4)
+        for _ in range(5):
+            registry.set_reading("sensor_0", 31)
+            await asyncio.sleep(HOLD / 5)
+            registry.set_reading("sensor_0", 25)
+            await asyncio.sleep(HOLD / 5)
+        await asyncio.sleep(HOLD * 6)
+        assert dispatcher.sent == []
+        engine.close()
+    asyncio.run(run())
+
+def test_rearms_after_recovery():
+    async def run():
+        registry, dispatcher, engine = engine_with_sensors()
+        registry.set_reading("sensor_0", 31)
+        await settle()
+        registry.set_reading("sensor_0", 25)
+        await settle()
+        registry.set_reading("sensor_0", 32)
+        await settle()
+        assert dispatcher.sent == ['TURN_ON', 'TURN_OFF', 'TURN_ON']
+        engine.close()
+    asyncio.run(run())
+
+def test_recovery_waits_for_every_matching_device():
+    async def run():
+        registry, dispatcher, engine = engine_with_sensors(otherwise=True)
+        registry.set_reading("sensor_0", 31)
+        registry.set_reading("sensor_1", 31)
+        await settle()
+        registry.set_reading("sensor_0", 25)
+        await settle()
+        assert dispatcher.sent == ['TURN_ON']
+        registry.remove("sensor_1") #o último acima do limite saiu
+        await settle()
+        assert dispatcher.sent == ['TURN_ON', 'TURN_OFF']
+        engine.close()
+    asyncio.run(run())
+
+def test_existing_state_does_not_fire_on_start():
+    async def run():
+        registry = DeviceRegistry()
+        registry.register("sensor_0", TEMP_SENSOR, "35°C", "centro", "10.0.0.2", 0, None)
+        dispatcher = FakeDispatcher()
+        engine = RulesEngine(registry, dispatcher, heat_rule())
+        await settle()
+        assert dispatcher.sent == []
+        registry.set_reading("sensor_0", 20)
+        await settle()
+        assert dispatcher.sent == ['TURN_OFF']
+        engine.close()
+    asyncio.run(run())
+
+def test_other_zones_are_not_observed():
+    async def run():
+        registry, dispatcher, engine = engine_with_sensors()
+        registry.register("sensor_norte", TEMP_SENSOR, "40°C", "norte", "10.0.0.2", 0, None)
+        await settle()
+        assert dispatcher.sent == [] and engine.rules[0].matching == set()
+        engine.close()
+    asyncio.run(run())
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(RuleError):
+        parse_rules([{'name': 'x', 'when': {'type': 'LAMP'}, 'then': {'action': 'TURN_ON'}}])
+    with pytest.raises(RuleError):
+        parse_rules([{'name': 'x', 'when': {'type': 'POSTE', 'above': 1}, 'then': {'action': 'TURN_ON'}}])
+    with pytest.raises(RuleError):
+        parse_rules({'name': 'x'})
@@ -0,0 +1,27 @@
+import asyncio
+from devices import simulador
+from devices.simulador import Simulator
+
+def test_failed_attempts_are_not_reconnects(monkeypatch):
+    monkeypatch.setattr(simulador, 'backoff_delay', lambda attempt, rng=None: 0.01)
+
+    async def run():
+        async def drop(reader, writer):
+            writer.close() #o Gateway derruba toda conexão: o dispositivo volta e é derrubado de novo
+
+        server = await asyncio.start_server(drop, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        simulator = Simulator(1, 0, '127.0.0.1', port, source_ip='127.0.0.1', heartbeats=False)
+        await simulator.start()
+        await asyncio.sleep(0.2)
+        server.close()
+        await server.wait_closed()
+        connected = simulator.stats.connected
+        await asyncio.sleep(0.2) #agora toda tentativa é recusada
+        await simulator.close()
+        return simulator.stats, connected
+
+    stats, connected = asyncio.run(run())
+    assert connected > 1 and stats.failed > 0
+    #a primeira conexão não é uma reconexão; as recusadas também não
+    assert stats.reconnects == stats.connected - 1
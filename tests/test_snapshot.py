@@ -0,0 +1,96 @@
+from proto import smart_city_pb2
+from gateway.registry import DeviceRegistry
+from gateway.snapshot import DeviceSnapshot
+
+LAMP = smart_city_pb2.DeviceType.LAMP
+TEMP_SENSOR = smart_city_pb2.DeviceType.TEMP_SENSOR
+
+def decode(data):
+    response = smart_city_pb2.GatewayClientResponse()
+    response.ParseFromString(data)
+    return response.devices
+
+def ids(data):
+    return [info.id for info in decode(data)]
+
+def populated(lamps=10, sensors=5):
+    registry = DeviceRegistry()
+    snapshot = DeviceSnapshot(registry)
+    for i in range(lamps):
+        registry.register(f"lamp_{i:02d}", LAMP, "ON" if i % 2 else "OFF", "centro", "10.0.0.1", 0, None)
+    for i in range(sensors):
+        registry.register(f"sensor_{i:02d}", TEMP_SENSOR, "25°C", "norte", "10.0.0.2", 0, None)
+    return registry, snapshot
+
+def query(**fields):
+    return smart_city_pb2.ListDevicesQuery(**fields)
+
+def all_pages(snapshot, **fields):
+    pages, cursor = [], ""
+    while True:
+        data, cursor = snapshot.page(query(cursor=cursor, **fields))
+        pages.append(ids(data))
+        if not cursor:
+            return pages
+
+def test_full_list_is_sorted_and_decodes():
+    registry, snapshot = populated()
+    devices = decode(snapshot.full())
+    assert [info.id for info in devices] == sorted(record.id for record in registry)
+    assert devices[1].status == "ON" and devices[-1].status == "25°C"
+
+def test_pages_cover_every_device_once():
+    _, snapshot = populated()
+    pages = all_pages(snapshot, page_size=4)
+    assert [len(page) for page in pages] == [4, 4, 4, 3]
+    flat = [device_id for page in pages for device_id in page]
+    assert flat == sorted(flat) and len(set(flat)) == 15
+
+def test_exact_last_page_has_no_cursor():
+    _, snapshot = populated(lamps=4, sensors=0)
+    data, cursor = snapshot.page(query(page_size=4))
+    assert len(ids(data)) == 4 and cursor == ""
+
+def test_filters_by_type_prefix_and_status():
+    _, snapshot = populated()
+    assert ids(snapshot.page(query(type=TEMP_SENSOR))[0]) == [f"sensor_{i:02d}" for i in range(5)]
+    assert ids(snapshot.page(query(id_prefix="lamp_0"))[0]) == [f"lamp_{i:02d}" for i in range(10)]
+    assert ids(snapshot.page(query(id_prefix="lamp_0", status="ON"))[0]) == \
+        [f"lamp_{i:02d}" for i in range(1, 10, 2)]
+    pages = all_pages(snapshot, type=LAMP, status="OFF", page_size=2)
+    assert [device_id for page in pages for device_id in page] == [f"lamp_{i:02d}" for i in range(0, 10, 2)]
+
+def test_cursor_is_stable_under_concurrent_changes():
+    registry, snapshot = populated(lamps=10, sensors=0)
+    data, cursor = snapshot.page(query(page_size=4))
+    assert ids(data) == ["lamp_00", "lamp_01", "lamp_02", "lamp_03"]
+    #entre uma página e outra: sai o dono do cursor, entram ids antes e depois dele
+    registry.remove("lamp_03")
+    registry.remove("lamp_05")
+    registry.register("lamp_015", LAMP, "ON", "centro", "10.0.0.1", 0, None)
+    registry.register("lamp_035", LAMP, "ON", "centro", "10.0.0.1", 0, None)
+    rest = []
+    while cursor:
+        data, cursor = snapshot.page(query(page_size=4, cursor=cursor))
+        rest += ids(data)
+    #nada repetido nem pulado entre os que existiam nas duas leituras
+    assert rest == ["lamp_035", "lamp_04", "lamp_06", "lamp_07", "lamp_08", "lamp_09"]
+
+def test_changes_invalidate_preserialized_entries():
+    registry, snapshot = populated(lamps=3, sensors=1)
+    before = snapshot.full()
+    assert snapshot.full() is before #em cache até a próxima mudança
+    registry.set_status_text("lamp_00", "ON")
+    registry.set_reading("sensor_00", 31.0)
+    registry.remove("lamp_02")
+    after = decode(snapshot.full())
+    assert [(info.id, info.status) for info in after] == \
+        [("lamp_00", "ON"), ("lamp_01", "ON"), ("sensor_00", "31°C")]
+    assert ids(snapshot.page(query(type=LAMP))[0]) == ["lamp_00", "lamp_01"]
+
+def test_reregistration_does_not_duplicate():
+    registry, snapshot = populated(lamps=2, sensors=0)
+    registry.register("lamp_00", LAMP, "ON", "sul", "10.0.0.9", 0, None)
+    devices = decode(snapshot.full())
+    assert [info.id for info in devices] == ["lamp_00", "lamp_01"]
+    assert devices[0].zone == "sul"
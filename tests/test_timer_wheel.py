@@ -0,0 +1,117 @@
+import random
+from types import SimpleNamespace
+from proto import smart_city_pb2
+from gateway import liveness
+from gateway.liveness import LivenessMonitor, MISSED_HEARTBEATS
+from gateway.registry import DeviceRegistry
+from gateway.timer_wheel import TimerWheel
+
+def expire_ticks(wheel, until):
+    '''{chave: tick em que venceu}, avançando um tick de cada vez até until.'''
+    expired = {}
+    while wheel.current < until:
+        for key in wheel.advance((wheel.current + 1) * wheel.tick):
+            expired[key] = wheel.current
+    return expired
+
+def test_timers_fire_on_their_tick_across_levels():
+    #níveis de 4 posições: 4, 16 e 64 ticks, com cascatas a cada volta do nível de baixo
+    wheel = TimerWheel(1, 0, bits=2, levels=3)
+    dues = {'l0': 3, 'l1': 9, 'l1_edge': 16, 'l2': 17, 'l2_far': 60}
+    for key, due in dues.items():
+        wheel.schedule(key, due)
+    assert {wheel._where[key][0] for key in dues} == {0, 1, 2}
+    assert expire_ticks(wheel, 70) == dues
+    assert len(wheel) == 0
+
+def test_randomized_against_expected_ticks():
+    rng = random.Random(7)
+    wheel = TimerWheel(0.25, 0, bits=3, levels=3)
+    expected = {}
+    for step in range(3000):
+        now = wheel.current
+        for _ in range(rng.randrange(3)):
+            key = rng.randrange(200)
+            due = now + rng.randrange(1, 700) #além do alcance de 512 ticks às vezes
+            wheel.schedule(key, due * 0.25)
+            expected[key] = due
+        if rng.random() < 0.1 and expected:
+            key = rng.choice(list(expected))
+            wheel.cancel(key)
+            del expected[key]
+        for key, tick in expire_ticks(wheel, now + rng.randrange(1, 4)).items():
+            assert expected.pop(key) == tick
+    assert len(wheel) == len(expected)
+
+def test_cancel_and_reschedule():
+    wheel = TimerWheel(1, 0)
+    wheel.schedule('a', 5)
+    wheel.schedule('b', 5)
+    wheel.cancel('a')
+    wheel.schedule('b', 100) #reagendar move a entrada, não duplica
+    assert 'a' not in wheel and len(wheel) == 1
+    assert wheel.advance(99) == []
+    assert wheel.advance(100) == ['b']
+
+def test_past_deadline_fires_on_next_tick():
+    wheel = TimerWheel(1, 10)
+    wheel.schedule('late', 3)
+    assert wheel.advance(11) == ['late']
+
+class FakeOutbox:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def monitor(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(liveness, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    registry = DeviceRegistry()
+    return clock, registry, LivenessMonitor(registry)
+
+def register(registry, device_id):
+    outbox = FakeOutbox()
+    registry.register(device_id, smart_city_pb2.DeviceType.LAMP, "OFF", "centro", "10.0.0.1", 0, outbox)
+    return outbox
+
+def test_silent_device_expires(monkeypatch):
+    clock, registry, monitor_ = monitor(monkeypatch)
+    outbox = register(registry, 'lamp_1')
+    timeout = liveness.DEFAULT_HEARTBEAT_INTERVAL_MS * MISSED_HEARTBEATS / 1000
+    clock.now += timeout - 1
+    assert monitor_.expire_due(clock.now) == 0
+    clock.now += 1.5
+    assert monitor_.expire_due(clock.now) == 1
+    assert 'lamp_1' not in registry and outbox.closed
+
+def test_touch_rearms_deadline(monkeypatch):
+    clock, registry, monitor_ = monitor(monkeypatch)
+    outbox = register(registry, 'lamp_1')
+    for _ in range(10):
+        clock.now += 10
+        monitor_.touch('lamp_1', 5000)
+        assert monitor_.expire_due(clock.now) == 0
+    assert 'lamp_1' in monitor_.wheel and not outbox.closed
+    clock.now += 5 * MISSED_HEARTBEATS + 1
+    assert monitor_.expire_due(clock.now) == 1
+
+def test_heartbeat_interval_changes_timeout(monkeypatch):
+    clock, registry, monitor_ = monitor(monkeypatch)
+    register(registry, 'lamp_1')
+    monitor_.touch('lamp_1', 20000)
+    #a entrada no wheel vence no prazo padrão, mas o prazo real foi adiado: é reagendada
+    clock.now += liveness.DEFAULT_HEARTBEAT_INTERVAL_MS * MISSED_HEARTBEATS / 1000 + 1
+    assert monitor_.expire_due(clock.now) == 0
+    assert 'lamp_1' in monitor_.wheel
+    clock.now += 20 * MISSED_HEARTBEATS
+    assert monitor_.expire_due(clock.now) == 1
+
+def test_removed_device_is_cancelled(monkeypatch):
+    clock, registry, monitor_ = monitor(monkeypatch)
+    register(registry, 'lamp_1')
+    registry.remove('lamp_1')
+    assert 'lamp_1' not in monitor_.wheel
+    clock.now += 3600
+    assert monitor_.expire_due(clock.now) == 0
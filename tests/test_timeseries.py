@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from gateway import timeseries
+from gateway.timeseries import HOUR_MS, MINUTE_MS, RAW_COLUMNS, Ring, TimeSeriesStore
+
+BASE = 1_700_000_000_000 // HOUR_MS * HOUR_MS #início de uma hora
+
+def ring(tmp_path, capacity):
+    r = Ring(str(tmp_path), 'raw', RAW_COLUMNS, capacity)
+    r.open(1)
+    return r
+
+def rows(times, values=None):
+    t = np.asarray(times, dtype=np.int64)
+    v = np.asarray(values if values is not None else times, dtype=np.float32)
+    return {'t': t, 'v': v}
+
+def test_ring_wraparound_keeps_last_rows_in_order(tmp_path):
+    r = ring(tmp_path, 5)
+    for start in range(0, 12, 3):
+        r.append(0, rows(range(start, start + 3)))
+    window = r.window(0, 0, 100)
+    assert window['t'].tolist() == [7, 8, 9, 10, 11]
+    assert r.window(0, 8, 10)['t'].tolist() == [8, 9, 10]
+
+def test_ring_batch_larger_than_capacity(tmp_path):
+    r = ring(tmp_path, 4)
+    r.append(0, rows(range(10)))
+    assert r.window(0, 0, 100)['t'].tolist() == [6, 7, 8, 9]
+
+def test_ring_drops_rows_older_than_last(tmp_path):
+    r = ring(tmp_path, 8)
+    r.append(0, rows([10, 20, 30]))
+    r.append(0, rows([5, 30, 25, 40])) #5 e 25 chegaram atrasados; 30 repetido vale
+    assert r.window(0, 0, 100)['t'].tolist() == [10, 20, 30, 30, 40]
+
+def store(tmp_path):
+    return TimeSeriesStore(str(tmp_path))
+
+def test_minute_rollup_bucket_math(tmp_path):
+    s = store(tmp_path)
+    readings = [(BASE + 1000, 20.0), (BASE + 59_999, 30.0), (BASE + MINUTE_MS, 10.0),
+                (BASE + MINUTE_MS + 500, 14.0), (BASE + 2 * MINUTE_MS, 50.0)]
+    s.append_readings([("s", t, v) for t, v in readings])
+    resolution, columns = s.query("s", BASE, BASE + HOUR_MS, 'minute')
+    assert resolution == 'minute'
+    assert columns['t'].tolist() == [BASE, BASE + MINUTE_MS, BASE + 2 * MINUTE_MS]
+    assert columns['count'].tolist() == [2, 2, 1] #o último é o minuto ainda aberto
+    assert columns['min'].tolist() == [20, 10, 50]
+    assert columns['max'].tolist() == [30, 14, 50]
+    assert columns['mean'].tolist() == pytest.approx([25, 12, 50])
+
+def test_hour_rollup_includes_open_minute(tmp_path):
+    s = store(tmp_path)
+    s.append_readings([("s", BASE + i * MINUTE_MS, float(i)) for i in range(61)])
+    resolution, columns = s.query("s", BASE, BASE + 2 * HOUR_MS, 'hour')
+    assert resolution == 'hour'
+    assert columns['t'].tolist() == [BASE, BASE + HOUR_MS]
+    assert columns['count'].tolist() == [60, 1]
+    assert columns['min'].tolist() == [0, 60] and columns['max'].tolist() == [59, 60]
+    assert columns['mean'][0] == pytest.approx(29.5)
+
+def test_late_reading_folds_into_open_bucket_and_leaves_raw(tmp_path):
+    s = store(tmp_path)
+    s.append_readings([("s", BASE + 1000, 20.0), ("s", BASE + MINUTE_MS + 1000, 22.0)])
+    s.append_readings([("s", BASE + 2000, 90.0)]) #do minuto já fechado
+    _, raw = s.query("s", BASE, BASE + HOUR_MS, 'raw')
+    assert raw['mean'].tolist() == [20, 22]
+    _, minutes = s.query("s", BASE, BASE + HOUR_MS, 'minute')
+    assert minutes['count'].tolist() == [1, 2] #somada ao minuto aberto, sem reabrir o fechado
+    assert minutes['max'].tolist() == [20, 90]
+
+def test_unsorted_batch_is_sorted(tmp_path):
+    s = store(tmp_path)
+    s.append_readings([("s", BASE + 3000, 3.0), ("s", BASE + 1000, 1.0), ("s", BASE + 2000, 2.0)])
+    _, raw = s.query("s", BASE, BASE + MINUTE_MS, 'raw')
+    assert raw['t'].tolist() == [BASE + 1000, BASE + 2000, BASE + 3000]
+
+def test_reopen_and_series_growth(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeseries, 'INITIAL_SERIES', 2)
+    s = store(tmp_path)
+    s.append_readings([(f"s{i}", BASE + 1000, float(i)) for i in range(5)])
+    assert s.series == 8
+    s.flush()
+    again = store(tmp_path)
+    for i in range(5):
+        _, raw = again.query(f"s{i}", BASE, BASE + MINUTE_MS, 'raw')
+        assert raw['mean'].tolist() == [i]
+
+def test_auto_resolution_and_unknown_sensor(tmp_path):
+    s = store(tmp_path)
+    assert s.query("nada", BASE, BASE + HOUR_MS)[0] == 'minute'
+    resolution, columns = s.query("nada", BASE, BASE + 24 * HOUR_MS)
+    assert resolution == 'hour' and len(columns['t']) == 0
+    with pytest.raises(ValueError):
+        s.query("nada", BASE, BASE + HOUR_MS, 'semana')
@@ -0,0 +1,138 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+try:
+    import orjson #opcional: serializa listas grandes várias vezes mais rápido que o json
+except ImportError:
+    orjson = None
+
+try:
+    import brotli #opcional: sem ele, só gzip é oferecido
+except ImportError:
+    brotli = None
+
+CACHE_TTL = 1.0 #segundos em que uma resposta é servida sem nenhuma consulta ao Gateway
+CACHE_MAX_ENTRIES = 64 #consultas diferentes guardadas; a usada há mais tempo sai primeiro
+COMPRESS_MIN_SIZE = 1024 #bytes; corpos menores vão sem compressão
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 #a partir daqui a brotli fica muito mais lenta para pouco ganho
+
+def encode_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def choose_encoding(accept_encoding):
+    '''Compressão a usar para o cabeçalho Accept-Encoding do cliente: "br", "gzip" ou None.'''
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(','):
+        name, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL)
+
+class CachedResponse:
+    '''
+    Corpo já serializado de uma resposta, com as versões dos nós que o produziram. As
+    versões comprimidas são feitas na primeira vez que alguém as pede e guardadas junto,
+    então cada versão da lista é comprimida uma vez, não uma vez por cliente.'''
+
+    __slots__ = ('versions', 'body', 'etag', 'checked_at', '_compressed')
+
+    def __init__(self, versions, body, etag, checked_at):
+        self.versions = versions
+        self.body = body
+        self.etag = etag
+        self.checked_at = checked_at
+        self._compressed = {} #codificação -> Future com o corpo comprimido
+
+    def encoding_for(self, encoding):
+        '''Compressão que de fato se aplica ao corpo: nenhuma abaixo de COMPRESS_MIN_SIZE.'''
+        return encoding if len(self.body) >= COMPRESS_MIN_SIZE else None
+
+    def etag_for(self, encoding):
+        #cada representação tem o seu ETag, como pede o HTTP para ETags fortes
+        if self.etag is None or encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    async def body_for(self, encoding):
+        if encoding is None:
+            return self.body
+        future = self._compressed.get(encoding)
+        if future is None:
+            #fora do event loop: comprimir alguns MB leva dezenas de milissegundos
+            future = self._compressed[encoding] = asyncio.get_running_loop().run_in_executor(
+                None, compress, self.body, encoding)
+        return await asyncio.shield(future)
+
+class ResponseCache:
+    '''
+    Cache de respostas do backend, validado pela versão do registro de cada nó:
+        - por CACHE_TTL segundos depois de buscada ou validada, a resposta é servida direto
+         do cache;
+        - passado o TTL, probe() consulta só as versões (um ping por nó): se nenhuma mudou,
+         o mesmo corpo continua valendo; senão fetch() busca e serializa a resposta de novo;
+        - requisições iguais que chegam enquanto a busca está em andamento esperam a mesma
+         tarefa (single-flight), então cem dashboards atualizando juntos custam uma consulta;
+        - o ETag é derivado da chave e das versões, e permite responder 304 a quem já tem
+         o corpo, sem enviá-lo de novo;
+        - respostas parciais (algum nó fora do ar, versions None) não ficam no cache.
+
+    probe devolve as versões (ou None); fetch devolve (versões ou None, corpo em bytes).'''
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    async def get(self, key, probe, fetch):
+        entry = self._entries.get(key)
+        if entry is not None and self._clock() - entry.checked_at < self.ttl:
+            self._entries.move_to_end(key)
+            return entry
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._refresh(key, entry, probe, fetch))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        #shield: um cliente que desiste não cancela a busca dos outros que a esperam
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key, entry, probe, fetch):
+        if entry is not None:
+            versions = await probe()
+            if versions == entry.versions:
+                entry.checked_at = self._clock()
+                return entry
+        versions, body = await fetch()
+        if versions is None:
+            return CachedResponse(None, body, None, self._clock())
+        digest = hashlib.blake2b(repr((key, versions)).encode('utf-8'), digest_size=12).hexdigest()
+        entry = CachedResponse(versions, body, f'"{digest}"', self._clock())
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+def etag_matches(if_none_match, etag):
+    '''Se o cabeçalho If-None-Match do cliente inclui o ETag (ou é "*").'''
+    if not if_none_match or etag is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,138 @@
+import asyncio
+import heapq
+from proto import smart_city_pb2
+from proto.cluster import HashRing
+from proto.metrics_text import merge_texts
+from web_client.backend.gateway_client import POOL_SIZE, REQUEST_TIMEOUT, GatewayError, GatewayPool
+
+class GatewayCluster:
+    '''
+    Acesso do backend a um ou mais nós do Gateway, cada um com seu GatewayPool:
+        - requisições de um dispositivo (comando, histórico) vão direto ao nó dono do id
+         no mesmo anel de hash usado pelos dispositivos;
+        - requisições sobre todos os dispositivos (listas, comandos em grupo, métricas)
+         são enviadas a todos os nós em paralelo (scatter) e as respostas são combinadas
+         por quem chamou. Um nó fora do ar não derruba a consulta: as respostas dos
+         demais voltam junto com o erro dele.
+    Com um único nó, o comportamento é o de um GatewayPool.'''
+
+    def __init__(self, nodes, size=POOL_SIZE):
+        self.nodes = list(nodes)
+        self.ring = HashRing(self.nodes)
+        self.pools = {node.name: GatewayPool(node.host or '127.0.0.1', node.tcp_port, size) for node in self.nodes}
+
+    async def start(self):
+        await asyncio.gather(*(pool.start() for pool in self.pools.values()))
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+
+    def owner(self, device_id):
+        return self.ring.owner(device_id).name
+
+    async def request(self, node_name, request_proto, timeout=REQUEST_TIMEOUT, pinned=False, raw=False):
+        return await self.pools[node_name].request(request_proto, timeout, pinned, raw)
+
+    async def request_owner(self, device_id, request_proto, timeout=REQUEST_TIMEOUT):
+        '''Envia a requisição ao nó dono de device_id.'''
+        return await self.request(self.owner(device_id), request_proto, timeout)
+
+    def split_by_owner(self, device_ids):
+        '''Agrupa ids por nó dono: {nó: [ids]}.'''
+        by_node = {}
+        for device_id in device_ids:
+            by_node.setdefault(self.owner(device_id), []).append(device_id)
+        return by_node
+
+    async def scatter(self, request_proto, timeout=REQUEST_TIMEOUT, pinned=False, raw=False):
+        '''Envia a mesma requisição a todos os nós; ver send_each.'''
+        return await self.send_each({name: request_proto for name in self.pools}, timeout, pinned, raw)
+
+    async def send_each(self, requests, timeout=REQUEST_TIMEOUT, pinned=False, raw=False):
+        '''
+        Envia a cada nó a sua requisição ({nó: ClientGatewayRequest}), em paralelo, e
+        devolve ({nó: resposta}, {nó: mensagem de erro}). Falha só se nenhum nó responder.
+        Com raw, cada resposta é (GatewayClientResponseHeader, bytes).'''
+        async def send(name, request_proto):
+            node_request = smart_city_pb2.ClientGatewayRequest()
+            node_request.CopyFrom(request_proto)
+            return await self.request(name, node_request, timeout, pinned, raw)
+
+        names = list(requests)
+        results = await asyncio.gather(*(send(name, requests[name]) for name in names), return_exceptions=True)
+        responses, errors = {}, {}
+        for name, result in zip(names, results):
+            if isinstance(result, GatewayError):
+                errors[name] = str(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                responses[name] = result
+        if names and not responses:
+            raise GatewayError("; ".join(f"{name}: {error}" for name, error in errors.items()))
+        return responses, errors
+
+def merge_device_lists(responses, page_size=0):
+    '''
+    Junta as listas de dispositivos de vários nós, cada uma já ordenada por id, numa só
+    lista ordenada. Com page_size, corta a página e calcula o próximo cursor: como o
+    cursor é o último id entregue, a mesma consulta com ele continua em todos os nós.
+    A versão combinada é a soma das versões dos nós, que cresce a cada mudança em qualquer um.'''
+    devices = list(heapq.merge(*(response.devices for response in responses.values()), key=lambda d: d.id))
+    next_cursor = ""
+    if page_size and (len(devices) > page_size or any(r.next_cursor for r in responses.values())):
+        devices = devices[:page_size]
+        next_cursor = devices[-1].id if devices else ""
+    version = sum(response.version for response in responses.values())
+    return devices, next_cursor, version
+
+def join_raw_lists(responses):
+    '''
+    Junta as respostas raw de list_devices ({nó: (cabeçalho, bytes)}) numa só
+    GatewayClientResponse serializada, sem decodificar nenhuma: mensagens protobuf
+    concatenadas são lidas como uma só, com os campos repetidos emendados. Os dispositivos
+    ficam agrupados por nó (cada grupo ordenado por id), e um trecho final com a soma das
+    versões substitui os campos escalares do último nó.'''
+    trailer = smart_city_pb2.GatewayClientResponse()
+    trailer.status.success = True
+    trailer.version = sum(header.version for header, _ in responses.values())
+    return b''.join(responses[name][1] for name in sorted(responses)) + trailer.SerializeToString()
+
+def node_versions(responses, errors):
+    '''
+    Versões dos nós que responderam, como (nó, worker, versão): iguais entre duas
+    consultas, nenhum dispositivo mudou. None se algum nó faltou.'''
+    if errors:
+        return None
+    return tuple(sorted((name, response.worker, response.version) for name, response in responses.items()))
+
+def merge_aggregates(responses):
+    '''
+    Soma os agregados de vários nós por (tipo, zona): contagens somadas, média ponderada
+    pelo número de leituras de cada nó, mínima das mínimas e máxima das máximas.'''
+    merged = {}
+    for response in responses.values():
+        for aggregate in response.aggregates:
+            key = (aggregate.type, aggregate.zone)
+            total = merged.get(key)
+            if total is None:
+                total = merged[key] = smart_city_pb2.GroupAggregate()
+                total.CopyFrom(aggregate)
+                continue
+            if aggregate.readings:
+                readings = total.readings + aggregate.readings
+                total.mean = (total.mean * total.readings + aggregate.mean * aggregate.readings) / readings
+                total.min = min(total.min, aggregate.min) if total.readings else aggregate.min
+                total.max = max(total.max, aggregate.max) if total.readings else aggregate.max
+                total.readings = readings
+            total.count += aggregate.count
+            total.pending += aggregate.pending
+            total.on += aggregate.on
+            total.off += aggregate.off
+    return [merged[key] for key in sorted(merged)]
+
+def merge_metrics(texts):
+    '''
+    Junta o texto de métricas de vários nós ({nó: texto}) num único documento
+    Prometheus válido, com o label node em cada amostra.'''
+    return merge_texts(texts, 'node')
@@ -0,0 +1,176 @@
+import asyncio
+import json
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, encode_message, read_frame
+
+RECONNECT_DELAY = 2.0 #segundos entre tentativas de reinscrição no Gateway
+KEEPALIVE_INTERVAL = 15.0 #segundos sem eventos até enviar um comentário SSE
+
+DEVICE_TYPE_NAMES = {value: name for name, value in smart_city_pb2.DeviceType.items()}
+
+def device_to_dict(device_info_proto):
+    '''
+    DeviceInfo em dict para o JSON dos clientes, montado campo a campo: o MessageToDict
+    percorre os descritores da mensagem a cada chamada e pesa em listas de milhares.'''
+    return {
+        "id": device_info_proto.id,
+        "type": DEVICE_TYPE_NAMES.get(device_info_proto.type, device_info_proto.type),
+        "status": device_info_proto.status,
+        "zone": device_info_proto.zone,
+        "pending_reconnect": device_info_proto.pending_reconnect,
+    }
+
+def devices_to_columns(device_protos):
+    '''Lista de DeviceInfo em colunas paralelas: o i-ésimo dispositivo é a posição i de cada uma.'''
+    return {
+        "ids": [device.id for device in device_protos],
+        "types": [DEVICE_TYPE_NAMES.get(device.type, device.type) for device in device_protos],
+        "statuses": [device.status for device in device_protos],
+        "zones": [device.zone for device in device_protos],
+        "pending_reconnect": [device.pending_reconnect for device in device_protos],
+    }
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class DashboardClient:
+    '''
+    Um navegador conectado no stream de dispositivos.
+
+    Assim como no Gateway, as mudanças são agregadas por dispositivo em pending (None
+    indica remoção): um navegador lento recebe apenas o estado mais recente de cada
+    dispositivo no próximo envio, sem acumular uma fila de eventos.'''
+
+    def __init__(self):
+        self.pending = {}
+        self.resync = True #próximo envio deve ser a lista completa
+        self.wakeup = asyncio.Event()
+        self.wakeup.set()
+
+    def push(self, device_id, device_dict):
+        self.pending[device_id] = device_dict
+        self.wakeup.set()
+
+    def request_resync(self):
+        self.pending.clear()
+        self.resync = True
+        self.wakeup.set()
+
+class DeviceStream:
+    '''
+    Mantém uma única inscrição (subscribe) em cada nó do Gateway e repassa as mudanças
+    para todos os dashboards conectados:
+        - _devices guarda, por nó, um espelho local dos seus dispositivos, usado para
+         enviar a lista completa a quem acabou de conectar sem consultar o Gateway;
+        - se a conexão com um nó cair, só o espelho daquele nó é esvaziado, uma vez, e a
+         inscrição é refeita até dar certo; ao voltar, todos os clientes recebem a lista
+         completa de novo.'''
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self._devices = {node.name: {} for node in self.nodes}
+        self.clients = set()
+        self._tasks = []
+
+    @property
+    def devices(self):
+        merged = {}
+        for node_devices in self._devices.values():
+            merged.update(node_devices)
+        return merged
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._run(node)) for node in self.nodes]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, node):
+        while True:
+            try:
+                await self._subscribe(node)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            #só na perda de uma inscrição que funcionava: tentativas seguintes que falham
+            #não mandam os dashboards refazer a lista a cada RECONNECT_DELAY
+            if self._devices[node.name]:
+                self._replace_devices(node, [])
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _subscribe(self, node):
+        reader, writer = await asyncio.open_connection(node.host or '127.0.0.1', node.tcp_port)
+        try:
+            request_proto = smart_city_pb2.ClientGatewayRequest()
+            request_proto.subscribe = "DEVICES"
+            request_proto.request_id = 1
+            writer.write(encode_message(request_proto))
+            await writer.drain()
+
+            decoder = FrameDecoder()
+            first = True
+            while True:
+                data = await read_frame(reader, decoder)
+                if data is None:
+                    return
+                response_proto = smart_city_pb2.GatewayClientResponse()
+                response_proto.ParseFromString(data)
+                if first:
+                    self._replace_devices(node, response_proto.devices)
+                    first = False
+                else:
+                    self._apply_events(node, response_proto.events)
+        finally:
+            writer.close()
+
+    def _replace_devices(self, node, device_protos):
+        self._devices[node.name] = {device.id: device_to_dict(device) for device in device_protos}
+        for client in self.clients:
+            client.request_resync()
+
+    def _apply_events(self, node, events):
+        node_devices = self._devices[node.name]
+        for event in events:
+            device_id = event.device.id
+            if event.kind == smart_city_pb2.DeviceEvent.REMOVED:
+                node_devices.pop(device_id, None)
+                #um dispositivo que mudou de nó pode já estar registrado em outro
+                device_dict = next((d[device_id] for d in self._devices.values() if device_id in d), None)
+            else:
+                device_dict = device_to_dict(event.device)
+                node_devices[device_id] = device_dict
+            for client in self.clients:
+                client.push(device_id, device_dict)
+
+    async def events(self):
+        '''Gerador de eventos Server-Sent Events para um navegador: "snapshot" com a lista
+        completa e depois "delta" com {"updated": [...], "removed": [...]}.'''
+        client = DashboardClient()
+        self.clients.add(client)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(client.wakeup.wait(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                client.wakeup.clear()
+
+                if client.resync:
+                    client.resync = False
+                    client.pending.clear()
+                    yield sse_event("snapshot", {"devices": list(self.devices.values())})
+                    continue
+
+                pending, client.pending = client.pending, {}
+                if pending:
+                    yield sse_event("delta", {
+                        "updated": [d for d in pending.values() if d is not None],
+                        "removed": [device_id for device_id, d in pending.items() if d is None],
+                    })
+        finally:
+            self.clients.discard(client)
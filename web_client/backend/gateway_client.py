@@ -0,0 +1,188 @@
+import asyncio
+from proto import smart_city_pb2
+from proto.framing import FrameDecoder, encode_message, read_frame
+
+POOL_SIZE = 4 #conexões mantidas abertas com o Gateway
+REQUEST_TIMEOUT = 5.0 #segundos esperando a resposta de uma requisição
+CONNECT_TIMEOUT = 3.0
+HEALTH_CHECK_INTERVAL = 10.0 #segundos entre pings de verificação
+
+class GatewayError(Exception):
+    '''Falha de comunicação com o Gateway (conexão recusada, caída ou sem resposta).'''
+
+class GatewayConnection:
+    '''
+    Uma conexão TCP de longa duração com o Gateway, multiplexada:
+        - cada requisição recebe um request_id e uma Future pendente;
+        - uma única tarefa de leitura (_read_loop) recebe as respostas, na ordem em que
+         chegarem, e resolve a Future com o mesmo request_id. Cada resposta é lida primeiro
+         como GatewayClientResponseHeader, sem decodificar a lista de dispositivos: as
+         requisições raw recebem (cabeçalho, bytes) e as demais a mensagem completa;
+        - se a conexão cair, todas as requisições pendentes falham com GatewayError.'''
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._last_id = 0
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        decoder = FrameDecoder()
+        error = GatewayError("Conexão com o Gateway encerrada.")
+        try:
+            while True:
+                data = await read_frame(self._reader, decoder)
+                if data is None:
+                    break
+                header = smart_city_pb2.GatewayClientResponseHeader()
+                header.ParseFromString(data)
+                future, raw = self._pending.pop(header.request_id, (None, False))
+                if future is None or future.done():
+                    continue
+                if raw:
+                    future.set_result((header, data))
+                else:
+                    response_proto = smart_city_pb2.GatewayClientResponse()
+                    response_proto.ParseFromString(data)
+                    future.set_result(response_proto)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = GatewayError(f"Conexão com o Gateway perdida: {e}")
+        finally:
+            self._fail_pending(error)
+            self._writer.close()
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, request_proto, timeout=REQUEST_TIMEOUT, raw=False):
+        if not self.connected:
+            raise GatewayError("Conexão com o Gateway fechada.")
+
+        self._last_id = self._last_id % 0xFFFFFFFF + 1
+        request_id = self._last_id
+        request_proto.request_id = request_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, raw)
+        try:
+            self._writer.write(encode_message(request_proto))
+            await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise GatewayError("Tempo de resposta do Gateway esgotado.")
+        except (ConnectionError, OSError) as e:
+            raise GatewayError(f"Falha ao enviar para o Gateway: {e}")
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+            self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+
+class GatewayPool:
+    '''
+    Pool de conexões persistentes com o Gateway usado pelo backend:
+        - mantém POOL_SIZE conexões abertas, e cada requisição vai para a conexão
+         conectada com menos requisições em andamento;
+        - uma tarefa de verificação envia ping periodicamente e reconecta as conexões
+         que caíram ou pararam de responder;
+        - se nenhuma conexão estiver disponível, tenta reconectar na hora antes de falhar;
+        - requisições pinned vão sempre para a primeira conexão conectada, para que
+         respostas comparadas entre si (a versão do registro) venham do mesmo worker.'''
+
+    def __init__(self, host, port, size=POOL_SIZE):
+        self.host = host
+        self.port = port
+        self._connections = [GatewayConnection(host, port) for _ in range(size)]
+        self._health_task = None
+        self._reconnect_lock = asyncio.Lock()
+
+    async def start(self):
+        '''
+        Abre as conexões em segundo plano: o backend atende HTTP sem esperar o Gateway, e
+        uma requisição que chegue antes disso conecta na hora (request).'''
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        for conn in self._connections:
+            await conn.close()
+
+    async def _reconnect(self, conn):
+        await conn.close()
+        try:
+            await conn.connect()
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def _reconnect_dead(self):
+        async with self._reconnect_lock:
+            dead = [conn for conn in self._connections if not conn.connected]
+            await asyncio.gather(*(self._reconnect(conn) for conn in dead))
+
+    async def _check(self, conn):
+        request_proto = smart_city_pb2.ClientGatewayRequest()
+        request_proto.ping = "PING"
+        try:
+            await conn.request(request_proto)
+        except GatewayError:
+            await self._reconnect(conn)
+
+    async def _health_loop(self):
+        await self._reconnect_dead()
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            await self._reconnect_dead()
+            await asyncio.gather(*(self._check(conn) for conn in self._connections if conn.connected))
+
+    def _pick(self, pinned=False):
+        connected = [conn for conn in self._connections if conn.connected]
+        if not connected:
+            return None
+        if pinned:
+            return connected[0]
+        return min(connected, key=lambda conn: conn.in_flight)
+
+    async def request(self, request_proto, timeout=REQUEST_TIMEOUT, pinned=False, raw=False):
+        '''
+        Envia uma ClientGatewayRequest e devolve a GatewayClientResponse correspondente
+        ou, com raw, (GatewayClientResponseHeader, bytes da resposta).'''
+        conn = self._pick(pinned)
+        if conn is None:
+            await self._reconnect_dead()
+            conn = self._pick(pinned)
+            if conn is None:
+                raise GatewayError(f"Gateway indisponível em {self.host}:{self.port}.")
+        return await conn.request(request_proto, timeout, raw)
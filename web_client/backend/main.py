@@ -1,10 +1,45 @@
-from fastapi import FastAPI, HTTPException
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-import socket
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from proto import smart_city_pb2
-from google.protobuf.json_format import MessageToDict
+from proto.cluster import Node, parse_nodes
+from web_client.backend.cache import ResponseCache, choose_encoding, encode_json, etag_matches
+from web_client.backend.cluster import (GatewayCluster, join_raw_lists, merge_aggregates, merge_device_lists,
+                                        merge_metrics, node_versions)
+from web_client.backend.device_stream import DeviceStream, device_to_dict, devices_to_columns
+from web_client.backend.gateway_client import GatewayError
 
-app = FastAPI()
+GATEWAY_IP = '127.0.0.1'
+GATEWAY_TCP_PORT = 10000
+
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+#formatos de /api/devices: JSON com um objeto por dispositivo, JSON em colunas ou a
+#GatewayClientResponse do Gateway em protobuf
+DEVICE_FORMATS = {"json": "application/json", "columnar": "application/json", "protobuf": PROTOBUF_MEDIA_TYPE}
+
+#nós do Gateway, ex.: "node0=127.0.0.1:10000:10001,node1=127.0.0.1:10010:10011"
+#(o gateway.cluster imprime esse valor); sem a variável, um único Gateway local
+GATEWAY_NODES = parse_nodes(os.environ.get('GATEWAY_NODES', '')) or \
+    [Node("gateway", GATEWAY_IP, GATEWAY_TCP_PORT, GATEWAY_TCP_PORT + 1)]
+
+#conexões persistentes com cada nó do Gateway, abertas na inicialização do app
+gateway_cluster = GatewayCluster(GATEWAY_NODES)
+#inscrição nas mudanças de estado, repassadas aos dashboards via SSE
+device_stream = DeviceStream(GATEWAY_NODES)
+#listas de dispositivos já serializadas, válidas enquanto a versão dos nós não muda
+devices_cache = ResponseCache()
+
+@asynccontextmanager
+async def lifespan(app):
+    await gateway_cluster.start()
+    await device_stream.start()
+    yield
+    await device_stream.close()
+    await gateway_cluster.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,47 +47,283 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-GATEWAY_IP = '127.0.0.1'
-GATEWAY_TCP_PORT = 10000
+def device_format(format, accept):
+    '''Formato pedido em ?format= ou, sem ele, protobuf se o Accept pedir.'''
+    if format:
+        if format not in DEVICE_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Formato inválido: {format}")
+        return format
+    return "protobuf" if PROTOBUF_MEDIA_TYPE in accept else "json"
+
+async def fetch_device_list(request_proto, format, page_size):
+    '''
+    Busca a lista nos nós e a serializa no formato pedido; devolve (versões, corpo).
+    Em protobuf, as respostas dos nós são repassadas sem decodificar, exceto quando é
+    preciso cortar uma página com vários nós.'''
+    if format == "protobuf" and (not page_size or len(gateway_cluster.nodes) == 1):
+        responses, errors = await gateway_cluster.scatter(request_proto, pinned=True, raw=True)
+        body = join_raw_lists(responses)
+        if errors:
+            #resposta parcial: o aviso vai no status do trecho final, que vale para a mensagem toda
+            trailer = smart_city_pb2.GatewayClientResponse()
+            trailer.status.success = True
+            trailer.status.message = "Nós indisponíveis: " + ", ".join(sorted(errors))
+            body += trailer.SerializeToString()
+        return node_versions({name: header for name, (header, _) in responses.items()}, errors), body
+
+    #pinned: a versão da lista e a do probe seguinte vêm da mesma conexão (o mesmo worker)
+    responses, errors = await gateway_cluster.scatter(request_proto, pinned=True)
+    device_protos, next_cursor, version = merge_device_lists(responses, page_size)
+    if format == "protobuf":
+        response_proto = smart_city_pb2.GatewayClientResponse(next_cursor=next_cursor, version=version)
+        response_proto.devices.extend(device_protos)
+        response_proto.status.success = True
+        if errors:
+            response_proto.status.message = "Nós indisponíveis: " + ", ".join(sorted(errors))
+        return node_versions(responses, errors), response_proto.SerializeToString()
+
+    if format == "columnar":
+        result = devices_to_columns(device_protos)
+    else:
+        result = {"devices": [device_to_dict(device) for device in device_protos]}
+    result.update(next_cursor=next_cursor, version=version)
+    if errors:
+        #resposta parcial: os dispositivos desses nós ficaram de fora
+        result["unavailable_nodes"] = sorted(errors)
+    return node_versions(responses, errors), encode_json(result)
 
 @app.get("/api/devices")
-async def get_devices():
+async def get_devices(type: str = "", id_prefix: str = "", status: str = "", page_size: int = 0, cursor: str = "",
+                      format: str = "", accept: str = Header(""), accept_encoding: str = Header(""),
+                      if_none_match: str = Header("")):
+    '''
+    Lista de dispositivos, servida do devices_cache enquanto nenhum nó mudou:
+        - format=json (padrão), columnar (colunas paralelas: ids, types, statuses...) ou
+         protobuf (também com Accept: application/x-protobuf), a GatewayClientResponse
+         como o Gateway a enviou;
+        - comprimida com brotli ou gzip, conforme o Accept-Encoding, uma vez por versão;
+        - o ETag acompanha a versão dos nós, e quem envia If-None-Match com ele recebe 304.'''
+    format = device_format(format, accept)
     request_proto = smart_city_pb2.ClientGatewayRequest()
-    request_proto.list_devices = "LIST"
-    
+    if type or id_prefix or status or page_size or cursor:
+        query = request_proto.query_devices
+        if type:
+            if type not in smart_city_pb2.DeviceType.keys():
+                raise HTTPException(status_code=400, detail=f"Tipo de dispositivo inválido: {type}")
+            query.type = smart_city_pb2.DeviceType.Value(type)
+        query.id_prefix = id_prefix
+        query.status = status
+        query.page_size = page_size
+        query.cursor = cursor
+    else:
+        request_proto.list_devices = "LIST"
+
+    async def probe():
+        ping_proto = smart_city_pb2.ClientGatewayRequest()
+        ping_proto.ping = "VERSION"
+        try:
+            responses, errors = await gateway_cluster.scatter(ping_proto, pinned=True)
+        except GatewayError:
+            return None
+        return node_versions(responses, errors)
+
+    async def fetch():
+        return await fetch_device_list(request_proto, format, page_size)
+
+    try:
+        cached = await devices_cache.get((format, type, id_prefix, status, page_size, cursor), probe, fetch)
+    except GatewayError as e:
+        raise HTTPException(status_code=500, detail=f"Erro de comunicação com o Gateway: {e}")
+
+    encoding = cached.encoding_for(choose_encoding(accept_encoding))
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    etag = cached.etag_for(encoding)
+    if etag is not None:
+        headers["ETag"] = etag
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(await cached.body_for(encoding), media_type=DEVICE_FORMATS[format], headers=headers)
+
+def aggregate_to_dict(aggregate):
+    result = {
+        "type": smart_city_pb2.DeviceType.Name(aggregate.type),
+        "zone": aggregate.zone,
+        "count": aggregate.count,
+        "pending": aggregate.pending,
+    }
+    if aggregate.type == smart_city_pb2.DeviceType.LAMP:
+        result.update(on=aggregate.on, off=aggregate.off)
+    elif aggregate.type == smart_city_pb2.DeviceType.TEMP_SENSOR:
+        result["readings"] = aggregate.readings
+        if aggregate.readings:
+            result.update(mean=round(aggregate.mean, 2), min=aggregate.min, max=aggregate.max)
+    return result
+
+@app.get("/api/aggregates")
+async def get_aggregates(type: str = "", zone: str = ""):
+    '''
+    Contagens e leituras por tipo de dispositivo, mantidas pelo Gateway: sem zone, o
+    total de cada tipo; zone=* para uma entrada por zona, ou o nome de uma zona.'''
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.aggregates.SetInParent()
+    if type:
+        if type not in smart_city_pb2.DeviceType.keys():
+            raise HTTPException(status_code=400, detail=f"Tipo de dispositivo inválido: {type}")
+        request_proto.aggregates.type = smart_city_pb2.DeviceType.Value(type)
+    request_proto.aggregates.zone = zone
+
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((GATEWAY_IP, GATEWAY_TCP_PORT))
-            s.sendall(request_proto.SerializeToString())
-            
-            response_bytes = s.recv(4096)
-            if not response_bytes:
-                return {"devices": []}
-            
-            response_proto = smart_city_pb2.GatewayClientResponse()
-            response_proto.ParseFromString(response_bytes)
-            
-            response_dict = MessageToDict(response_proto, preserving_proto_field_name=True)
-            return response_dict
-
-    except Exception as e:
+        responses, errors = await gateway_cluster.scatter(request_proto)
+    except GatewayError as e:
         raise HTTPException(status_code=500, detail=f"Erro de comunicação com o Gateway: {e}")
 
+    result = {
+        "aggregates": [aggregate_to_dict(aggregate) for aggregate in merge_aggregates(responses)],
+        "version": sum(response.version for response in responses.values()),
+    }
+    if errors:
+        result["unavailable_nodes"] = sorted(errors)
+    return result
+
+@app.get("/api/devices/stream")
+async def stream_devices():
+    return StreamingResponse(
+        device_stream.events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/devices/{deviceId}/history")
+async def get_device_history(deviceId: str, from_ms: int = Query(0, alias="from"), to_ms: int = Query(0, alias="to"), resolution: str = "auto"):
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.history.device_id = deviceId
+    request_proto.history.from_ms = from_ms
+    request_proto.history.to_ms = to_ms
+    request_proto.history.resolution = resolution
+
+    try:
+        response_proto = await gateway_cluster.request_owner(deviceId, request_proto)
+    except GatewayError as e:
+        raise HTTPException(status_code=500, detail=f"Erro de comunicação com o Gateway: {e}")
+
+    if not response_proto.status.success:
+        raise HTTPException(status_code=400, detail=response_proto.status.message)
+    history = response_proto.history
+    return {
+        "device_id": history.device_id,
+        "resolution": history.resolution,
+        "timestamps": list(history.timestamps_ms),
+        "min": list(history.min),
+        "max": list(history.max),
+        "mean": list(history.mean),
+        "count": list(history.count),
+    }
+
+@app.get("/metrics")
+async def get_gateway_metrics():
+    '''Métricas do Gateway no formato do Prometheus, obtidas pela conexão com o Gateway.'''
+    request_proto = smart_city_pb2.ClientGatewayRequest()
+    request_proto.metrics = "METRICS"
+
+    try:
+        responses, _ = await gateway_cluster.scatter(request_proto)
+    except GatewayError as e:
+        raise HTTPException(status_code=500, detail=f"Erro de comunicação com o Gateway: {e}")
+
+    text = merge_metrics({name: response.metrics_text for name, response in responses.items()})
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+#status HTTP para cada resultado de comando que não foi confirmado
+COMMAND_ERROR_STATUS = {
+    smart_city_pb2.CommandResult.NOT_CONNECTED: 404,
+    smart_city_pb2.CommandResult.TIMEOUT: 504,
+    smart_city_pb2.CommandResult.QUEUE_FULL: 503,
+}
+
+def command_result_to_dict(result):
+    return {
+        "device_id": result.device_id,
+        "outcome": smart_city_pb2.CommandResult.Outcome.Name(result.outcome),
+        "status": result.status,
+        "message": result.message,
+    }
+
+def command_timeout(timeout_ms):
+    #o backend espera um pouco mais que o Gateway, que responde com TIMEOUT por dispositivo
+    return (timeout_ms or 2000) / 1000 + 1
+
 @app.post("/api/devices/{deviceId}/command")
 async def send_device_command(deviceId: str, command_req: dict):
     action = command_req.get("action")
-    
+    if not action or not isinstance(action, str):
+        raise HTTPException(status_code=400, detail="O campo 'action' é obrigatório e deve ser texto.")
+    try:
+        timeout_ms = int(command_req.get("timeout_ms", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="O campo 'timeout_ms' deve ser um número inteiro.")
+
     request_proto = smart_city_pb2.ClientGatewayRequest()
     request_proto.command_device.device_id = deviceId
     request_proto.command_device.action = action
+    request_proto.command_device.timeout_ms = timeout_ms
 
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((GATEWAY_IP, GATEWAY_TCP_PORT))
-            s.sendall(request_proto.SerializeToString())
-            s.recv(1024) 
-            return {"status": "success", "message": "Comando enviado."}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro na comunicação com o Gateway: {e}")
\ No newline at end of file
+        response_proto = await gateway_cluster.request_owner(deviceId, request_proto, command_timeout(timeout_ms))
+    except GatewayError as e:
+        raise HTTPException(status_code=500, detail=f"Erro na comunicação com o Gateway: {e}")
+
+    if not response_proto.command_results:
+        #o Gateway (ou o worker com o dispositivo) falhou antes de enviar o comando
+        raise HTTPException(status_code=502, detail=response_proto.status.message or
+                            f"O Gateway não devolveu resultado para o comando a {deviceId}.")
+    result = response_proto.command_results[0]
+    if result.outcome != smart_city_pb2.CommandResult.ACKED:
+        raise HTTPException(status_code=COMMAND_ERROR_STATUS[result.outcome], detail=result.message)
+    return {"status": "success", "message": "Comando confirmado.", "device_status": result.status}
+
+@app.post("/api/commands/bulk")
+async def send_bulk_command(command_req: dict):
+    '''Envia um comando a um grupo: {"action", "device_ids"} ou filtros "type", "zone", "id_prefix".'''
+    bulk = smart_city_pb2.ClientGatewayRequest()
+    bulk.bulk_command.action = command_req.get("action", "")
+    device_type = command_req.get("type")
+    if device_type:
+        if device_type not in smart_city_pb2.DeviceType.keys():
+            raise HTTPException(status_code=400, detail=f"Tipo de dispositivo inválido: {device_type}")
+        bulk.bulk_command.type = smart_city_pb2.DeviceType.Value(device_type)
+    bulk.bulk_command.zone = command_req.get("zone", "")
+    bulk.bulk_command.id_prefix = command_req.get("id_prefix", "")
+    bulk.bulk_command.device_ids.extend(command_req.get("device_ids", []))
+    bulk.bulk_command.timeout_ms = int(command_req.get("timeout_ms", 0))
+
+    #ids explícitos vão só para os seus donos; filtros vão para todos os nós
+    if bulk.bulk_command.device_ids:
+        requests = {}
+        for node_name, device_ids in gateway_cluster.split_by_owner(bulk.bulk_command.device_ids).items():
+            node_bulk = smart_city_pb2.ClientGatewayRequest()
+            node_bulk.CopyFrom(bulk)
+            del node_bulk.bulk_command.device_ids[:]
+            node_bulk.bulk_command.device_ids.extend(device_ids)
+            requests[node_name] = node_bulk
+    else:
+        requests = {name: bulk for name in gateway_cluster.pools}
+
+    try:
+        responses, errors = await gateway_cluster.send_each(requests, command_timeout(bulk.bulk_command.timeout_ms))
+    except GatewayError as e:
+        raise HTTPException(status_code=500, detail=f"Erro na comunicação com o Gateway: {e}")
+
+    results = [result for response in responses.values() for result in response.command_results]
+    failed = [result for result in results if result.outcome != smart_city_pb2.CommandResult.ACKED]
+    messages = [f"{len(failed)} de {len(results)} dispositivos não confirmaram o comando."] if failed else []
+    messages += [f"Nó {name} indisponível: {error}" for name, error in sorted(errors.items())]
+    return {
+        "success": not failed and not errors,
+        "message": " ".join(messages),
+        "results": [command_result_to_dict(result) for result in results],
+    }